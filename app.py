@@ -1,11 +1,20 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
 import json
-import pandas as pd
-import pymysql
+import hashlib
+import threading
 from dotenv import load_dotenv
 import os
 import logging
-from functools import lru_cache
+from storage import open_storage
+from data_version import DataVersionTracker
+from result_cache import ResultCache, DiskCacheBackend, CompressedPayload, ENCODINGS, make_cache_key
+from geometry_lod import lod_for_zoom, FULL_RESOLUTION_LOD
+from buckets import INCOME_BUCKETS, POPULATION_BUCKETS, bucket_labels, read_label_artifact, sort_labels
+from text_search import search_terms
+
+# Modules that pull in NumPy, shapely or mapbox_vector_tile (vector_tiles,
+# geometry_codec, snapshot) are imported where they are first needed, so
+# workers start without them and the home page never loads them
 
 # Load environment variables
 load_dotenv()
@@ -16,54 +25,199 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-def get_mysql_connection():
-    return pymysql.connect(
-        host=os.getenv('MYSQL_HOST'),
-        user=os.getenv('MYSQL_USER'),
-        password=os.getenv('MYSQL_PASSWORD'),
-        database=os.getenv('MYSQL_DATABASE'),
-        cursorclass=pymysql.cursors.DictCursor
-    )
+# MySQL by default; STORAGE_BACKEND=sqlite serves straight from education_demographics.db
+storage = open_storage()
 
-@lru_cache(maxsize=1)
-def get_buckets():
-    """Get income and population buckets with caching"""
+# Rendered vector tiles, filled lazily or ahead of time with vector_tiles.py;
+# opened on the first tile request
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+def get_tile_cache():
+    global _tile_cache
+    with _tile_cache_lock:
+        if _tile_cache is None:
+            from vector_tiles import TileCache
+            _tile_cache = TileCache(os.getenv('TILE_CACHE_PATH', 'zip_boundaries.mbtiles'))
+        return _tile_cache
+
+def get_db_cursor(streaming=False):
+    """Context manager yielding a dict cursor on the configured storage backend"""
+    return storage.cursor(streaming)
+
+def read_data_version():
+    """Version stamp written by the setup scripts whenever the data is rebuilt"""
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT version FROM data_version WHERE id = 1")
+        row = cursor.fetchone()
+    return row['version'] if row else None
+
+data_version = DataVersionTracker(
+    read_data_version,
+    check_interval=float(os.getenv('DATA_VERSION_CHECK_INTERVAL', '30'))
+)
+
+# Serialized API results, shared across workers when RESULT_CACHE_PATH is set
+result_cache = ResultCache(
+    max_entries=int(os.getenv('RESULT_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('RESULT_CACHE_TTL', '300')),
+    disk_backend=DiskCacheBackend(os.getenv('RESULT_CACHE_PATH')) if os.getenv('RESULT_CACHE_PATH') else None
+)
+
+# Browsers may keep responses requested with the current ?v= data version forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Anything else is revalidated with If-None-Match on every use
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+def load_snapshot(version):
+    """Read college_context and the demographics summary into a DataSnapshot"""
+    from snapshot import DataSnapshot
+    with get_db_cursor() as cursor:
+        cursor.execute(f"SELECT {COLLEGE_CONTEXT_COLUMNS} FROM college_context ORDER BY id")
+        colleges = cursor.fetchall()
+    return DataSnapshot(version, colleges, query_demographics())
+
+# DATA_SNAPSHOT=1 answers college and demographics queries from memory,
+# reloaded whenever the data version changes
+if os.getenv('DATA_SNAPSHOT') == '1':
+    from snapshot import SnapshotManager
+    data_snapshot = SnapshotManager(load_snapshot, data_version.get)
+else:
+    data_snapshot = None
+
+def payload_response(payload, etag, version, mimetype):
+    """Serve a pre-compressed payload with a strong ETag, answering 304 when the client has it"""
+    body, encoding = payload.negotiate(request.accept_encodings)
+    # Each stored encoding is a different byte sequence, so it gets its own strong tag
+    variant_etag = f"{etag}-{encoding}" if encoding else etag
+    cache_control = IMMUTABLE_CACHE_CONTROL if request.args.get('v') == version else REVALIDATE_CACHE_CONTROL
+    
+    known_tags = request.if_none_match.as_set()
+    if {etag, f"{etag}-gzip", f"{etag}-br"} & known_tags:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(variant_etag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def cached_payload(key, version, compute_body):
+    """Cached payload for a key, holding the encodings this client accepts
+
+    Requests compress only the encoding their client will get, at a fast
+    level, and add it to the cached entry; the warm-cache command stores
+    every encoding at the best level ahead of time
+    """
+    best = app.config.get('PRECOMPRESS_BEST', False)
+    # Only the most compact encoding the client accepts is ever sent to it
+    accepted = [encoding for encoding in ENCODINGS if request.accept_encodings[encoding]]
+    encodings = ENCODINGS if best else accepted[:1]
+    payload = result_cache.get(key, version)
+    if payload is None:
+        payload = CompressedPayload.from_body(compute_body(), encodings, best)
+        result_cache.set(key, version, payload)
+    elif best or payload.missing(encodings):
+        payload = payload.with_encodings(encodings, best)
+        result_cache.set(key, version, payload)
+    return payload
+
+def cached_json(namespace, compute):
+    """JSON response for the current request's parameters, computed at most once per data version"""
+    key = make_cache_key(namespace, request.args)
+    version = data_version.get()
+    payload = cached_payload(key, version, lambda: app.json.dumps(compute()))
+    etag = f"{version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+    return payload_response(payload, etag, version, 'application/json')
+
+def wants_packed_geometry():
+    """Whether the client asked for packed binary geometry instead of GeoJSON text"""
+    from geometry_codec import PACKED_GEOMETRY_MIMETYPE
+    best = request.accept_mimetypes.best_match(['application/json', PACKED_GEOMETRY_MIMETYPE])
+    return best == PACKED_GEOMETRY_MIMETYPE
+
+def geometry_columns(table_alias, packed):
+    """Select the packed geometry, falling back to GeoJSON text only for rows without one"""
+    if not packed:
+        return f"{table_alias}.geometry"
+    return f"""{table_alias}.geometry_packed,
+        CASE WHEN {table_alias}.geometry_packed IS NULL THEN {table_alias}.geometry END AS geometry"""
+
+def pack_rows(rows):
+    """Packed collection of geometry rows; every other column becomes a feature property"""
+    import shapely
+    from geometry_codec import pack_collection, pack_geometries
+    blobs = [row['geometry_packed'] for row in rows]
+    missing = [i for i, blob in enumerate(blobs) if blob is None]
+    if missing:
+        # Rows built before packed columns existed are packed on the fly
+        geometries = shapely.from_geojson([rows[i]['geometry'] for i in missing], on_invalid='ignore')
+        for i, blob in zip(missing, pack_geometries(geometries)):
+            blobs[i] = blob
+    properties = [
+        {name: value for name, value in row.items() if name not in ('geometry', 'geometry_packed')}
+        for row in rows
+    ]
+    return pack_collection([bytes(blob) for blob in blobs], properties)
+
+def cached_geometry(namespace, load_rows):
+    """Geometry rows as JSON or, when the Accept header asks for it, one packed binary collection"""
+    packed = wants_packed_geometry()
+    if packed:
+        from geometry_codec import PACKED_GEOMETRY_MIMETYPE
+        key = make_cache_key(f"{namespace}:packed", request.args)
+        version = data_version.get()
+        payload = cached_payload(key, version, lambda: pack_rows(load_rows(True)))
+        etag = f"{version}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+        response = payload_response(payload, etag, version, PACKED_GEOMETRY_MIMETYPE)
+    else:
+        response = cached_json(namespace, lambda: load_rows(False))
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    return response
+
+def load_buckets():
+    """Get income and population buckets from the setup scripts' label file, or the database without one"""
+    labels = read_label_artifact(data_version.get())
+    if labels is not None:
+        return labels
+    
     logger.info("Loading buckets...")
-    try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
-        
+    # Listed in the order defined in buckets.py rather than alphabetically
+    with get_db_cursor() as cursor:
         # Get income buckets
         cursor.execute("""
             SELECT DISTINCT income_bucket 
             FROM zip_demographics 
-            WHERE income_bucket IS NOT NULL 
-            ORDER BY income_bucket
+            WHERE income_bucket IS NOT NULL
         """)
-        income_buckets = [row['income_bucket'] for row in cursor.fetchall()]
+        income_buckets = sort_labels([row['income_bucket'] for row in cursor.fetchall()], INCOME_BUCKETS)
         
         # Get population buckets
         cursor.execute("""
             SELECT DISTINCT population_bucket 
             FROM zip_demographics 
-            WHERE population_bucket IS NOT NULL 
-            ORDER BY population_bucket
+            WHERE population_bucket IS NOT NULL
         """)
-        population_buckets = [row['population_bucket'] for row in cursor.fetchall()]
-        
-        return {
-            'income_buckets': income_buckets,
-            'population_buckets': population_buckets
-        }
+        population_buckets = sort_labels([row['population_bucket'] for row in cursor.fetchall()], POPULATION_BUCKETS)
+    
+    return {
+        'income_buckets': income_buckets,
+        'population_buckets': population_buckets
+    }
+
+def get_buckets():
+    """Get income and population buckets, cached until the data changes"""
+    try:
+        payload = result_cache.get_or_set(
+            'buckets', data_version.get(), lambda: CompressedPayload.from_body(json.dumps(load_buckets()))
+        )
+        return json.loads(payload.identity)
         
     except Exception as e:
         logger.error(f"Error getting buckets: {str(e)}")
         return {'income_buckets': [], 'population_buckets': []}
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
 
 @app.route('/')
 def home():
@@ -71,83 +225,250 @@ def home():
         buckets = get_buckets()
         return render_template('index.html', 
                             income_buckets=buckets['income_buckets'],
-                            population_buckets=buckets['population_buckets'])
+                            population_buckets=buckets['population_buckets'],
+                            data_version=data_version.get())
     except Exception as e:
         logger.error(f"Error in index route: {str(e)}")
         return f"An error occurred: {str(e)}", 500
 
+# Where a college is placed on the map: its own coordinates, or its ZIP's
+# centroid without them. Every bbox filter on colleges (viewport, table,
+# clusters, snapshot) uses it, as does idx_college_context_location
+COLLEGE_LATITUDE = "COALESCE(LATITUDE, latitude_zip)"
+COLLEGE_LONGITUDE = "COALESCE(LONGITUDE, longitude_zip)"
+
+# Fields returned for each college; latitude/longitude are where it is placed
+COLLEGE_CONTEXT_COLUMNS = f"""
+    id, NAME, ADDRESS, CITY, STATE, ZIP, TELEPHONE, POPULATION, COUNTY, COUNTYFIPS, WEBSITE,
+    median_household_income, zip_population, income_bucket, population_bucket, population_density,
+    {COLLEGE_LATITUDE} AS latitude, {COLLEGE_LONGITUDE} AS longitude
+"""
+
+# Rows fetched per round trip when streaming
+STREAM_BATCH_SIZE = 500
+
+def stream_rows(query, params, output_format):
+    """Serialize rows from an unbuffered cursor as a JSON array or NDJSON, batch by batch"""
+    with get_db_cursor(streaming=True) as cursor:
+        cursor.execute(query, params)
+        first = True
+        if output_format == 'json':
+            yield '['
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            if output_format == 'ndjson':
+                yield ''.join(app.json.dumps(row) + '\n' for row in rows)
+            else:
+                chunk = ','.join(app.json.dumps(row) for row in rows)
+                yield chunk if first else ',' + chunk
+            first = False
+        if output_format == 'json':
+            yield ']'
+
 @app.route('/api/colleges')
 def get_colleges():
-    conn = get_mysql_connection()
-    cursor = conn.cursor()
-    
     try:
         # Get query parameters
         min_income = request.args.get('min_income', type=int)
         max_income = request.args.get('max_income', type=int)
         min_population = request.args.get('min_population', type=int)
         max_population = request.args.get('max_population', type=int)
+        min_density, max_density = parse_density_range()
+        stream = request.args.get('stream')
+        if stream not in (None, 'json', 'ndjson'):
+            return jsonify({'error': "stream must be 'json' or 'ndjson'"}), 400
+        try:
+            origin = parse_origin()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        radius_miles = request.args.get('radius_miles', default=DEFAULT_RADIUS_MILES, type=float)
+        if radius_miles <= 0:
+            return jsonify({'error': 'radius_miles must be positive'}), 400
+        if origin is not None and stream:
+            return jsonify({'error': 'Results near a point are ordered by distance and cannot be streamed'}), 400
         
-        # Build the query dynamically
-        query = """
-            SELECT 
-                c.*,
-                d.median_household_income,
-                d.population as zip_population,
-                coord.latitude,
-                coord.longitude,
-                b.geometry
-            FROM colleges c
-            LEFT JOIN zip_demographics d ON c.ZIP = d.zip_code
-            LEFT JOIN zip_coordinates coord ON c.ZIP = coord.zip_code
-            LEFT JOIN zip_boundaries b ON c.ZIP = b.zip_code
+        # Build the query dynamically against the precomputed college context
+        query = f"""
+            SELECT {COLLEGE_CONTEXT_COLUMNS}
+            FROM college_context
             WHERE 1=1
         """
         params = []
         
         if min_income is not None:
-            query += " AND d.median_household_income >= %s"
+            query += " AND median_household_income >= %s"
             params.append(min_income)
         if max_income is not None:
-            query += " AND d.median_household_income <= %s"
+            query += " AND median_household_income <= %s"
             params.append(max_income)
         if min_population is not None:
-            query += " AND d.population >= %s"
+            query += " AND zip_population >= %s"
             params.append(min_population)
         if max_population is not None:
-            query += " AND d.population <= %s"
+            query += " AND zip_population <= %s"
             params.append(max_population)
+        query += density_filter('population_density', min_density, max_density, params)
+        
+        # Stream large results so memory stays flat however many rows match
+        if stream:
+            mimetype = 'application/x-ndjson' if stream == 'ndjson' else 'application/json'
+            return Response(stream_with_context(stream_rows(query, params, stream)), mimetype=mimetype)
             
-        cursor.execute(query, params)
-        results = cursor.fetchall()
+        def load_colleges(ids=None):
+            if data_snapshot is not None:
+                rows = data_snapshot.get().select_colleges(
+                    min_income, max_income, min_population, max_population, min_density, max_density
+                )
+                return rows if ids is None else [row for row in rows if row['id'] in ids]
+            with get_db_cursor() as cursor:
+                if ids is None:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query + f" AND id IN ({', '.join(['%s'] * len(ids))})", params + list(ids))
+                return cursor.fetchall()
         
-        # Convert to list of dicts
-        colleges = []
-        for row in results:
-            college = dict(row)
-            # Convert geometry to JSON if it exists
-            if college.get('geometry'):
-                try:
-                    college['geometry'] = json.loads(college['geometry'])
-                except:
-                    college['geometry'] = None
-            colleges.append(college)
+        def load_nearby():
+            # The grid index finds the colleges in range; the filters above narrow them down
+            nearby = {row['id']: distance for row, distance in get_located_rows('colleges').within(*origin, radius_miles)}
+            if not nearby:
+                return []
+            rows = [dict(row, distance_miles=round(nearby[row['id']], 2)) for row in load_colleges(nearby)]
+            return sorted(rows, key=lambda row: row['distance_miles'])
             
-        return jsonify(colleges)
+        return cached_json('colleges', load_colleges if origin is None else load_nearby)
         
     except Exception as e:
         logger.error(f"Error getting colleges: {str(e)}")
         return jsonify({'error': str(e)}), 500
-    finally:
-        cursor.close()
-        conn.close()
 
-@app.route('/api/demographics')
-def get_demographics():
-    conn = get_mysql_connection()
-    cursor = conn.cursor()
+# College table columns that can be sorted, and the indexed column each sorts
+# on; buckets sort by the figure they were cut from
+TABLE_SORT_COLUMNS = {
+    'NAME': 'NAME',
+    'CITY': 'CITY',
+    'STATE': 'STATE',
+    'POPULATION': 'POPULATION',
+    'income_bucket': 'median_household_income',
+    'population_bucket': 'zip_population'
+}
+# Longest page the table may ask for; DataTables' "All" (-1) gets this many
+MAX_TABLE_PAGE_LENGTH = 100
+
+def parse_table_order():
+    """Sort column and direction from DataTables' order[0] and columns[] parameters"""
+    index = request.args.get('order[0][column]', default=0, type=int)
+    name = request.args.get(f'columns[{index}][data]', 'NAME')
+    if name not in TABLE_SORT_COLUMNS:
+        raise ValueError(f"The college table cannot be sorted by {name}")
+    direction = request.args.get('order[0][dir]', 'asc')
+    if direction not in ('asc', 'desc'):
+        raise ValueError("order[0][dir] must be 'asc' or 'desc'")
+    return TABLE_SORT_COLUMNS[name], direction == 'desc'
+
+def parse_table_cursor(value):
+    """[sort value, id] of the row a keyset page starts after, or None"""
+    if value is None:
+        return None
+    try:
+        sort_value, last_id = json.loads(value)
+        return sort_value, int(last_id)
+    except (TypeError, ValueError):
+        raise ValueError("after must be a [value, id] pair from a previous page's next")
+
+def keyset_condition(column, descending, sort_value, last_id, params):
+    """SQL condition for the rows after (sort_value, last_id) in ORDER BY column, id
+
+    NULLs sort first ascending and last descending, in MySQL and SQLite alike
+    """
+    operator = '<' if descending else '>'
+    if sort_value is None:
+        params.append(last_id)
+        if descending:
+            return f" AND {column} IS NULL AND id < %s"
+        return f" AND ({column} IS NOT NULL OR id > %s)"
+    params.extend([sort_value, sort_value, last_id])
+    condition = f"{column} {operator} %s OR ({column} = %s AND id {operator} %s)"
+    if descending:
+        condition += f" OR {column} IS NULL"
+    return f" AND ({condition})"
+
+@app.route('/api/colleges/table')
+def get_college_table():
+    # DataTables server-side processing: one page of the colleges matching the
+    # map's filters, sorted and searched by the database
+    try:
+        draw = request.args.get('draw', default=0, type=int)
+        start = max(request.args.get('start', default=0, type=int), 0)
+        length = request.args.get('length', default=25, type=int)
+        if length < 0 or length > MAX_TABLE_PAGE_LENGTH:
+            length = MAX_TABLE_PAGE_LENGTH
+        length = max(length, 1)
+        column, descending = parse_table_order()
+        after = parse_table_cursor(request.args.get('after'))
+        bbox = parse_bbox(request.args.get('bbox')) if 'bbox' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    min_density, max_density = parse_density_range()
+    terms = search_terms(request.args.get('search[value]'))
     
     try:
+        conditions = ""
+        params = []
+        if bbox is not None:
+            west, south, east, north = bbox
+            conditions += f" AND {COLLEGE_LATITUDE} BETWEEN %s AND %s AND {COLLEGE_LONGITUDE} BETWEEN %s AND %s"
+            params += [south, north, west, east]
+        for name in ('income_bucket', 'population_bucket'):
+            if name in request.args:
+                conditions += bucket_filter(name, request.args.getlist(name), params)
+        conditions += density_filter('population_density', min_density, max_density, params)
+        searched = conditions
+        searched_params = list(params)
+        if terms:
+            searched += " AND " + storage.college_search_condition(terms, searched_params)
+        
+        # Pages after a known row seek to it on the sort index (keyset
+        # pagination); jumps to an arbitrary page fall back to OFFSET
+        query = f"SELECT {COLLEGE_CONTEXT_COLUMNS} FROM college_context WHERE 1=1" + searched
+        page_params = list(searched_params)
+        if after is not None:
+            query += keyset_condition(column, descending, *after, page_params)
+        direction = 'DESC' if descending else 'ASC'
+        query += f" ORDER BY {column} {direction}, id {direction} LIMIT %s"
+        page_params.append(length)
+        if after is None:
+            query += " OFFSET %s"
+            page_params.append(start)
+        
+        with get_db_cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS count FROM college_context WHERE 1=1" + conditions, params)
+            total = cursor.fetchone()['count']
+            filtered = total
+            if terms:
+                cursor.execute("SELECT COUNT(*) AS count FROM college_context WHERE 1=1" + searched, searched_params)
+                filtered = cursor.fetchone()['count']
+            cursor.execute(query, page_params)
+            rows = cursor.fetchall()
+        
+        # Cursor for the following page, sent back as after=
+        next_cursor = [rows[-1][column], rows[-1]['id']] if rows and len(rows) == length else None
+        return jsonify({
+            'draw': draw,
+            'recordsTotal': total,
+            'recordsFiltered': filtered,
+            'data': rows,
+            'next': next_cursor
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting college table: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def query_demographics():
+    """Income and population ranges across ZIPs with both known"""
+    with get_db_cursor() as cursor:
         cursor.execute("""
             SELECT 
                 MIN(median_household_income) as min_income,
@@ -158,15 +479,564 @@ def get_demographics():
             WHERE median_household_income IS NOT NULL
             AND population IS NOT NULL
         """)
-        result = cursor.fetchone()
-        return jsonify(result)
+        return cursor.fetchone()
+
+# Search radius for near=, near_zip= and /api/nearby when radius_miles is not given
+DEFAULT_RADIUS_MILES = 25.0
+# Limits on one /api/nearby or /api/knn request
+MAX_ORIGINS = 200
+MAX_NEIGHBOURS = 500
+
+# Points the proximity searches run over, as (query, key column); colleges
+# are placed at COLLEGE_LATITUDE and COLLEGE_LONGITUDE
+LOCATED_ROWS = {
+    'colleges': (f"""
+        SELECT id, NAME, CITY, STATE, zcta, median_household_income, zip_population,
+               income_bucket, population_bucket, population_density,
+               {COLLEGE_LATITUDE} AS latitude, {COLLEGE_LONGITUDE} AS longitude
+        FROM college_context
+        ORDER BY id
+    """, 'id'),
+    'zips': ("""
+        SELECT c.zip_code, c.city, c.state, d.median_household_income, d.population,
+               d.income_bucket, d.population_bucket, b.population_density, c.latitude, c.longitude
+        FROM zip_coordinates c
+        LEFT JOIN zip_demographics d ON d.zip_code = c.zip_code
+        LEFT JOIN zip_boundaries b ON b.zip_code = c.zip_code
+        ORDER BY c.zip_code
+    """, 'zip_code')
+}
+
+def load_located_rows(name, version):
+    """Read colleges or ZIP centroids into a grid index"""
+    from proximity import LocatedRows
+    query, key = LOCATED_ROWS[name]
+    with get_db_cursor() as cursor:
+        cursor.execute(query)
+        rows = cursor.fetchall()
+    return LocatedRows(version, rows, key)
+
+# Built on the first proximity query and rebuilt when the data version changes
+_located_rows = {}
+_located_rows_lock = threading.Lock()
+
+def get_located_rows(name):
+    """Grid index over 'colleges' or 'zips' for the current data version"""
+    with _located_rows_lock:
+        if name not in _located_rows:
+            from snapshot import SnapshotManager
+            _located_rows[name] = SnapshotManager(lambda version: load_located_rows(name, version), data_version.get)
+    return _located_rows[name].get()
+
+def resolve_origin(spec):
+    """(latitude, longitude) of an origin given as 'lat,lon', 'zip:12345' or 'college:<id>'"""
+    if spec.startswith('zip:') or spec.startswith('college:'):
+        kind, key = spec.split(':', 1)
+        if kind == 'zip':
+            row = get_located_rows('zips').find(key)
+        else:
+            row = get_located_rows('colleges').find(int(key)) if key.isdigit() else None
+        if row is None or row['latitude'] is None or row['longitude'] is None:
+            raise ValueError(f"Unknown or unlocated {kind} {key}")
+        return float(row['latitude']), float(row['longitude'])
+    try:
+        latitude, longitude = [float(v) for v in spec.split(',')]
+    except ValueError:
+        raise ValueError(f"Origin '{spec}' must be 'latitude,longitude', 'zip:<code>' or 'college:<id>'")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f"Origin '{spec}' is not a valid latitude and longitude")
+    return latitude, longitude
+
+def parse_origin():
+    """(latitude, longitude) named by near=lat,lon or near_zip=, or None when neither is given"""
+    if 'near' in request.args:
+        return resolve_origin(request.args['near'])
+    if 'near_zip' in request.args:
+        return resolve_origin(f"zip:{request.args['near_zip']}")
+    return None
+
+def parse_proximity_request():
+    """Target, resolved origins and bucket filters shared by /api/nearby and /api/knn"""
+    target = request.args.get('target', 'colleges')
+    if target not in LOCATED_ROWS:
+        raise ValueError("target must be 'colleges' or 'zips'")
+    specs = request.args.getlist('origin')
+    if not specs:
+        raise ValueError("At least one origin is required")
+    if len(specs) > MAX_ORIGINS:
+        raise ValueError(f"At most {MAX_ORIGINS} origins per request")
+    origins = [(spec, resolve_origin(spec)) for spec in specs]
+    # Missing bucket params mean "no filter", empty ones mean "nothing selected"
+    income_buckets = request.args.getlist('income_bucket') if 'income_bucket' in request.args else None
+    population_buckets = request.args.getlist('population_bucket') if 'population_bucket' in request.args else None
+    return target, origins, income_buckets, population_buckets
+
+def search_origins(target, origins, income_buckets, population_buckets, search):
+    """Run one search per origin; search(rows, latitude, longitude, allowed) returns (row, miles) pairs"""
+    rows = get_located_rows(target)
+    allowed = rows.mask(income_buckets, population_buckets)
+    return [
+        {
+            'origin': spec,
+            'latitude': latitude,
+            'longitude': longitude,
+            'matches': [dict(row, distance_miles=round(distance, 2))
+                        for row, distance in search(rows, latitude, longitude, allowed)]
+        }
+        for spec, (latitude, longitude) in origins
+    ]
+
+@app.route('/api/nearby')
+def get_nearby():
+    try:
+        target, origins, income_buckets, population_buckets = parse_proximity_request()
+        radius_miles = request.args.get('radius_miles', default=DEFAULT_RADIUS_MILES, type=float)
+        if radius_miles <= 0:
+            raise ValueError("radius_miles must be positive")
+        
+        return cached_json('nearby', lambda: {
+            'target': target,
+            'radius_miles': radius_miles,
+            'results': search_origins(
+                target, origins, income_buckets, population_buckets,
+                lambda rows, latitude, longitude, allowed: rows.within(latitude, longitude, radius_miles, allowed)
+            )
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting nearby results: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/knn')
+def get_knn():
+    try:
+        target, origins, income_buckets, population_buckets = parse_proximity_request()
+        k = request.args.get('k', default=10, type=int)
+        if not 1 <= k <= MAX_NEIGHBOURS:
+            raise ValueError(f"k must be between 1 and {MAX_NEIGHBOURS}")
+        
+        return cached_json('knn', lambda: {
+            'target': target,
+            'k': k,
+            'results': search_origins(
+                target, origins, income_buckets, population_buckets,
+                lambda rows, latitude, longitude, allowed: rows.nearest(latitude, longitude, k, allowed)
+            )
+        })
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting nearest neighbours: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# /api/rollup parameters and the demographic_rollups columns they name, in the
+# order rollups.py lists dimensions in its dimensions column
+ROLLUP_DIMENSIONS = {
+    'state': 'state',
+    'county': 'countyfips',
+    'income_bucket': 'income_bucket',
+    'population_bucket': 'population_bucket'
+}
+ROLLUP_MEASURES = ['college_count', 'enrollment', 'zip_count', 'population',
+                   'income_p25', 'income_p50', 'income_p75', 'income_p90']
+
+# Buckets are listed in display order rather than alphabetically
+BUCKET_POSITIONS = {
+    'income_bucket': {label: i for i, label in enumerate(bucket_labels(INCOME_BUCKETS))},
+    'population_bucket': {label: i for i, label in enumerate(bucket_labels(POPULATION_BUCKETS))}
+}
+
+def rollup_sort_key(row, columns):
+    """Order rollup rows by their dimensions, with missing values last"""
+    key = []
+    for column in columns:
+        value = row[column]
+        positions = BUCKET_POSITIONS.get(column, {})
+        key.append((value is None, positions.get(value, len(positions)), value or ''))
+    return key
+
+@app.route('/api/rollup')
+def get_rollup():
+    by = [name for name in request.args.get('by', '').split(',') if name]
+    unknown = [name for name in by if name not in ROLLUP_DIMENSIONS]
+    if unknown:
+        return jsonify({'error': f"Unknown rollup dimension {unknown[0]}; use {', '.join(ROLLUP_DIMENSIONS)}"}), 400
+    # Filtering on a dimension groups by it too, so state=CA&by=income_bucket drills into one state
+    filters = {name: request.args.getlist(name) for name in ROLLUP_DIMENSIONS if name in request.args}
+    grouped = [name for name in ROLLUP_DIMENSIONS if name in by or name in filters]
+    columns = [ROLLUP_DIMENSIONS[name] for name in grouped]
+    
+    def load_rollup():
+        query = f"""
+            SELECT {', '.join(columns + ROLLUP_MEASURES)}
+            FROM demographic_rollups
+            WHERE dimensions = %s
+        """
+        params = [','.join(columns)]
+        for name, values in filters.items():
+            query += bucket_filter(ROLLUP_DIMENSIONS[name], values, params)
+        with get_db_cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        return {'by': grouped, 'rows': sorted(rows, key=lambda row: rollup_sort_key(row, columns))}
+    
+    try:
+        return cached_json('rollup', load_rollup)
+        
+    except Exception as e:
+        logger.error(f"Error getting rollup: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/demographics')
+def get_demographics():
+    def load_demographics():
+        if data_snapshot is not None:
+            return data_snapshot.get().demographics
+        return query_demographics()
+    
+    try:
+        return cached_json('demographics', load_demographics)
         
     except Exception as e:
         logger.error(f"Error getting demographics: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+def parse_bbox(value):
+    """Parse a 'west,south,east,north' bbox string into floats"""
+    try:
+        west, south, east, north = [float(v) for v in value.split(',')]
+    except (AttributeError, ValueError):
+        raise ValueError("bbox must be 'west,south,east,north'")
+    if west > east or south > north:
+        raise ValueError("bbox must be 'west,south,east,north'")
+    return west, south, east, north
+
+def bucket_filter(column, buckets, params):
+    """SQL condition restricting a bucket column to the selected values"""
+    if not buckets:
+        return " AND 1=0"
+    params.extend(buckets)
+    return f" AND {column} IN ({', '.join(['%s'] * len(buckets))})"
+
+def density_filter(column, min_density, max_density, params):
+    """SQL condition restricting a population density column to a range; None leaves that end open"""
+    condition = ""
+    if min_density is not None:
+        condition += f" AND {column} >= %s"
+        params.append(min_density)
+    if max_density is not None:
+        condition += f" AND {column} <= %s"
+        params.append(max_density)
+    return condition
+
+def parse_density_range():
+    """min_density and max_density request parameters, in people per square kilometer"""
+    return request.args.get('min_density', type=float), request.args.get('max_density', type=float)
+
+# Smallest on-screen size, in pixels, for a ZIP boundary to be worth sending
+MIN_BOUNDARY_PIXELS = float(os.getenv('VIEWPORT_MIN_BOUNDARY_PIXELS', '1'))
+
+def query_boundaries(cursor, west, south, east, north, zoom, income_buckets, population_buckets,
+                     packed=False, min_density=None, max_density=None):
+    """ZIP boundaries overlapping a bbox, at the level of detail for the zoom"""
+    lod = lod_for_zoom(zoom)
+    # Overlap test on the SPATIAL index, and skip ZIPs that would
+    # render smaller than a pixel at this zoom
+    min_extent = MIN_BOUNDARY_PIXELS * 360.0 / (256 * 2 ** zoom)
+    if lod == FULL_RESOLUTION_LOD:
+        query = f"""
+            SELECT
+                b.zip_code,
+                {geometry_columns('b', packed)},
+                d.income_bucket,
+                d.population_bucket,
+                b.population_density
+            FROM zip_boundaries b
+            JOIN zip_demographics d ON d.zip_code = b.zip_code
+        """
+        params = []
+    else:
+        # Simplified geometry for the zoom instead of the full-resolution polygon
+        query = f"""
+            SELECT
+                b.zip_code,
+                {geometry_columns('l', packed)},
+                d.income_bucket,
+                d.population_bucket,
+                b.population_density
+            FROM zip_boundaries b
+            JOIN zip_boundary_lods l ON l.zip_code = b.zip_code AND l.lod = %s
+            JOIN zip_demographics d ON d.zip_code = b.zip_code
+        """
+        params = [lod]
+    query += " WHERE " + storage.bbox_condition('b', west, south, east, north, params)
+    query += " AND (b.max_lon - b.min_lon >= %s OR b.max_lat - b.min_lat >= %s)"
+    params += [min_extent, min_extent]
+    if income_buckets is not None:
+        query += bucket_filter('d.income_bucket', income_buckets, params)
+    if population_buckets is not None:
+        query += bucket_filter('d.population_bucket', population_buckets, params)
+    query += density_filter('b.population_density', min_density, max_density, params)
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+def query_viewport(west, south, east, north, zoom, income_buckets, population_buckets,
+                   include_colleges, include_boundaries, min_density=None, max_density=None):
+    """Colleges and ZIP boundaries inside a bbox, at the level of detail for the zoom"""
+    with get_db_cursor() as cursor:
+        colleges = []
+        if include_colleges and data_snapshot is not None:
+            colleges = data_snapshot.get().colleges_in_bbox(west, south, east, north, income_buckets,
+                                                            population_buckets, min_density, max_density)
+        elif include_colleges:
+            query = f"""
+                SELECT {COLLEGE_CONTEXT_COLUMNS}
+                FROM college_context
+                WHERE {COLLEGE_LATITUDE} BETWEEN %s AND %s
+                AND {COLLEGE_LONGITUDE} BETWEEN %s AND %s
+            """
+            params = [south, north, west, east]
+            if income_buckets is not None:
+                query += bucket_filter('income_bucket', income_buckets, params)
+            if population_buckets is not None:
+                query += bucket_filter('population_bucket', population_buckets, params)
+            query += density_filter('population_density', min_density, max_density, params)
+            cursor.execute(query, params)
+            colleges = cursor.fetchall()
+
+        boundaries = []
+        lod = lod_for_zoom(zoom)
+        if include_boundaries:
+            boundaries = query_boundaries(cursor, west, south, east, north, zoom,
+                                          income_buckets, population_buckets,
+                                          min_density=min_density, max_density=max_density)
+
+    # Geometry stays as GeoJSON text; the browser parses it per feature
+    return {
+        'bbox': [west, south, east, north],
+        'zoom': zoom,
+        'lod': lod,
+        'colleges': colleges,
+        'boundaries': boundaries
+    }
+
+@app.route('/api/viewport')
+def get_viewport():
+    try:
+        west, south, east, north = parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', default=4, type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    min_density, max_density = parse_density_range()
+
+    # Missing bucket params mean "no filter", empty ones mean "nothing selected"
+    income_buckets = request.args.getlist('income_bucket') if 'income_bucket' in request.args else None
+    population_buckets = request.args.getlist('population_bucket') if 'population_bucket' in request.args else None
+    include_colleges = request.args.get('colleges', default=1, type=int) == 1
+    include_boundaries = request.args.get('boundaries', default=1, type=int) == 1
+
+    try:
+        return cached_json('viewport', lambda: query_viewport(
+            west, south, east, north, zoom, income_buckets, population_buckets,
+            include_colleges, include_boundaries, min_density, max_density
+        ))
+
+    except Exception as e:
+        logger.error(f"Error getting viewport: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def load_cluster_index(version):
+    """Sort the located colleges along the cluster grid"""
+    from clustering import ClusterIndex
+    return ClusterIndex(version, get_located_rows('colleges').rows)
+
+# Built on the first cluster query and rebuilt when the data version changes
+_cluster_index = None
+_cluster_index_lock = threading.Lock()
+
+def get_cluster_index():
+    """Cluster grid over the colleges for the current data version"""
+    global _cluster_index
+    with _cluster_index_lock:
+        if _cluster_index is None:
+            from snapshot import SnapshotManager
+            _cluster_index = SnapshotManager(load_cluster_index, data_version.get)
+    return _cluster_index.get()
+
+@app.route('/api/clusters')
+def get_clusters():
+    try:
+        west, south, east, north = parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', default=4, type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    min_density, max_density = parse_density_range()
+    income_buckets = request.args.getlist('income_bucket') if 'income_bucket' in request.args else None
+    population_buckets = request.args.getlist('population_bucket') if 'population_bucket' in request.args else None
+
+    try:
+        # Colleges are placed by their own coordinates, or their ZIP's centroid without them
+        return cached_json('clusters', lambda: {
+            'bbox': [west, south, east, north],
+            'zoom': zoom,
+            'clusters': get_cluster_index().clusters(west, south, east, north, zoom, income_buckets,
+                                                     population_buckets, min_density, max_density)
+        })
+
+    except Exception as e:
+        logger.error(f"Error getting clusters: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/colleges/<int:college_id>')
+def get_college(college_id):
+    def load_college():
+        with get_db_cursor() as cursor:
+            cursor.execute(f"SELECT {COLLEGE_CONTEXT_COLUMNS} FROM college_context WHERE id = %s", [college_id])
+            college = cursor.fetchone()
+        if college is None:
+            raise LookupError(f"No college with id {college_id}")
+        return college
+    
+    try:
+        # Popups ask for one college at a time: one lookup on a miss, none once
+        # cached, and unknown ids are never cached
+        return cached_json(f"college:{college_id}", load_college)
+        
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        logger.error(f"Error getting college {college_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/boundaries')
+def get_boundaries():
+    try:
+        west, south, east, north = parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', default=4, type=int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    min_density, max_density = parse_density_range()
+
+    income_buckets = request.args.getlist('income_bucket') if 'income_bucket' in request.args else None
+    population_buckets = request.args.getlist('population_bucket') if 'population_bucket' in request.args else None
+
+    def load_boundaries(packed):
+        with get_db_cursor() as cursor:
+            return query_boundaries(cursor, west, south, east, north, zoom,
+                                    income_buckets, population_buckets, packed, min_density, max_density)
+
+    try:
+        return cached_geometry('boundaries', load_boundaries)
+
+    except Exception as e:
+        logger.error(f"Error getting boundaries: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/merged_boundaries')
+def get_merged_boundaries():
+    income_buckets = request.args.getlist('income_bucket') if 'income_bucket' in request.args else None
+    population_buckets = request.args.getlist('population_bucket') if 'population_bucket' in request.args else None
+    
+    try:
+        query = """
+            SELECT
+                m.income_bucket,
+                m.population_bucket,
+                m.region_id,
+                m.zip_count,
+                {geometry}
+            FROM merged_boundaries m
+            WHERE 1=1
+        """
+        params = []
+        if 'bbox' in request.args:
+            west, south, east, north = parse_bbox(request.args.get('bbox'))
+            query += " AND min_lon <= %s AND max_lon >= %s AND min_lat <= %s AND max_lat >= %s"
+            params += [east, west, north, south]
+        if income_buckets is not None:
+            query += bucket_filter('income_bucket', income_buckets, params)
+        if population_buckets is not None:
+            query += bucket_filter('population_bucket', population_buckets, params)
+        
+        def load_regions(packed):
+            with get_db_cursor() as cursor:
+                cursor.execute(query.format(geometry=geometry_columns('m', packed)), params)
+                return cursor.fetchall()
+        
+        # GeoJSON text by default; packed binary for clients that send its Accept type
+        return cached_geometry('merged_boundaries', load_regions)
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error getting merged boundaries: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.mvt')
+def get_tile(z, x, y):
+    if z < 0 or z > 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 404
+    
+    try:
+        version = data_version.get()
+        etag = f"{version}-tile-{z}-{x}-{y}"
+        if etag in request.if_none_match.as_set():
+            response = Response(status=304)
+        else:
+            # Tiles rendered from an older build of the data are thrown away
+            from vector_tiles import get_or_render_tile
+            tile_cache = get_tile_cache()
+            tile_cache.ensure_version(version)
+            data = get_or_render_tile(tile_cache, storage, z, x, y, version)
+            response = Response(data, mimetype='application/vnd.mapbox-vector-tile')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = (
+            IMMUTABLE_CACHE_CONTROL if request.args.get('v') == version else REVALIDATE_CACHE_CONTROL
+        )
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error getting tile {z}/{x}/{y}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# Heavy responses worth building and compressing before the first visitor asks
+WARM_URLS = ['/api/colleges', '/api/demographics', '/api/merged_boundaries']
+
+@app.cli.command('warm-cache')
+def warm_cache():
+    """Pre-compute the heavy API responses for the current data version, compressed at the best levels"""
+    app.config['PRECOMPRESS_BEST'] = True
+    try:
+        with app.test_client() as client:
+            for url in WARM_URLS:
+                response = client.get(url, headers={'Accept-Encoding': 'br'})
+                logger.info(f"Warmed {url}: {response.status_code}, {len(response.data):,} bytes")
     finally:
-        cursor.close()
-        conn.close()
+        app.config['PRECOMPRESS_BEST'] = False
+
+@app.route('/api/pool_stats')
+def get_pool_stats():
+    return jsonify(storage.stats())
+
+@app.route('/api/cache_stats')
+def get_cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/api/snapshot_stats')
+def get_snapshot_stats():
+    if data_snapshot is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(data_snapshot.stats(), enabled=True))
+
+# Load the snapshot at startup so the first request doesn't pay for it
+if data_snapshot is not None:
+    try:
+        data_snapshot.get()
+    except Exception as e:
+        logger.error(f"Error loading data snapshot, will retry on first request: {str(e)}")
 
 if __name__ == '__main__':
     app.run(debug=True)
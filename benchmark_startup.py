@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Modules the app defers until a route needs them; loading any of them at
+# startup is a regression
+DEFERRED_MODULES = ['numpy', 'pandas', 'shapely', 'mapbox_vector_tile', 'pyproj']
+
+# Run in a fresh interpreter so every measurement is a cold start
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (done - imported) * 1000,
+    'status': response.status_code,
+    'loaded': [name for name in json.loads(sys.argv[2]) if name in sys.modules]
+}))
+"""
+
+def log_progress(message):
+    """Log a message with timestamp"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}")
+
+def measure_startup(url):
+    """Timings of one cold start: process launch to exit, app import, and the first response"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD_SCRIPT, url, json.dumps(DEFERRED_MODULES)],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    total_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(f"App failed to start:\n{result.stderr}")
+    # The app logs to stderr, so the last stdout line is the child's report
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['total_ms'] = total_ms
+    return timings
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold-start import time and time to first response')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--url', default='/', help='Path requested first')
+    parser.add_argument('--max-import-ms', type=float, help='Fail when the median import time is above this')
+    parser.add_argument('--max-first-response-ms', type=float,
+                        help='Fail when the median time to first response is above this')
+    args = parser.parse_args()
+
+    log_progress(f"Starting the app {args.runs} times and requesting {args.url}")
+    runs = [measure_startup(args.url) for _ in range(args.runs)]
+
+    print(f"{'measure':<20} {'p50 ms':>9} {'max ms':>9}")
+    medians = {}
+    for measure in ('import_ms', 'first_response_ms', 'total_ms'):
+        values = [run[measure] for run in runs]
+        medians[measure] = np.percentile(values, 50)
+        print(f"{measure[:-3]:<20} {medians[measure]:>9.1f} {max(values):>9.1f}")
+
+    statuses = sorted({run['status'] for run in runs})
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    log_progress(f"First response status: {', '.join(str(status) for status in statuses)}")
+    log_progress(f"Deferred modules loaded by then: {', '.join(loaded) if loaded else 'none'}")
+
+    failures = []
+    if args.max_import_ms is not None and medians['import_ms'] > args.max_import_ms:
+        failures.append(f"import took {medians['import_ms']:.1f} ms, limit {args.max_import_ms:.1f} ms")
+    if args.max_first_response_ms is not None and medians['first_response_ms'] > args.max_first_response_ms:
+        failures.append(f"first response took {medians['first_response_ms']:.1f} ms, "
+                        f"limit {args.max_first_response_ms:.1f} ms")
+    if failures:
+        raise SystemExit("Startup regression: " + "; ".join(failures))
@@ -0,0 +1,107 @@
+import argparse
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+import app
+from storage import DEFAULT_MMAP_SIZE, MySQLStorage, SQLiteStorage
+from vector_tiles import fetch_tile_features, tile_range
+
+# Roughly the lower 48 states, as the map first opens
+US_BBOX = (-125.0, 24.0, -66.0, 50.0)
+
+def log_progress(message):
+    """Log a message with timestamp"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}")
+
+def open_backend(name, sqlite_path):
+    """A storage backend by name, or None when it cannot be reached"""
+    try:
+        if name == 'sqlite':
+            storage = SQLiteStorage(sqlite_path, mmap_size=int(os.getenv('SQLITE_MMAP_SIZE', str(DEFAULT_MMAP_SIZE))))
+        else:
+            storage = MySQLStorage.from_env()
+        with storage.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS n FROM zip_boundaries")
+            cursor.fetchone()
+        return storage
+    except Exception as e:
+        log_progress(f"Skipping {name}: {str(e)}")
+        return None
+
+def sample_center(storage):
+    """Center of the middle ZIP by code, so every backend is asked about the same place"""
+    with storage.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) AS n FROM zip_boundaries")
+        count = cursor.fetchone()['n']
+        cursor.execute("SELECT min_lon, min_lat, max_lon, max_lat FROM zip_boundaries ORDER BY zip_code LIMIT 1 OFFSET %s",
+                       (count // 2,))
+        row = cursor.fetchone()
+    return ((float(row['min_lon']) + float(row['max_lon'])) / 2,
+            (float(row['min_lat']) + float(row['max_lat'])) / 2)
+
+def build_workload(lon, lat):
+    """Named queries the map makes, each run through the app's own query code"""
+    def viewport(half_width, zoom):
+        return lambda: app.query_viewport(lon - half_width, lat - half_width, lon + half_width, lat + half_width,
+                                          zoom, None, None, True, True)
+
+    def tile(zoom):
+        (x, _), (y, _) = tile_range(zoom, lon, lat, lon, lat)
+        return lambda: fetch_tile_features(app.storage, zoom, x, y)
+
+    return [
+        ('buckets', app.load_buckets),
+        ('viewport US zoom 4', lambda: app.query_viewport(*US_BBOX, 4, None, None, True, True)),
+        ('viewport zoom 8', viewport(1.0, 8)),
+        ('viewport zoom 12', viewport(0.1, 12)),
+        ('tile zoom 8', tile(8)),
+        ('tile zoom 12', tile(12)),
+    ]
+
+def result_size(result):
+    if isinstance(result, dict):
+        return sum(len(value) for value in result.values() if isinstance(value, list))
+    return len(result)
+
+def benchmark(storage, workload, iterations, warmup):
+    """Latency percentiles of every workload query on one backend"""
+    # The app's query functions read the module-level storage
+    app.storage = storage
+    results = []
+    for name, run in workload:
+        for _ in range(warmup):
+            run()
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            rows = result_size(run())
+            timings.append((time.perf_counter() - start) * 1000)
+        results.append((name, rows, np.percentile(timings, 50), np.percentile(timings, 99), np.mean(timings)))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare query latency of the storage backends on the same queries')
+    parser.add_argument('--backends', nargs='+', choices=['sqlite', 'mysql'], default=['sqlite', 'mysql'])
+    parser.add_argument('--sqlite-path', default=os.getenv('SQLITE_PATH', 'education_demographics.db'))
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger('app').setLevel(logging.WARNING)
+
+    backends = [storage for storage in (open_backend(name, args.sqlite_path) for name in args.backends) if storage]
+    if not backends:
+        raise SystemExit("No storage backend available")
+
+    lon, lat = sample_center(backends[0])
+    workload = build_workload(lon, lat)
+    log_progress(f"Running {len(workload)} queries {args.iterations} times each around ({lon:.4f}, {lat:.4f})")
+
+    print(f"{'backend':<8} {'query':<20} {'rows':>7} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9}")
+    for storage in backends:
+        for name, rows, p50, p99, mean in benchmark(storage, workload, args.iterations, args.warmup):
+            print(f"{storage.name:<8} {name:<20} {rows:>7} {p50:>9.2f} {p99:>9.2f} {mean:>9.2f}")
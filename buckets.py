@@ -0,0 +1,98 @@
+import json
+import os
+
+# Income and population bucket definitions shared by the setup scripts and
+# the app. Each bucket holds values below its 'max' and at or above the
+# previous bucket's; the last bucket has no upper bound. Listed in display
+# order. After changing a threshold, run `python database_setup.py --rebucket`
+# to relabel the existing tables without downloading anything again.
+INCOME_BUCKETS = [
+    {'label': 'Under $100k', 'max': 100000},
+    {'label': '$100k-$125k', 'max': 125000},
+    {'label': '$125k-$150k', 'max': 150000},
+    {'label': '$150k-$175k', 'max': 175000},
+    {'label': '$175k-$200k', 'max': 200000},
+    {'label': '$200k-$250k', 'max': 250000},
+    {'label': '$250k+', 'max': None},
+]
+
+POPULATION_BUCKETS = [
+    {'label': 'Under 1,000', 'max': 1000},
+    {'label': '1,000-5,000', 'max': 5000},
+    {'label': '5,000-10,000', 'max': 10000},
+    {'label': '10,000-25,000', 'max': 25000},
+    {'label': '25,000-40,000', 'max': 40000},
+    {'label': '40,000+', 'max': None},
+]
+
+# Label for rows whose source value is missing
+UNKNOWN_BUCKET = 'Unknown'
+
+def bucket_labels(buckets):
+    """Labels in display order, with the unknown bucket last"""
+    return [bucket['label'] for bucket in buckets] + [UNKNOWN_BUCKET]
+
+def assign_buckets(values, buckets):
+    """Label a whole column of values in one vectorized pass"""
+    # Imported here so the app can use the definitions without loading pandas
+    import numpy as np
+    import pandas as pd
+
+    values = pd.to_numeric(pd.Series(values), errors='coerce')
+    thresholds = np.array([bucket['max'] for bucket in buckets[:-1]], dtype=float)
+    labels = np.array([bucket['label'] for bucket in buckets], dtype=object)
+    # Index of the first bucket whose max is above the value
+    positions = np.searchsorted(thresholds, values.to_numpy(dtype=float), side='right')
+    return pd.Series(
+        np.where(values.isna(), UNKNOWN_BUCKET, labels[positions]),
+        index=values.index,
+        dtype=object
+    )
+
+def bucket_case_sql(column, buckets):
+    """SQL CASE expression that assigns the same labels as assign_buckets"""
+    def quote(label):
+        return "'" + label.replace("'", "''") + "'"
+
+    clauses = [f"WHEN {column} IS NULL THEN {quote(UNKNOWN_BUCKET)}"]
+    for bucket in buckets[:-1]:
+        clauses.append(f"WHEN {column} < {bucket['max']} THEN {quote(bucket['label'])}")
+    return f"CASE {' '.join(clauses)} ELSE {quote(buckets[-1]['label'])} END"
+
+def sort_labels(labels, buckets):
+    """Order labels found in the data by their position in the bucket definitions"""
+    order = {label: position for position, label in enumerate(bucket_labels(buckets))}
+    return sorted(labels, key=lambda label: (order.get(label, len(order)), label))
+
+# Bucket labels present in the data, written by the setup scripts with each
+# data version so the app can list them without querying zip_demographics
+DEFAULT_LABELS_PATH = 'bucket_labels.json'
+
+def write_label_artifact(conn, version, path=None):
+    """Save the labels found in zip_demographics, in display order, tagged with the data version"""
+    path = path or os.getenv('BUCKET_LABELS_PATH', DEFAULT_LABELS_PATH)
+    cursor = conn.cursor()
+    labels = {'version': version}
+    for column, buckets in (('income_bucket', INCOME_BUCKETS), ('population_bucket', POPULATION_BUCKETS)):
+        cursor.execute(f"SELECT DISTINCT {column} FROM zip_demographics WHERE {column} IS NOT NULL")
+        labels[f"{column}s"] = sort_labels([row[0] for row in cursor.fetchall()], buckets)
+    cursor.close()
+
+    # Replace the file in one step so the app never reads half of it
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(labels, f)
+    os.replace(temp_path, path)
+    return labels
+
+def read_label_artifact(version, path=None):
+    """Labels saved for this data version, or None when the file is missing or from another build"""
+    path = path or os.getenv('BUCKET_LABELS_PATH', DEFAULT_LABELS_PATH)
+    try:
+        with open(path) as f:
+            labels = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if labels.get('version') != version:
+        return None
+    return {'income_buckets': labels['income_buckets'], 'population_buckets': labels['population_buckets']}
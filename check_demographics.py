@@ -4,14 +4,19 @@ import pandas as pd
 # Connect to the database
 conn = sqlite3.connect('education_demographics.db')
 
-# Check income bucket distribution
-print("\nIncome bucket distribution:")
-df = pd.read_sql_query("SELECT income_bucket, COUNT(*) as count FROM zip_demographics GROUP BY income_bucket", conn)
-print(df)
+# Bucket distributions come from the precomputed rollups when they exist
+has_rollups = conn.execute(
+    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='demographic_rollups'"
+).fetchone() is not None
 
-print("\nPopulation bucket distribution:")
-df = pd.read_sql_query("SELECT population_bucket, COUNT(*) as count FROM zip_demographics GROUP BY population_bucket", conn)
-print(df)
+for dimension, title in (('income_bucket', 'Income'), ('population_bucket', 'Population')):
+    print(f"\n{title} bucket distribution:")
+    if has_rollups:
+        df = pd.read_sql_query(f"SELECT {dimension}, zip_count as count FROM demographic_rollups "
+                               f"WHERE dimensions = '{dimension}' AND zip_count > 0", conn)
+    else:
+        df = pd.read_sql_query(f"SELECT {dimension}, COUNT(*) as count FROM zip_demographics GROUP BY {dimension}", conn)
+    print(df)
 
 # Check if we're missing any ZIP codes
 print("\nChecking for missing ZIP codes:")
@@ -0,0 +1,161 @@
+import math
+
+import numpy as np
+
+# Clusters are the colleges sharing a square grid cell of CELL_PIXELS on
+# screen. Cells are a power of two in Web Mercator pixels, so every cell at
+# one zoom splits into exactly four at the next: the grid is a quadtree, and
+# a cell at any zoom is a prefix of the Morton (Z-order) code of the finest
+# cell. Sorted by that code once, the colleges of any cell at any zoom are
+# one contiguous run.
+CELL_PIXELS = 64
+TILE_PIXELS = 256
+# Finest zoom with its own grid; deeper zooms reuse it
+MAX_CLUSTER_ZOOM = 16
+# Web Mercator is undefined at the poles; tiles stop at this latitude
+MAX_LATITUDE = 85.0511287798
+FINEST_CELLS = TILE_PIXELS * 2 ** MAX_CLUSTER_ZOOM // CELL_PIXELS
+
+def mercator_cells(latitudes, longitudes):
+    """Column and row of the finest grid cell holding each point"""
+    latitudes = np.radians(np.clip(np.asarray(latitudes, dtype=float), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitudes, dtype=float) + 180) / 360
+    y = (1 - np.log(np.tan(latitudes) + 1 / np.cos(latitudes)) / math.pi) / 2
+    columns = np.clip(np.floor(x * FINEST_CELLS), 0, FINEST_CELLS - 1).astype(np.int64)
+    rows = np.clip(np.floor(y * FINEST_CELLS), 0, FINEST_CELLS - 1).astype(np.int64)
+    return columns, rows
+
+def _spread_bits(values):
+    """Put a zero bit between each bit of 32-bit values"""
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+def morton_codes(columns, rows):
+    """Z-order code interleaving column and row bits; a cell's code shifted right by 2 is its parent's"""
+    return _spread_bits(columns) | (_spread_bits(rows) << np.uint64(1))
+
+class ClusterIndex:
+    """Colleges sorted along the quadtree of grid cells, for one data version
+
+    A request filters the colleges in view and reads each cell's cluster off
+    the sorted runs, so its cost grows with the colleges in view while its
+    output is bounded by the cells on screen
+    """
+
+    def __init__(self, version, rows):
+        self.version = version
+        located = [row for row in rows if row['latitude'] is not None and row['longitude'] is not None]
+        latitudes = np.array([float(row['latitude']) for row in located], dtype=float)
+        longitudes = np.array([float(row['longitude']) for row in located], dtype=float)
+        columns, cell_rows = mercator_cells(latitudes, longitudes)
+        codes = morton_codes(columns, cell_rows)
+        order = np.argsort(codes, kind='stable')
+
+        self.codes = codes[order]
+        self.columns = columns[order]
+        self.rows = cell_rows[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.ids = np.array([row['id'] for row in located], dtype=np.int64)[order]
+        self.densities = np.array([np.nan if row['population_density'] is None else float(row['population_density'])
+                                   for row in located], dtype=float)[order]
+        # Buckets as codes into a label list, -1 for NULL
+        self.bucket_labels = {}
+        self.bucket_codes = {}
+        for name in ('income_bucket', 'population_bucket'):
+            labels = sorted({row[name] for row in located if row[name] is not None})
+            code_of = {label: code for code, label in enumerate(labels)}
+            self.bucket_labels[name] = labels
+            self.bucket_codes[name] = np.array([code_of.get(row[name], -1) for row in located], dtype=np.int16)[order]
+
+    def _mask(self, west, south, east, north, shift, income_buckets, population_buckets, min_density, max_density):
+        """Colleges in every cell the bbox touches at this level, and in the selected buckets and density range"""
+        # Whole cells, so a cluster on the edge of the view is the same as when it is in the middle
+        (first_column, last_column), (first_row, last_row) = mercator_cells([north, south], [west, east])
+        columns = self.columns >> shift
+        rows = self.rows >> shift
+        mask = ((columns >= first_column >> shift) & (columns <= last_column >> shift) &
+                (rows >= first_row >> shift) & (rows <= last_row >> shift))
+        for name, selected in (('income_bucket', income_buckets), ('population_bucket', population_buckets)):
+            # None means no filter; an empty list matches nothing, as in bucket_filter
+            if selected is not None:
+                codes = [self.bucket_labels[name].index(label) for label in selected if label in self.bucket_labels[name]]
+                mask &= np.isin(self.bucket_codes[name], codes)
+        if min_density is not None:
+            mask &= self.densities >= min_density
+        if max_density is not None:
+            mask &= self.densities <= max_density
+        return mask
+
+    def _breakdown(self, name, positions, run_of, run_count):
+        """{label: colleges} per run for one bucket column; colleges without a bucket are counted only in the total"""
+        codes = self.bucket_codes[name][positions]
+        labels = self.bucket_labels[name]
+        known = codes >= 0
+        counts = np.bincount(run_of[known] * len(labels) + codes[known],
+                             minlength=run_count * len(labels)).reshape(run_count, len(labels))
+        return [{labels[code]: int(count) for code, count in enumerate(run) if count} for run in counts]
+
+    def clusters(self, west, south, east, north, zoom, income_buckets=None, population_buckets=None,
+                 min_density=None, max_density=None):
+        """Clusters in view at a zoom, each with its count, centroid, bounds and bucket breakdown
+
+        A cell with one college is returned as that college's id and buckets.
+        Colleges that zooming in would never separate (all at one point, or
+        past the finest grid) are listed by id
+        """
+        zoom = min(max(int(zoom), 0), MAX_CLUSTER_ZOOM)
+        shift = MAX_CLUSTER_ZOOM - zoom
+        positions = np.flatnonzero(self._mask(west, south, east, north, shift, income_buckets,
+                                              population_buckets, min_density, max_density))
+        if len(positions) == 0:
+            return []
+
+        # Sorted by code, so each cell at this zoom is a run of equal prefixes
+        cells = self.codes[positions] >> np.uint64(2 * shift)
+        starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+        counts = np.diff(np.append(starts, len(positions)))
+        run_of = np.repeat(np.arange(len(starts)), counts)
+        latitudes = self.latitudes[positions]
+        longitudes = self.longitudes[positions]
+        mean_latitudes = np.add.reduceat(latitudes, starts) / counts
+        mean_longitudes = np.add.reduceat(longitudes, starts) / counts
+        bounds = np.column_stack([
+            np.minimum.reduceat(longitudes, starts), np.minimum.reduceat(latitudes, starts),
+            np.maximum.reduceat(longitudes, starts), np.maximum.reduceat(latitudes, starts)
+        ])
+        income = self._breakdown('income_bucket', positions, run_of, len(starts))
+        population = self._breakdown('population_bucket', positions, run_of, len(starts))
+
+        clusters = []
+        for run, (start, count) in enumerate(zip(starts, counts)):
+            if count == 1:
+                position = positions[start]
+                income_code = self.bucket_codes['income_bucket'][position]
+                population_code = self.bucket_codes['population_bucket'][position]
+                clusters.append({
+                    'id': int(self.ids[position]),
+                    'count': 1,
+                    'latitude': float(latitudes[start]),
+                    'longitude': float(longitudes[start]),
+                    'income_bucket': self.bucket_labels['income_bucket'][income_code] if income_code >= 0 else None,
+                    'population_bucket': (self.bucket_labels['population_bucket'][population_code]
+                                          if population_code >= 0 else None)
+                })
+                continue
+            west_edge, south_edge, east_edge, north_edge = (float(value) for value in bounds[run])
+            cluster = {
+                'count': int(count),
+                'latitude': float(mean_latitudes[run]),
+                'longitude': float(mean_longitudes[run]),
+                'bounds': [west_edge, south_edge, east_edge, north_edge],
+                'income_buckets': income[run],
+                'population_buckets': population[run]
+            }
+            if zoom == MAX_CLUSTER_ZOOM or (west_edge == east_edge and south_edge == north_edge):
+                cluster['ids'] = [int(value) for value in self.ids[positions[start:start + count]]]
+            clusters.append(cluster)
+        return clusters
@@ -0,0 +1,59 @@
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# Version reported when the database predates version stamps
+UNVERSIONED = 'unversioned'
+
+def new_data_version():
+    """Unique, time-ordered identifier for one build of the data"""
+    return f"{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+def stamp_data_version(conn, version=None):
+    """Record that the data changed; works with sqlite3 and MySQL connections"""
+    version = version or new_data_version()
+    placeholder = '?' if conn.__class__.__module__.startswith('sqlite3') else '%s'
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY,
+            version VARCHAR(64),
+            updated_at VARCHAR(32)
+        )
+    """)
+    cursor.execute("DELETE FROM data_version")
+    cursor.execute(
+        f"INSERT INTO data_version (id, version, updated_at) VALUES (1, {placeholder}, {placeholder})",
+        (version, datetime.utcnow().isoformat())
+    )
+    conn.commit()
+    cursor.close()
+    return version
+
+class DataVersionTracker:
+    """Caches the current data version, re-reading it at most once per interval"""
+
+    def __init__(self, read_version, check_interval=30):
+        self._read_version = read_version
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return self._version
+
+        with self._lock:
+            if self._version is not None and now - self._checked_at < self.check_interval:
+                return self._version
+            try:
+                self._version = self._read_version() or UNVERSIONED
+            except Exception:
+                # Keep serving the last known version while the database is unreachable
+                if self._version is None:
+                    self._version = UNVERSIONED
+            self._checked_at = now
+            return self._version
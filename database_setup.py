@@ -1,10 +1,16 @@
 import sqlite3
 import pandas as pd
-import requests
 import json
+import os
 import sys
 import time
 from datetime import datetime
+from data_version import stamp_data_version
+from buckets import INCOME_BUCKETS, POPULATION_BUCKETS, assign_buckets, bucket_case_sql, write_label_artifact
+from pipeline import ArtifactCache, Pipeline, hash_file, sync_rows, table_columns
+from zcta_assignment import assign_college_zctas
+from rollups import run_rollup_stage
+from text_search import create_college_search_table
 
 def log_progress(message):
     """Log a message with timestamp"""
@@ -15,6 +21,25 @@ def log_progress(message):
 conn = sqlite3.connect('education_demographics.db')
 cursor = conn.cursor()
 
+COLLEGES_CSV = 'all-college-data.csv'
+ZIP_COORDINATES_CSV = 'ZIP-lat-long.csv'
+CENSUS_URL = "https://api.census.gov/data/2021/acs/acs5"
+CENSUS_FIELDS = "B19013_001E,B01003_001E,NAME"  # Median income, Population, Name
+CENSUS_ARTIFACT = 'census_acs5_2021_zcta.json'
+
+# Columns the college table sorts on, by index name suffix
+COLLEGE_SORT_INDEXES = [
+    ('name', 'NAME'),
+    ('city', 'CITY'),
+    ('state', 'STATE'),
+    ('enrollment', 'POPULATION'),
+    ('income', 'median_household_income'),
+    ('zip_population', 'zip_population')
+]
+# Bumped whenever college_context gains indexes or side tables, so existing
+# builds rerun the stage and get them
+COLLEGE_CONTEXT_LAYOUT = 3
+
 def create_colleges_table():
     log_progress("Creating colleges table...")
     cursor.execute('''
@@ -38,9 +63,10 @@ def create_colleges_table():
     
     # Read CSV file
     log_progress("Reading college data from CSV...")
-    df = pd.read_csv('all-college-data.csv')
+    # Keep ZIP and county FIPS as text so leading zeros survive
+    df = pd.read_csv(COLLEGES_CSV, dtype={'ZIP': str, 'COUNTYFIPS': str})
     
-    # Insert data into the table
+    # The CSV has no stable key, so a changed file replaces the whole (small) table
     log_progress(f"Inserting {len(df)} college records into database...")
     df.to_sql('colleges', conn, if_exists='replace', index=False)
     log_progress("College data import complete")
@@ -53,13 +79,14 @@ def create_zip_coordinates_table():
         city TEXT,
         state TEXT,
         latitude REAL,
-        longitude REAL
+        longitude REAL,
+        row_hash TEXT  -- Change detection, see pipeline.py
     )
     ''')
     
     # Read ZIP coordinates CSV file
     log_progress("Reading ZIP coordinates from CSV...")
-    df = pd.read_csv('ZIP-lat-long.csv')
+    df = pd.read_csv(ZIP_COORDINATES_CSV)
     
     # Rename columns and select needed ones
     df = df.rename(columns={
@@ -76,96 +103,52 @@ def create_zip_coordinates_table():
     # Select only the columns we want
     df = df[['zip_code', 'city', 'state', 'latitude', 'longitude']]
     
-    # Insert data into the table
-    log_progress(f"Inserting {len(df)} ZIP coordinate records into database...")
-    df.to_sql('zip_coordinates', conn, if_exists='replace', index=False)
+    # Write only the ZIPs that are new or changed since the last run
+    log_progress(f"Syncing {len(df)} ZIP coordinate records into database...")
+    content_hash = sync_rows(conn, 'zip_coordinates', df, ['zip_code'])
     log_progress("ZIP coordinates import complete")
+    return content_hash
 
-def download_census_data(api_key):
-    """Download complete Census dataset for all ZIP codes"""
-    start_time = time.time()
-    log_progress("Starting Census data download...")
-    
-    base_url = "https://api.census.gov/data/2021/acs/acs5"
+def download_census_data(api_key, artifacts, refresh=False):
+    """Download complete Census dataset for all ZIP codes into the artifact cache"""
     params = {
-        "get": "B19013_001E,B01003_001E,NAME", # Median income, Population, Name
+        "get": CENSUS_FIELDS,
         "for": "zip code tabulation area:*",
         "key": api_key
     }
-    
-    try:
-        log_progress("Requesting demographic data from Census API...")
-        response = requests.get(base_url, params=params)
-        if response.status_code != 200:
-            log_progress(f"Error downloading Census data: {response.status_code}")
-            log_progress(f"Response: {response.text}")
-            return None
-            
-        data = response.json()
-        log_progress(f"Received data for {len(data)-1} ZIP codes")
-        
-        # Convert to DataFrame
-        log_progress("Converting Census data to DataFrame...")
-        columns = ['median_household_income', 'population', 'name', 'zip_code']
-        df = pd.DataFrame(data[1:], columns=columns)
-        
-        # Extract ZIP code and ensure 5 digits with leading zeros
-        df['zip_code'] = df['zip_code'].str.zfill(5)
-        
-        # Convert data types
-        log_progress("Converting data types...")
-        df['median_household_income'] = pd.to_numeric(df['median_household_income'], errors='coerce')
-        df['population'] = pd.to_numeric(df['population'], errors='coerce')
-        
-        # Select final columns
-        result_df = df[['zip_code', 'median_household_income', 'population']]
-        
-        elapsed_time = time.time() - start_time
-        log_progress(f"Data collection completed in {elapsed_time:.1f} seconds")
-        
-        return result_df
-        
-    except Exception as e:
-        log_progress(f"Error downloading Census data: {str(e)}")
-        return None
-
-def get_income_bucket(income):
-    """Categorize income into buckets"""
-    if pd.isna(income):
-        return 'Unknown'
-    elif income < 100000:
-        return 'Under $100k'
-    elif income < 125000:
-        return '$100k-$125k'
-    elif income < 150000:
-        return '$125k-$150k'
-    elif income < 175000:
-        return '$150k-$175k'
-    elif income < 200000:
-        return '$175k-$200k'
-    elif income < 250000:
-        return '$200k-$250k'
-    else:
-        return '$250k+'
+    log_progress("Requesting demographic data from Census API...")
+    path = artifacts.download(CENSUS_URL, CENSUS_ARTIFACT, params=params, refresh=refresh)
+    return hash_file(path)
 
-def get_population_bucket(population):
-    """Categorize population into buckets"""
-    if pd.isna(population):
-        return 'Unknown'
-    elif population < 1000:
-        return 'Under 1,000'
-    elif population < 5000:
-        return '1,000-5,000'
-    elif population < 10000:
-        return '5,000-10,000'
-    elif population < 25000:
-        return '10,000-25,000'
-    elif population < 40000:
-        return '25,000-40,000'
-    else:
-        return '40,000+'
+def load_census_data(path):
+    """Parse a downloaded Census API response into one row per ZIP code"""
+    start_time = time.time()
+    with open(path) as f:
+        data = json.load(f)
+    log_progress(f"Received data for {len(data)-1} ZIP codes")
+    
+    # Convert to DataFrame
+    log_progress("Converting Census data to DataFrame...")
+    columns = ['median_household_income', 'population', 'name', 'zip_code']
+    df = pd.DataFrame(data[1:], columns=columns)
+    
+    # Extract ZIP code and ensure 5 digits with leading zeros
+    df['zip_code'] = df['zip_code'].str.zfill(5)
+    
+    # Convert data types
+    log_progress("Converting data types...")
+    df['median_household_income'] = pd.to_numeric(df['median_household_income'], errors='coerce')
+    df['population'] = pd.to_numeric(df['population'], errors='coerce')
+    
+    # Select final columns
+    result_df = df[['zip_code', 'median_household_income', 'population']]
+    
+    elapsed_time = time.time() - start_time
+    log_progress(f"Data collection completed in {elapsed_time:.1f} seconds")
+    
+    return result_df
 
-def create_zip_demographics_table(census_api_key):
+def create_zip_demographics_table(census_path):
     log_progress("Creating ZIP demographics table...")
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS zip_demographics (
@@ -173,29 +156,26 @@ def create_zip_demographics_table(census_api_key):
         median_household_income INTEGER,
         population INTEGER,
         income_bucket TEXT,
-        population_bucket TEXT
+        population_bucket TEXT,
+        row_hash TEXT  -- Change detection, see pipeline.py
     )
     ''')
     
-    # Download complete Census dataset
-    df = download_census_data(census_api_key)
-    if df is None:
-        log_progress("Failed to download Census data")
-        return
+    df = load_census_data(census_path)
         
     log_progress(f"Processing {len(df)} ZIP codes...")
     
     # Add bucketed columns
     log_progress("Creating income and population buckets...")
-    df['income_bucket'] = df['median_household_income'].apply(get_income_bucket)
-    df['population_bucket'] = df['population'].apply(get_population_bucket)
+    df['income_bucket'] = assign_buckets(df['median_household_income'], INCOME_BUCKETS)
+    df['population_bucket'] = assign_buckets(df['population'], POPULATION_BUCKETS)
     
-    # Insert data into the table
+    # Write only the ZIPs whose figures or buckets changed
     start_time = time.time()
-    log_progress("Inserting data into database...")
-    df.to_sql('zip_demographics', conn, if_exists='replace', index=False)
+    log_progress("Syncing data into database...")
+    content_hash = sync_rows(conn, 'zip_demographics', df, ['zip_code'])
     elapsed_time = time.time() - start_time
-    log_progress(f"Database insert completed in {elapsed_time:.1f} seconds")
+    log_progress(f"Database sync completed in {elapsed_time:.1f} seconds")
     log_progress("ZIP demographics table created successfully!")
     
     # Print bucket distribution
@@ -208,6 +188,141 @@ def create_zip_demographics_table(census_api_key):
     pop_dist = df['population_bucket'].value_counts()
     for bucket, count in pop_dist.items():
         log_progress(f"- {bucket}: {count:,} ZIP codes ({count/len(df)*100:.1f}%)")
+    
+    return content_hash
+
+def create_college_context_table():
+    """Materialize one compact row per college with its ZIP's demographics and coordinates"""
+    log_progress("Building college context table...")
+    start_time = time.time()
+    
+    colleges = pd.read_sql_query("""
+        SELECT rowid AS id, NAME, ADDRESS, CITY, STATE, ZIP, TELEPHONE, POPULATION,
+               COUNTY, COUNTYFIPS, WEBSITE, LATITUDE, LONGITUDE
+        FROM colleges
+    """, conn)
+    # Match on the 5-digit ZIP, whatever form the source column took
+    colleges['ZIP'] = colleges['ZIP'].astype(str).str.split('-').str[0].str.zfill(5)
+    
+    demographics = pd.read_sql_query("""
+        SELECT zip_code, median_household_income, population AS zip_population,
+               income_bucket, population_bucket
+        FROM zip_demographics
+    """, conn)
+    # Column names are case-insensitive in SQL, so the ZIP centroid gets its own names
+    coordinates = pd.read_sql_query("""
+        SELECT zip_code, latitude AS latitude_zip, longitude AS longitude_zip
+        FROM zip_coordinates
+    """, conn)
+    
+    # Density and the ZCTA polygons come from get_zip_boundaries.py, which on
+    # a first run fills them in later
+    boundary_columns = table_columns(conn, 'zip_boundaries')
+    if 'population_density' in boundary_columns:
+        densities = pd.read_sql_query("SELECT zip_code, population_density FROM zip_boundaries", conn)
+    else:
+        densities = pd.DataFrame({'zip_code': pd.Series(dtype=object), 'population_density': pd.Series(dtype=float)})
+    
+    # The ZIP column is often a ZIP+4 or a PO-box ZIP with no ZCTA, so colleges are
+    # placed in the ZCTA polygon containing their coordinates where possible
+    if table_columns(conn, 'zcta_polygons'):
+        colleges = colleges.join(assign_college_zctas(conn, colleges))
+    else:
+        colleges['zcta'] = colleges['ZIP']
+        colleges['zcta_method'] = 'zip'
+    
+    df = colleges.merge(demographics, how='left', left_on='zcta', right_on='zip_code').drop(columns=['zip_code'])
+    df = df.merge(coordinates, how='left', left_on='zcta', right_on='zip_code').drop(columns=['zip_code'])
+    df = df.merge(densities, how='left', left_on='zcta', right_on='zip_code').drop(columns=['zip_code'])
+    
+    # Build the new copy beside the live table, then swap it in one transaction
+    cursor.execute("DROP TABLE IF EXISTS college_context_new")
+    cursor.execute('''
+    CREATE TABLE college_context_new (
+        id INTEGER PRIMARY KEY,
+        NAME TEXT,
+        ADDRESS TEXT,
+        CITY TEXT,
+        STATE TEXT,
+        ZIP TEXT,
+        TELEPHONE TEXT,
+        POPULATION INTEGER,
+        COUNTY TEXT,
+        COUNTYFIPS TEXT,
+        WEBSITE TEXT,
+        LATITUDE REAL,
+        LONGITUDE REAL,
+        median_household_income INTEGER,
+        zip_population INTEGER,
+        income_bucket TEXT,
+        population_bucket TEXT,
+        latitude_zip REAL,
+        longitude_zip REAL,
+        population_density REAL,  -- People per square kilometer in the ZIP
+        zcta TEXT,  -- ZCTA the demographics come from
+        zcta_method TEXT  -- 'polygon', 'nearest' or 'zip', see zcta_assignment.py
+    )
+    ''')
+    df.to_sql('college_context_new', conn, if_exists='append', index=False)
+    conn.commit()
+    
+    cursor.execute("BEGIN")
+    cursor.execute("DROP TABLE IF EXISTS college_context")
+    cursor.execute("ALTER TABLE college_context_new RENAME TO college_context")
+    cursor.execute("CREATE INDEX idx_college_context_income ON college_context(median_household_income, zip_population)")
+    cursor.execute("CREATE INDEX idx_college_context_population ON college_context(zip_population, median_household_income)")
+    cursor.execute("CREATE INDEX idx_college_context_buckets ON college_context(income_bucket, population_bucket)")
+    # On where the app places each college, its own coordinates or its ZIP's centroid (see app.COLLEGE_LATITUDE)
+    cursor.execute("""
+        CREATE INDEX idx_college_context_location
+        ON college_context(COALESCE(LATITUDE, latitude_zip), COALESCE(LONGITUDE, longitude_zip))
+    """)
+    cursor.execute("CREATE INDEX idx_college_context_density ON college_context(population_density)")
+    cursor.execute("CREATE INDEX idx_college_context_zcta ON college_context(zcta)")
+    # Sort keys of the college table; the id primary key rides along in each,
+    # so ORDER BY <column>, id and its keyset pages are read off the index
+    for name, column in COLLEGE_SORT_INDEXES:
+        cursor.execute(f"CREATE INDEX idx_college_context_sort_{name} ON college_context({column})")
+    create_college_search_table(cursor, 'college_context')
+    conn.commit()
+    
+    matched = df['median_household_income'].notna().sum()
+    by_polygon = (df['zcta_method'] == 'polygon').sum()
+    elapsed_time = time.time() - start_time
+    log_progress(f"College context built for {len(df)} colleges ({by_polygon} placed in a ZCTA by location, "
+                 f"{matched} matched to ZIP demographics) in {elapsed_time:.1f} seconds")
+
+def rebucket_tables():
+    """Relabel existing rows after the thresholds in buckets.py change"""
+    log_progress("Re-bucketing existing rows...")
+    start_time = time.time()
+    
+    # college_context carries copies of the buckets, so it is relabelled in the same transaction
+    cursor.execute("BEGIN")
+    cursor.execute(f"""
+        UPDATE zip_demographics SET
+            income_bucket = {bucket_case_sql('median_household_income', INCOME_BUCKETS)},
+            population_bucket = {bucket_case_sql('population', POPULATION_BUCKETS)}
+    """)
+    log_progress(f"Relabelled {cursor.rowcount:,} ZIP codes")
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'college_context'")
+    has_college_context = cursor.fetchone() is not None
+    if has_college_context:
+        cursor.execute(f"""
+            UPDATE college_context SET
+                income_bucket = {bucket_case_sql('median_household_income', INCOME_BUCKETS)},
+                population_bucket = {bucket_case_sql('zip_population', POPULATION_BUCKETS)}
+        """)
+        log_progress(f"Relabelled {cursor.rowcount:,} colleges")
+    conn.commit()
+    
+    # The rollups are grouped by bucket, so they are regrouped before the new version is stamped
+    if has_college_context:
+        run_rollup_stage(conn)
+    
+    elapsed_time = time.time() - start_time
+    log_progress(f"Re-bucketing completed in {elapsed_time:.2f} seconds")
+    log_progress("Run 'python get_zip_boundaries.py --dissolve-only' to rebuild the merged regions")
 
 def summarize_database():
     """Print summary of all tables in the database"""
@@ -241,23 +356,64 @@ def summarize_database():
     log_progress(f"- Fields: {', '.join(coordinates_fields)}")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python database_setup.py <census_api_key>")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if '--rebucket' in sys.argv:
+        rebucket_tables()
+        version = stamp_data_version(conn)
+        write_label_artifact(conn, version)
+        log_progress(f"Data version is now {version}")
+        conn.close()
+        sys.exit(0)
+    
+    if len(args) != 1:
+        print("Usage: python database_setup.py <census_api_key> [--refresh]")
+        print("       python database_setup.py --rebucket")
         sys.exit(1)
         
-    census_api_key = sys.argv[1]
+    census_api_key = args[0]
+    # Re-download remote inputs even if a cached copy exists
+    refresh = '--refresh' in sys.argv
     
     total_start_time = time.time()
     log_progress("Starting database setup...")
     
-    # Create all tables
-    create_colleges_table()
-    create_zip_coordinates_table()
-    create_zip_demographics_table(census_api_key)
+    # Each stage reruns only when its inputs changed, and a failed run
+    # picks up again at the stage that failed
+    pipeline = Pipeline(conn, 'database_setup')
+    artifacts = ArtifactCache()
+    colleges_hash = pipeline.run_stage('colleges', [hash_file(COLLEGES_CSV)], create_colleges_table)
+    coordinates_hash = pipeline.run_stage(
+        'zip_coordinates', [hash_file(ZIP_COORDINATES_CSV)], create_zip_coordinates_table
+    )
+    pipeline.run_stage(
+        'census_download', [CENSUS_URL, CENSUS_FIELDS],
+        lambda: download_census_data(census_api_key, artifacts, refresh),
+        force=refresh or not os.path.exists(artifacts.path(CENSUS_ARTIFACT))
+    )
+    # Keyed on the response's content, so an identical re-download changes nothing downstream
+    demographics_hash = pipeline.run_stage(
+        'zip_demographics', [hash_file(artifacts.path(CENSUS_ARTIFACT)), INCOME_BUCKETS, POPULATION_BUCKETS],
+        lambda: create_zip_demographics_table(artifacts.path(CENSUS_ARTIFACT))
+    )
+    pipeline.run_stage(
+        'college_context', [colleges_hash, coordinates_hash, demographics_hash, COLLEGE_CONTEXT_LAYOUT],
+        create_college_context_table
+    )
+    # Per-state, county and bucket summaries for /api/rollup
+    if run_rollup_stage(conn):
+        pipeline.changed = True
     
     # Print database summary
     summarize_database()
     
+    # Let running app servers know their cached results are stale
+    if pipeline.changed:
+        version = stamp_data_version(conn)
+        write_label_artifact(conn, version)
+        log_progress(f"Data version is now {version}")
+    else:
+        log_progress("No inputs changed; data version left as is")
+    
     total_elapsed_time = time.time() - total_start_time
     log_progress(f"\nDatabase setup completed in {total_elapsed_time:.1f} seconds")
     conn.close()
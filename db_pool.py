@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection frees up within the acquire timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of reusable pymysql connections with health checks"""
+
+    def __init__(self, connect, max_size=10, acquire_timeout=5.0,
+                 recycle_seconds=3600, idle_timeout=300, ping_interval=30):
+        self._connect = connect
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.recycle_seconds = recycle_seconds
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+
+        self._cond = threading.Condition()
+        self._idle = []        # [conn, created_at, last_used], most recently used last
+        self._checked_out = {}  # id(conn) -> entry
+        self._size = 0          # open connections, idle + in use
+
+        self._stats = {
+            'created': 0,
+            'recycled': 0,
+            'health_check_failures': 0,
+            'acquired': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+        }
+
+    def _is_expired(self, entry, now):
+        """Check whether a connection is too old or has sat idle too long"""
+        conn, created_at, last_used = entry
+        if self.recycle_seconds and now - created_at > self.recycle_seconds:
+            return True
+        if self.idle_timeout and now - last_used > self.idle_timeout:
+            return True
+        return False
+
+    def _is_healthy(self, entry, now):
+        """Ping a connection that has been idle longer than the ping interval"""
+        conn, created_at, last_used = entry
+        if now - last_used < self.ping_interval:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding pooled connection after failed ping: {str(e)}")
+            with self._cond:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if there is room"""
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {self.acquire_timeout:.1f}s "
+                            f"({self._size} of {self.max_size} in use)"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+                entry = self._idle.pop() if self._idle else None
+                if entry is None:
+                    # Reserve the slot before connecting outside the lock
+                    self._size += 1
+
+            now = time.monotonic()
+            if entry is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                entry = [conn, now, now]
+                with self._cond:
+                    self._stats['created'] += 1
+            elif self._is_expired(entry, now):
+                self._close(entry[0])
+                self._release_slot()
+                with self._cond:
+                    self._stats['recycled'] += 1
+                continue
+            elif not self._is_healthy(entry, now):
+                self._close(entry[0])
+                self._release_slot()
+                continue
+
+            with self._cond:
+                self._checked_out[id(entry[0])] = entry
+                self._stats['acquired'] += 1
+                if waited:
+                    self._stats['waits'] += 1
+                    self._stats['wait_time'] += time.monotonic() - start
+            return entry[0]
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is no longer usable"""
+        with self._cond:
+            entry = self._checked_out.pop(id(conn), None)
+        if entry is None:
+            self._close(conn)
+            return
+
+        now = time.monotonic()
+        if discard or (self.recycle_seconds and now - entry[1] > self.recycle_seconds):
+            self._close(conn)
+            self._release_slot()
+            if not discard:
+                with self._cond:
+                    self._stats['recycled'] += 1
+            return
+
+        entry[2] = now
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            # The connection may be half-broken, never hand it out again
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close(self):
+        """Close every idle connection"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Snapshot of pool usage counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['max_size'] = self.max_size
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = len(self._checked_out)
+        stats['avg_wait_time'] = stats['wait_time'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
@@ -0,0 +1,121 @@
+import json
+import struct
+
+import numpy as np
+import shapely
+
+# Binary alternative to GeoJSON text for polygon features.
+#
+# Coordinates are quantized to integers (QUANTIZE_SCALE units per degree) and
+# stored GeoArrow-style as flat int32 x/y pairs, with uint32 offset arrays
+# saying where each ring, polygon and feature starts. Every geometry is a
+# MultiPolygon. All numbers are little-endian.
+#
+# A single packed geometry, as stored per row in the database:
+#   uint32 polygon_count, ring_count, coord_count
+#   uint32 polygon_offsets[polygon_count + 1]   ring index where each polygon starts
+#   uint32 ring_offsets[ring_count + 1]         coord index where each ring starts
+#   int32  coords[coord_count * 2]
+#
+# A collection, as sent to the browser:
+#   4s     magic 'ZGEO'
+#   uint16 format version, uint16 flags (unused)
+#   uint32 feature_count, polygon_count, ring_count, coord_count
+#   float64 scale
+#   uint32 properties_length
+#   uint32 feature_offsets[feature_count + 1]   polygon index where each feature starts
+#   uint32 polygon_offsets[polygon_count + 1]
+#   uint32 ring_offsets[ring_count + 1]
+#   int32  coords[coord_count * 2]
+#   UTF-8 JSON array with one properties object per feature
+PACKED_GEOMETRY_MIMETYPE = 'application/vnd.zipgeom'
+MAGIC = b'ZGEO'
+FORMAT_VERSION = 1
+QUANTIZE_SCALE = 1e6  # About 0.1 m at the equator
+_GEOMETRY_HEADER = struct.Struct('<III')
+_COLLECTION_HEADER = struct.Struct('<4sHHIIIIdI')
+
+def pack_geometries(geometries):
+    """Pack an array of Polygon/MultiPolygon geometries into one blob each"""
+    geometries = np.asarray(geometries, dtype=object)
+    if len(geometries) == 0:
+        return []
+    geometry_type, coords, offsets = shapely.to_ragged_array(geometries)
+    if geometry_type == shapely.GeometryType.POLYGON:
+        # Only plain Polygons: each feature is a MultiPolygon with one part
+        ring_offsets, polygon_offsets = offsets
+        feature_offsets = np.arange(len(geometries) + 1)
+    else:
+        ring_offsets, polygon_offsets, feature_offsets = offsets
+    quantized = np.round(coords * QUANTIZE_SCALE).astype('<i4')
+    ring_offsets = ring_offsets.astype('<u4')
+    polygon_offsets = polygon_offsets.astype('<u4')
+
+    blobs = []
+    for i in range(len(geometries)):
+        first_polygon, last_polygon = feature_offsets[i], feature_offsets[i + 1]
+        first_ring, last_ring = polygon_offsets[first_polygon], polygon_offsets[last_polygon]
+        first_coord, last_coord = ring_offsets[first_ring], ring_offsets[last_ring]
+        blobs.append(b''.join([
+            _GEOMETRY_HEADER.pack(last_polygon - first_polygon, last_ring - first_ring, last_coord - first_coord),
+            (polygon_offsets[first_polygon:last_polygon + 1] - first_ring).tobytes(),
+            (ring_offsets[first_ring:last_ring + 1] - first_coord).tobytes(),
+            quantized[first_coord:last_coord].tobytes()
+        ]))
+    return blobs
+
+def pack_collection(blobs, properties):
+    """Join per-row packed geometries and their properties into one collection"""
+    feature_offsets = np.zeros(len(blobs) + 1, dtype='<u4')
+    polygon_parts = [np.zeros(1, dtype='<u4')]
+    ring_parts = [np.zeros(1, dtype='<u4')]
+    coord_parts = []
+    polygons = rings = coords = 0
+
+    for i, blob in enumerate(blobs):
+        polygon_count, ring_count, coord_count = _GEOMETRY_HEADER.unpack_from(blob)
+        offsets = np.frombuffer(blob, dtype='<u4', offset=_GEOMETRY_HEADER.size,
+                                count=polygon_count + ring_count + 2)
+        # Rebase the per-geometry offsets onto the collection's running totals
+        polygon_parts.append(offsets[1:polygon_count + 1] + rings)
+        ring_parts.append(offsets[polygon_count + 2:] + coords)
+        coord_parts.append(np.frombuffer(blob, dtype='<i4',
+                                         offset=_GEOMETRY_HEADER.size + 4 * (polygon_count + ring_count + 2),
+                                         count=2 * coord_count))
+        polygons += polygon_count
+        rings += ring_count
+        coords += coord_count
+        feature_offsets[i + 1] = polygons
+
+    properties_json = json.dumps(properties, separators=(',', ':')).encode('utf-8')
+    return b''.join([
+        _COLLECTION_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(blobs), polygons, rings, coords,
+                                QUANTIZE_SCALE, len(properties_json)),
+        feature_offsets.tobytes(),
+        np.concatenate(polygon_parts).astype('<u4').tobytes(),
+        np.concatenate(ring_parts).astype('<u4').tobytes(),
+        np.concatenate(coord_parts).astype('<i4').tobytes() if coord_parts else b'',
+        properties_json
+    ])
+
+def unpack_collection(data):
+    """Decode a packed collection back into shapely MultiPolygons and properties"""
+    (magic, version, _, feature_count, polygon_count, ring_count, coord_count,
+     scale, properties_length) = _COLLECTION_HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a packed geometry collection")
+
+    offset = _COLLECTION_HEADER.size
+    arrays = []
+    for count in (feature_count + 1, polygon_count + 1, ring_count + 1):
+        arrays.append(np.frombuffer(data, dtype='<u4', offset=offset, count=count).astype(np.int64))
+        offset += 4 * count
+    feature_offsets, polygon_offsets, ring_offsets = arrays
+    coords = np.frombuffer(data, dtype='<i4', offset=offset, count=2 * coord_count).reshape(-1, 2) / scale
+    offset += 8 * coord_count
+    properties = json.loads(data[offset:offset + properties_length])
+
+    geometries = shapely.from_ragged_array(
+        shapely.GeometryType.MULTIPOLYGON, coords, (ring_offsets, polygon_offsets, feature_offsets)
+    )
+    return geometries, properties
@@ -0,0 +1,29 @@
+# Levels of detail for ZIP boundary geometry.
+#
+# Level 0 is the full-resolution geometry in zip_boundaries.geometry. Every
+# other level is generated by get_zip_boundaries.py into zip_boundary_lods and
+# is served up to and including its max_zoom. Tolerances and grid sizes are in
+# degrees and sit below half a screen pixel of longitude at the level's max
+# zoom (half_pixel_degrees, on 256-pixel tiles), so the simplification is
+# invisible at the zooms it is used for. Mercator stretches latitude away from
+# the equator, so north of about 45 degrees an error along it can reach a
+# pixel; and a ZIP still over max_vertices is simplified further (see
+# geometry_workers.simplify_for_level).
+LOD_LEVELS = [
+    {'lod': 3, 'max_zoom': 6, 'tolerance': 0.01, 'grid_size': 0.001, 'max_vertices': 64},
+    {'lod': 2, 'max_zoom': 9, 'tolerance': 0.0012, 'grid_size': 0.0001, 'max_vertices': 256},
+    {'lod': 1, 'max_zoom': 12, 'tolerance': 0.00015, 'grid_size': 0.00001, 'max_vertices': 1024},
+]
+
+FULL_RESOLUTION_LOD = 0
+
+def half_pixel_degrees(zoom):
+    """Degrees of longitude in half a pixel of a 256-pixel tile at a zoom"""
+    return 360 / (256 * 2 ** zoom) / 2
+
+def lod_for_zoom(zoom):
+    """Pick the coarsest level of detail that still looks exact at a zoom"""
+    for level in LOD_LEVELS:
+        if zoom <= level['max_zoom']:
+            return level['lod']
+    return FULL_RESOLUTION_LOD
@@ -0,0 +1,185 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+
+from geometry_codec import pack_geometries
+
+# Processes used for geometry work in the setup scripts; 1 keeps it all in-process
+GEOMETRY_WORKERS = int(os.getenv('GEOMETRY_WORKERS', '0')) or os.cpu_count() or 1
+# Features per task: large enough to amortize pickling, small enough to balance the load
+GEOMETRY_CHUNK_SIZE = int(os.getenv('GEOMETRY_CHUNK_SIZE', '500'))
+
+# ZCTA shapes are NAD83 longitude/latitude. Areas are measured after projecting
+# to an equal-area CRS that covers every state and territory; perimeters are
+# geodesic on the NAD83 (GRS80) ellipsoid, since no equal-area projection
+# also preserves distances
+SOURCE_CRS = 'EPSG:4269'
+EQUAL_AREA_CRS = 'EPSG:6933'
+GEOD = pyproj.Geod(ellps='GRS80')
+
+def log_progress(message):
+    """Log a message with timestamp"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}")
+
+class GeometryPool:
+    """Process pool for geometry work that always returns results in input order"""
+
+    def __init__(self, workers=GEOMETRY_WORKERS, chunk_size=GEOMETRY_CHUNK_SIZE):
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self._executor = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            self._executor = ProcessPoolExecutor(self.workers)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def map(self, function, *iterables):
+        """function applied to each item, in parallel when the pool has workers"""
+        if self._executor is None:
+            return list(map(function, *iterables))
+        return list(self._executor.map(function, *iterables))
+
+    def map_chunks(self, function, *arrays):
+        """function applied to aligned consecutive chunks of equal-length arrays"""
+        length = len(arrays[0])
+        starts = range(0, length, self.chunk_size)
+        chunked = [[array[start:start + self.chunk_size] for start in starts] for array in arrays]
+        return self.map(function, *chunked)
+
+def repair_geometries(geometries):
+    """Make invalid polygons valid without turning them into lines or points"""
+    geometries = np.asarray(geometries, dtype=object).copy()
+    invalid = ~shapely.is_valid(geometries)
+    if invalid.any():
+        try:
+            geometries[invalid] = shapely.make_valid(geometries[invalid], method='structure', keep_collapsed=False)
+        except TypeError:
+            # Shapely before 2.1 only has the default linework method
+            geometries[invalid] = shapely.make_valid(geometries[invalid])
+    return geometries
+
+@lru_cache(maxsize=None)
+def _equal_area_transformer():
+    # Built on first use in each worker process rather than pickled across
+    return pyproj.Transformer.from_crs(SOURCE_CRS, EQUAL_AREA_CRS, always_xy=True)
+
+def _to_equal_area(coords):
+    x, y = _equal_area_transformer().transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y])
+
+def measure_geometries(geometries):
+    """Area in square meters and perimeter in meters of an array of lon/lat polygons"""
+    area = shapely.area(shapely.transform(geometries, _to_equal_area))
+
+    # Every ring edge of every polygon in one flat array, measured in one geodesic call
+    parts, part_geometry = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    same_ring = coord_ring[1:] == coord_ring[:-1]
+    start, end = coords[:-1][same_ring], coords[1:][same_ring]
+    _, _, lengths = GEOD.inv(start[:, 0], start[:, 1], end[:, 0], end[:, 1])
+    edge_geometry = part_geometry[ring_part[coord_ring[:-1][same_ring]]]
+    perimeter = np.bincount(edge_geometry, weights=lengths, minlength=len(geometries))
+    return area, perimeter
+
+def serialize_boundaries(zip_codes, geometries):
+    """zip_boundaries rows for one chunk of ZCTA features"""
+    geometries = repair_geometries(geometries)
+    bounds = shapely.bounds(geometries)
+    area, perimeter = measure_geometries(geometries)
+    return pd.DataFrame({
+        'zip_code': zip_codes,
+        'geometry': shapely.to_geojson(geometries),
+        'geometry_packed': pack_geometries(geometries),
+        'area_sq_meters': area,
+        'perimeter_meters': perimeter,
+        # Bounding box so off-screen ZIPs can be skipped without parsing geometry
+        'min_lon': bounds[:, 0],
+        'min_lat': bounds[:, 1],
+        'max_lon': bounds[:, 2],
+        'max_lat': bounds[:, 3]
+    })
+
+def serialize_zcta_polygons(zip_codes, geometries):
+    """zcta_polygons rows for one chunk of ZCTA features"""
+    geometries = repair_geometries(geometries)
+    bounds = shapely.bounds(geometries)
+    return pd.DataFrame({
+        'zip_code': zip_codes,
+        'shape': shapely.to_wkb(geometries),
+        'min_lon': bounds[:, 0],
+        'min_lat': bounds[:, 1],
+        'max_lon': bounds[:, 2],
+        'max_lat': bounds[:, 3]
+    })
+
+def simplify_for_level(geometries, level):
+    """Simplify an array of ZIP polygons for one level of detail"""
+    # Coverage simplification keeps the edges shared by neighbouring ZIPs
+    # identical, so no gaps or overlaps open up between them
+    try:
+        simplified = shapely.coverage_simplify(geometries, level['tolerance'])
+    except (AttributeError, shapely.errors.GEOSException) as e:
+        # Older shapely, or polygons that do not form a clean coverage
+        log_progress(f"Coverage simplification unavailable ({str(e)}), simplifying per ZIP")
+        simplified = shapely.simplify(geometries, level['tolerance'], preserve_topology=True)
+
+    # Keep simplifying anything still over the vertex budget on its own
+    tolerance = level['tolerance']
+    for _ in range(10):
+        over_budget = shapely.get_num_coordinates(simplified) > level['max_vertices']
+        if not over_budget.any():
+            break
+        tolerance *= 2
+        simplified[over_budget] = shapely.simplify(simplified[over_budget], tolerance, preserve_topology=True)
+
+    # Snap to a grid to shorten the coordinate text, unless that collapses the shape
+    snapped = shapely.set_precision(simplified, level['grid_size'])
+    collapsed = shapely.is_empty(snapped)
+    snapped[collapsed] = simplified[collapsed]
+    return snapped
+
+def build_lod_level(geometries, level):
+    """GeoJSON, packed geometry and vertex counts of every ZIP at one level of detail"""
+    # The whole coverage is simplified at once so shared edges stay shared,
+    # which is why levels rather than chunks of ZIPs run in parallel
+    simplified = simplify_for_level(np.asarray(geometries, dtype=object).copy(), level)
+    return shapely.to_geojson(simplified), pack_geometries(simplified), shapely.get_num_coordinates(simplified)
+
+def dissolve_regions(zip_codes, geojson, tolerance, grid_size):
+    """Union one bucket combination's ZIPs into connected regions, largest first"""
+    geometries = repair_geometries(shapely.from_geojson(geojson))
+    union = shapely.union_all(geometries)
+
+    # Each connected polygon of the union is one region, largest first. A
+    # repair can leave lines or points beside the polygons, which have no
+    # area and cannot be packed, so only the polygons are kept
+    regions = shapely.get_parts(union)
+    regions = regions[shapely.get_type_id(regions) == shapely.GeometryType.POLYGON]
+    regions = regions[np.argsort(-shapely.area(regions), kind='stable')]
+    simplified = shapely.simplify(regions, tolerance, preserve_topology=True)
+    simplified = shapely.set_precision(simplified, grid_size)
+    collapsed = shapely.is_empty(simplified)
+    simplified[collapsed] = regions[collapsed]
+
+    # Assign each ZIP to the region containing a point inside it
+    tree = shapely.STRtree(regions)
+    zip_idx, region_idx = tree.query(shapely.point_on_surface(geometries), predicate='intersects')
+    members = [[] for _ in regions]
+    for z, r in zip(zip_idx, region_idx):
+        members[r].append(zip_codes[z])
+
+    return shapely.to_geojson(simplified), pack_geometries(simplified), shapely.bounds(simplified), members
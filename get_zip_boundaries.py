@@ -1,121 +1,447 @@
-import geopandas as gpd
 import pandas as pd
 import sqlite3
-import requests
-import zipfile
-import io
+import sys
+import hashlib
 import os
+import zipfile
+import argparse
 from datetime import datetime
-from shapely.geometry import shape, mapping
-import json
+import pyogrio
+import shapely
+import numpy as np
+from geometry_lod import LOD_LEVELS
+from data_version import stamp_data_version
+from geometry_workers import (GEOMETRY_WORKERS, EQUAL_AREA_CRS, GeometryPool, build_lod_level, dissolve_regions,
+                              serialize_boundaries, serialize_zcta_polygons)
+from buckets import INCOME_BUCKETS, write_label_artifact
+from pipeline import ArtifactCache, Pipeline, RowSyncer, hash_dataframe, hash_file, hash_values, sync_rows, table_columns
+from zcta_assignment import assign_college_zctas
+from rollups import run_rollup_stage
 
 def log_progress(message):
     """Log a message with timestamp"""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     print(f"[{timestamp}] {message}")
 
-def download_and_extract_zcta_shapefile():
-    """Download and extract ZCTA shapefile from Census TIGER/Line"""
+def ensure_columns(cursor, table, columns):
+    """Add any missing columns to a table created by an earlier run"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+# 2023 ZCTA shapefile
+ZCTA_URL = "https://www2.census.gov/geo/tiger/TIGER2023/ZCTA520/tl_2023_us_zcta520.zip"
+ZCTA_ARTIFACT = 'tl_2023_us_zcta520.zip'
+
+def download_zcta_shapefile(artifacts, refresh=False):
+    """Download the ZCTA shapefile archive from Census TIGER/Line into the artifact cache"""
     log_progress("Downloading ZCTA shapefile from Census...")
+    path = artifacts.download(ZCTA_URL, ZCTA_ARTIFACT, refresh=refresh)
+    log_progress("ZCTA shapefile ready")
+    return hash_file(path)
+
+def zcta_shapefile_path(zip_path):
+    """GDAL path to the shapefile inside the downloaded archive, read without extracting it"""
+    return f"/vsizip/{os.path.abspath(zip_path)}/tl_2023_us_zcta520.shp"
+
+# Memory budget for the boundary ingest, and roughly how many times its size
+# on disk a feature takes up while it is parsed, serialized and written
+INGEST_MAX_MEMORY_MB = int(os.getenv('BOUNDARY_INGEST_MAX_MEMORY_MB', '512'))
+INGEST_MEMORY_FACTOR = 8
+
+def read_feature_sizes(zip_path):
+    """Size in bytes of every shapefile record, indexed by feature id, from the .shx index"""
+    with zipfile.ZipFile(zip_path) as archive:
+        shx = archive.read('tl_2023_us_zcta520.shx')
+    # 100-byte header, then a big-endian (offset, length) pair per record, both in 16-bit words
+    records = np.frombuffer(shx, dtype='>i4', offset=100).reshape(-1, 2)
+    return records[:, 1].astype(np.int64) * 2
+
+def plan_ingest_batches(fids, feature_sizes, max_memory_mb):
+    """Split feature ids into consecutive batches that each fit the memory budget"""
+    if len(fids) == 0:
+        return []
+    costs = feature_sizes[fids] * INGEST_MEMORY_FACTOR
+    budget = max_memory_mb * 1024 * 1024
+    batch_ids = np.cumsum(costs) // budget
+    return np.split(fids, np.flatnonzero(np.diff(batch_ids)) + 1)
+
+def create_zip_boundary_lods(conn, pool):
+    """Store simplified copies of each ZIP boundary, one row per level of detail"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS zip_boundary_lods (
+        zip_code TEXT,
+        lod INTEGER,
+        geometry TEXT,  -- GeoJSON format
+        geometry_packed BLOB,  -- Quantized binary, see geometry_codec.py
+        vertex_count INTEGER,
+        row_hash TEXT,  -- Change detection, see pipeline.py
+        PRIMARY KEY (zip_code, lod)
+    )
+    ''')
+    ensure_columns(cursor, 'zip_boundary_lods', {'geometry_packed': 'BLOB'})
     
-    # 2023 ZCTA shapefile URL
-    url = "https://www2.census.gov/geo/tiger/TIGER2023/ZCTA520/tl_2023_us_zcta520.zip"
+    # Simplify every ZIP together so shared edges stay shared, then write only the rows that changed
+    boundaries = pd.read_sql_query("SELECT zip_code, geometry FROM zip_boundaries ORDER BY zip_code", conn)
+    zip_codes = boundaries['zip_code'].to_numpy()
+    geometries = shapely.from_geojson(boundaries['geometry'].to_numpy())
+    full_vertices = int(shapely.get_num_coordinates(geometries).sum())
     
-    try:
-        # Download the zip file
-        response = requests.get(url)
-        if response.status_code != 200:
-            raise Exception(f"Failed to download shapefile: {response.status_code}")
-        
-        import shutil
-        
-        # Force remove temp directory if it exists
-        if os.path.exists('temp'):
-            shutil.rmtree('temp', ignore_errors=True)
-        
-        # Create a temporary directory for the files
-        os.makedirs('temp', exist_ok=True)
-        
-        # Save and extract the zip file
-        zip_path = 'temp/zcta.zip'
-        with open(zip_path, 'wb') as f:
-            f.write(response.content)
-        
-        # Extract the files
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall('temp')
+    log_progress(f"Simplifying boundaries for {len(LOD_LEVELS)} levels of detail...")
+    results = pool.map(build_lod_level, [geometries] * len(LOD_LEVELS), LOD_LEVELS)
+    levels = []
+    for level, (geojson, packed, vertex_counts) in zip(LOD_LEVELS, results):
+        levels.append(pd.DataFrame({
+            'zip_code': zip_codes,
+            'lod': level['lod'],
+            'geometry': geojson,
+            'geometry_packed': packed,
+            'vertex_count': vertex_counts
+        }))
+        log_progress(f"LOD {level['lod']}: {int(vertex_counts.sum()):,} vertices "
+                     f"(full resolution {full_vertices:,}), max {int(vertex_counts.max()) if len(vertex_counts) else 0} per ZIP")
+    
+    return sync_rows(conn, 'zip_boundary_lods', pd.concat(levels, ignore_index=True), ['zip_code', 'lod'])
+
+# Simplification applied to dissolved regions, in degrees
+MERGED_TOLERANCE = 0.0005
+MERGED_GRID_SIZE = 0.00001
+
+def create_merged_boundaries_table(conn, pool):
+    """Dissolve adjacent ZIPs that share an income and population bucket into regions"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS merged_boundary_groups (
+        income_bucket TEXT,
+        population_bucket TEXT,
+        source_hash TEXT,  -- Hash of member ZIPs, their geometry and the simplification settings
+        zip_count INTEGER,
+        region_count INTEGER,
+        updated_at TEXT,
+        PRIMARY KEY (income_bucket, population_bucket)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS merged_boundaries (
+        income_bucket TEXT,
+        population_bucket TEXT,
+        region_id INTEGER,
+        geometry TEXT,  -- GeoJSON format
+        geometry_packed BLOB,  -- Quantized binary, see geometry_codec.py
+        zip_count INTEGER,
+        zip_codes TEXT,  -- Comma separated
+        min_lon REAL,
+        min_lat REAL,
+        max_lon REAL,
+        max_lat REAL,
+        PRIMARY KEY (income_bucket, population_bucket, region_id)
+    )
+    ''')
+    ensure_columns(cursor, 'merged_boundaries', {'geometry_packed': 'BLOB'})
+    
+    log_progress("Loading boundaries for dissolve...")
+    df = pd.read_sql_query("""
+        SELECT b.zip_code, b.geometry, d.income_bucket, d.population_bucket
+        FROM zip_boundaries b
+        JOIN zip_demographics d ON d.zip_code = b.zip_code
+        ORDER BY b.zip_code
+    """, conn)
+    existing_hashes = dict(
+        ((income, population), source_hash)
+        for income, population, source_hash in cursor.execute(
+            'SELECT income_bucket, population_bucket, source_hash FROM merged_boundary_groups'
+        ).fetchall()
+    )
+    
+    seen = set()
+    stale = []
+    for (income_bucket, population_bucket), group in df.groupby(['income_bucket', 'population_bucket']):
+        key = (income_bucket, population_bucket)
+        seen.add(key)
         
-        log_progress("Successfully downloaded and extracted ZCTA shapefile")
-        return 'temp/tl_2023_us_zcta520.shp'
+        # Only recompute combinations whose members, their shapes or the simplification changed
+        digest = hashlib.sha1(f"{MERGED_TOLERANCE}:{MERGED_GRID_SIZE}".encode())
+        for zip_code, geometry in zip(group['zip_code'], group['geometry']):
+            digest.update(zip_code.encode())
+            digest.update(geometry.encode())
+        source_hash = digest.hexdigest()
+        if existing_hashes.get(key) != source_hash:
+            stale.append((key, source_hash, group))
     
-    except Exception as e:
-        log_progress(f"Error downloading shapefile: {str(e)}")
+    # Dissolve the combinations in parallel, then write them in a fixed order
+    results = pool.map(
+        dissolve_regions,
+        [group['zip_code'].to_numpy() for _, _, group in stale],
+        [group['geometry'].to_numpy() for _, _, group in stale],
+        [MERGED_TOLERANCE] * len(stale),
+        [MERGED_GRID_SIZE] * len(stale)
+    )
+    for ((income_bucket, population_bucket), source_hash, group), (geojson, packed, bounds, members) in zip(stale, results):
+        key = (income_bucket, population_bucket)
+        records = [
+            (income_bucket, population_bucket, region_id, geojson[region_id], packed[region_id], len(members[region_id]),
+             ','.join(sorted(set(members[region_id]))), *bounds[region_id].tolist())
+            for region_id in range(len(geojson))
+        ]
+        cursor.execute('DELETE FROM merged_boundaries WHERE income_bucket = ? AND population_bucket = ?', key)
+        cursor.executemany(
+            '''INSERT INTO merged_boundaries
+               (income_bucket, population_bucket, region_id, geometry, geometry_packed, zip_count, zip_codes,
+                min_lon, min_lat, max_lon, max_lat)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            records
+        )
+        cursor.execute(
+            '''INSERT OR REPLACE INTO merged_boundary_groups
+               (income_bucket, population_bucket, source_hash, zip_count, region_count, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (income_bucket, population_bucket, source_hash, len(group), len(records), datetime.now().isoformat())
+        )
+        log_progress(f"Dissolved {len(group)} ZIPs in {income_bucket} / {population_bucket} into {len(records)} regions")
+    
+    # Drop combinations that no longer have any ZIPs
+    for key in set(existing_hashes) - seen:
+        cursor.execute('DELETE FROM merged_boundaries WHERE income_bucket = ? AND population_bucket = ?', key)
+        cursor.execute('DELETE FROM merged_boundary_groups WHERE income_bucket = ? AND population_bucket = ?', key)
+    
+    conn.commit()
+    log_progress(f"Merged boundaries up to date ({len(stale)} of {len(seen)} bucket combinations rebuilt)")
+
+def load_boundary_zip_codes(conn):
+    """ZIP codes that get boundaries: those with demographics and coordinates, above the lowest income bucket"""
+    zip_codes = pd.read_sql_query("""
+        SELECT DISTINCT d.zip_code
+        FROM zip_demographics d
+        JOIN zip_coordinates c ON d.zip_code = c.zip_code
+        WHERE d.income_bucket != ?
+        ORDER BY d.zip_code
+    """, conn, params=(INCOME_BUCKETS[0]['label'],))
+    return zip_codes['zip_code'].tolist()
+
+def create_zip_boundaries_table(conn, pool, zip_path, zip_codes, max_memory_mb=INGEST_MAX_MEMORY_MB, bbox=None):
+    """Create a table with ZIP code boundary data, streaming the shapefile in memory-bounded batches"""
+    path = zcta_shapefile_path(zip_path)
+    
+    # Read only the ZIP attribute first (and only inside bbox, if given) to find
+    # which features qualify; the geometry of the rest is never loaded
+    log_progress("Indexing shapefile attributes...")
+    index = pyogrio.read_dataframe(path, columns=['ZCTA5CE20'], read_geometry=False,
+                                   fid_as_index=True, bbox=bbox)
+    qualifies = index['ZCTA5CE20'].astype(str).str.zfill(5).isin(set(zip_codes))
+    fids = index.index[qualifies].to_numpy()
+    batches = plan_ingest_batches(fids, read_feature_sizes(zip_path), max_memory_mb)
+    log_progress(f"Loading {len(fids)} of {len(index)} ZIP code boundaries in {len(batches)} batches "
+                 f"(memory budget {max_memory_mb} MB)")
+    
+    # Create a new table for the boundaries
+    log_progress("Creating ZIP boundaries table...")
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS zip_boundaries (
+        zip_code TEXT PRIMARY KEY,
+        geometry TEXT,  -- GeoJSON format
+        geometry_packed BLOB,  -- Quantized binary, see geometry_codec.py
+        area_sq_meters REAL,  -- Measured in an equal-area projection
+        perimeter_meters REAL,  -- Geodesic
+        population_density REAL,  -- People per square kilometer, see update_population_density
+        min_lon REAL,  -- Bounding box used by the viewport API
+        min_lat REAL,
+        max_lon REAL,
+        max_lat REAL,
+        row_hash TEXT  -- Change detection, see pipeline.py
+    )
+    ''')
+    ensure_columns(cursor, 'zip_boundaries', {
+        'min_lon': 'REAL',
+        'min_lat': 'REAL',
+        'max_lon': 'REAL',
+        'max_lat': 'REAL',
+        'geometry_packed': 'BLOB',
+        'population_density': 'REAL'
+    })
+    
+    # Create an index on zip_code if it doesn't exist
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_zip_boundaries_zip ON zip_boundaries(zip_code)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_zip_boundaries_bbox ON zip_boundaries(min_lon, max_lon, min_lat, max_lat)')
+    
+    # Serialize and write each batch before reading the next, keeping only ZIPs that changed
+    syncer = RowSyncer(conn, 'zip_boundaries', ['zip_code'])
+    for number, batch_fids in enumerate(batches, start=1):
+        batch = pyogrio.read_dataframe(path, columns=['ZCTA5CE20'], fids=batch_fids)
+        # Repair, serialize and measure chunks of the batch on every core
+        records = pool.map_chunks(
+            serialize_boundaries,
+            batch['ZCTA5CE20'].astype(str).str.zfill(5).to_numpy(),
+            np.asarray(batch.geometry.values, dtype=object)
+        )
+        syncer.write(pd.concat(records, ignore_index=True))
+        log_progress(f"Batch {number}/{len(batches)}: {len(batch_fids)} ZIP code boundaries")
+        del batch
+    content_hash = syncer.finish()
+    log_progress(f"Successfully synced {len(fids)} ZIP code boundaries to database")
+    return content_hash
+
+def create_zcta_polygons_table(conn, pool, zip_path, max_memory_mb=INGEST_MAX_MEMORY_MB, bbox=None):
+    """Store every ZCTA polygon, whatever its income, as WKB for placing colleges in the ZCTA containing them"""
+    path = zcta_shapefile_path(zip_path)
+    index = pyogrio.read_dataframe(path, columns=['ZCTA5CE20'], read_geometry=False,
+                                   fid_as_index=True, bbox=bbox)
+    fids = index.index.to_numpy()
+    batches = plan_ingest_batches(fids, read_feature_sizes(zip_path), max_memory_mb)
+    log_progress(f"Loading {len(fids)} ZCTA polygons for college placement in {len(batches)} batches")
+    
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS zcta_polygons (
+        zip_code TEXT PRIMARY KEY,
+        shape BLOB,  -- WKB, see zcta_assignment.py
+        min_lon REAL,  -- Bounding box, so only polygons near a college are parsed
+        min_lat REAL,
+        max_lon REAL,
+        max_lat REAL,
+        row_hash TEXT  -- Change detection, see pipeline.py
+    )
+    ''')
+    
+    syncer = RowSyncer(conn, 'zcta_polygons', ['zip_code'])
+    for batch_fids in batches:
+        batch = pyogrio.read_dataframe(path, columns=['ZCTA5CE20'], fids=batch_fids)
+        records = pool.map_chunks(
+            serialize_zcta_polygons,
+            batch['ZCTA5CE20'].astype(str).str.zfill(5).to_numpy(),
+            np.asarray(batch.geometry.values, dtype=object)
+        )
+        syncer.write(pd.concat(records, ignore_index=True))
+        del batch
+    content_hash = syncer.finish()
+    log_progress(f"Successfully synced {len(fids)} ZCTA polygons to database")
+    return content_hash
+
+def update_population_density(conn):
+    """Store people per square kilometer beside each ZIP's area"""
+    cursor = conn.cursor()
+    ensure_columns(cursor, 'zip_boundaries', {'population_density': 'REAL'})
+    cursor.execute('''
+        UPDATE zip_boundaries SET population_density = CASE WHEN area_sq_meters > 0 THEN (
+            SELECT d.population * 1000000.0 / zip_boundaries.area_sq_meters
+            FROM zip_demographics d
+            WHERE d.zip_code = zip_boundaries.zip_code
+        ) END
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_zip_boundaries_density ON zip_boundaries(population_density)')
+    conn.commit()
+    
+    densities = pd.read_sql_query("SELECT zip_code, population_density FROM zip_boundaries ORDER BY zip_code", conn)
+    log_progress(f"Population density stored for {densities['population_density'].notna().sum()} ZIP codes")
+    return hash_dataframe(densities)
+
+def update_college_zctas(conn):
+    """Place each college in the ZCTA containing it and refresh its copy of that ZCTA's figures"""
+    cursor = conn.cursor()
+    # database_setup.py builds college_context before the boundaries exist, so it is redone here
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'college_context'")
+    if not cursor.fetchone():
         return None
+    
+    colleges = pd.read_sql_query("SELECT id, LATITUDE, LONGITUDE, ZIP FROM college_context ORDER BY id", conn)
+    assignments = colleges[['id']].join(assign_college_zctas(conn, colleges))
+    ensure_columns(cursor, 'college_context', {'population_density': 'REAL', 'zcta': 'TEXT', 'zcta_method': 'TEXT'})
+    cursor.executemany(
+        'UPDATE college_context SET zcta = ?, zcta_method = ? WHERE id = ?',
+        assignments[['zcta', 'zcta_method', 'id']].itertuples(index=False, name=None)
+    )
+    cursor.execute('''
+        UPDATE college_context SET
+            median_household_income = (SELECT d.median_household_income FROM zip_demographics d WHERE d.zip_code = college_context.zcta),
+            zip_population = (SELECT d.population FROM zip_demographics d WHERE d.zip_code = college_context.zcta),
+            income_bucket = (SELECT d.income_bucket FROM zip_demographics d WHERE d.zip_code = college_context.zcta),
+            population_bucket = (SELECT d.population_bucket FROM zip_demographics d WHERE d.zip_code = college_context.zcta),
+            latitude_zip = (SELECT c.latitude FROM zip_coordinates c WHERE c.zip_code = college_context.zcta),
+            longitude_zip = (SELECT c.longitude FROM zip_coordinates c WHERE c.zip_code = college_context.zcta),
+            population_density = (SELECT b.population_density FROM zip_boundaries b WHERE b.zip_code = college_context.zcta)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_college_context_density ON college_context(population_density)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_college_context_zcta ON college_context(zcta)')
+    conn.commit()
+    
+    counts = assignments['zcta_method'].value_counts()
+    log_progress(f"Placed {counts.get('polygon', 0)} colleges inside a ZCTA and {counts.get('nearest', 0)} "
+                 f"in the nearest one; {counts.get('zip', 0)} kept their listed ZIP")
+    return hash_dataframe(assignments)
 
-def create_zip_boundaries_table():
-    """Create a table with ZIP code boundary data"""
+def build_boundaries(refresh=False, max_memory_mb=INGEST_MAX_MEMORY_MB, bbox=None, workers=GEOMETRY_WORKERS):
+    """Download, load, simplify and dissolve ZIP boundaries, rerunning only stages whose inputs changed"""
     conn = None
     try:
-        # Download and read the shapefile
-        shapefile_path = download_and_extract_zcta_shapefile()
-        if not shapefile_path:
-            return
-        
-        log_progress("Reading shapefile...")
-        # Use GeoPandas to read the shapefile
-        gdf = gpd.read_file(shapefile_path, engine='pyogrio')
-        
         # Connect to the database
         conn = sqlite3.connect('education_demographics.db')
+        pipeline = Pipeline(conn, 'get_zip_boundaries')
+        artifacts = ArtifactCache()
         
-        # Get existing ZIP codes from demographics and coordinates tables
-        log_progress("Getting existing ZIP codes from database...")
-        existing_zips_df = pd.read_sql_query("""
-            SELECT DISTINCT d.zip_code, c.latitude, c.longitude
-            FROM zip_demographics d
-            JOIN zip_coordinates c ON d.zip_code = c.zip_code
-            WHERE d.income_bucket != 'Under $100k'
-        """, conn)
-        
-        # Filter the geodataframe to only include our ZIP codes
-        log_progress("Filtering boundaries to match our ZIP codes...")
-        gdf['ZCTA5CE20'] = gdf['ZCTA5CE20'].astype(str).str.zfill(5)
-        filtered_gdf = gdf[gdf['ZCTA5CE20'].isin(existing_zips_df['zip_code'])]
-        
-        # Create a new table for the boundaries
-        log_progress("Creating ZIP boundaries table...")
-        cursor = conn.cursor()
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS zip_boundaries (
-            zip_code TEXT PRIMARY KEY,
-            geometry TEXT,  -- GeoJSON format
-            area_sq_meters REAL,
-            perimeter_meters REAL
+        # The archive stays in the artifact cache, so later runs skip the download
+        pipeline.run_stage(
+            'shapefile_download', [ZCTA_URL],
+            lambda: download_zcta_shapefile(artifacts, refresh),
+            force=refresh or not os.path.exists(artifacts.path(ZCTA_ARTIFACT))
         )
-        ''')
+        zip_path = artifacts.path(ZCTA_ARTIFACT)
         
-        # Create an index on zip_code if it doesn't exist
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_zip_boundaries_zip ON zip_boundaries(zip_code)')
+        # One pool of worker processes shared by every geometry stage
+        with GeometryPool(workers) as pool:
+            # Get existing ZIP codes from demographics and coordinates tables
+            log_progress("Getting existing ZIP codes from database...")
+            zip_codes = load_boundary_zip_codes(conn)
+            boundaries_hash = pipeline.run_stage(
+                'zip_boundaries', [hash_file(zip_path), hash_values(zip_codes), bbox, EQUAL_AREA_CRS],
+                lambda: create_zip_boundaries_table(conn, pool, zip_path, zip_codes, max_memory_mb, bbox)
+            )
+            
+            # People per square kilometer, from the measured areas and census populations
+            populations = pd.read_sql_query("SELECT zip_code, population FROM zip_demographics", conn)
+            densities_hash = pipeline.run_stage(
+                'population_density', [boundaries_hash, hash_dataframe(populations)],
+                lambda: update_population_density(conn)
+            )
+            
+            # Colleges are tied to demographics by location rather than their listed ZIP,
+            # searched among every ZCTA rather than only those zip_boundaries keeps
+            polygons_hash = pipeline.run_stage(
+                'zcta_polygons', [hash_file(zip_path), bbox],
+                lambda: create_zcta_polygons_table(conn, pool, zip_path, max_memory_mb, bbox)
+            )
+            college_locations = (
+                pd.read_sql_query("SELECT id, LATITUDE, LONGITUDE, ZIP FROM college_context", conn)
+                if table_columns(conn, 'college_context') else pd.DataFrame()
+            )
+            pipeline.run_stage(
+                'college_zctas', [polygons_hash, densities_hash, hash_dataframe(college_locations)],
+                lambda: update_college_zctas(conn)
+            )
+            
+            # Reassigned colleges can change bucket, so the summaries follow
+            if table_columns(conn, 'college_context') and run_rollup_stage(conn):
+                pipeline.changed = True
+            
+            # Build the simplified levels of detail served at lower zooms
+            pipeline.run_stage(
+                'zip_boundary_lods', [boundaries_hash, LOD_LEVELS],
+                lambda: create_zip_boundary_lods(conn, pool)
+            )
+            
+            # Dissolve neighbouring ZIPs in the same buckets into merged regions
+            buckets = pd.read_sql_query("SELECT zip_code, income_bucket, population_bucket FROM zip_demographics", conn)
+            pipeline.run_stage(
+                'merged_boundaries', [boundaries_hash, hash_dataframe(buckets), MERGED_TOLERANCE, MERGED_GRID_SIZE],
+                lambda: create_merged_boundaries_table(conn, pool)
+            )
         
-        # Convert geometries to GeoJSON and calculate area/perimeter
-        log_progress(f"Processing {len(filtered_gdf)} ZIP code boundaries...")
-        records = []
-        for idx, row in filtered_gdf.iterrows():
-            # Convert geometry to GeoJSON
-            geojson = json.dumps(mapping(row.geometry))
-            # Calculate area and perimeter
-            area = row.geometry.area
-            perimeter = row.geometry.length
-            records.append((row['ZCTA5CE20'], geojson, area, perimeter))
-        
-        # Insert the data
-        cursor.executemany(
-            'INSERT OR REPLACE INTO zip_boundaries (zip_code, geometry, area_sq_meters, perimeter_meters) VALUES (?, ?, ?, ?)',
-            records
-        )
-        
-        conn.commit()
-        log_progress(f"Successfully added {len(records)} ZIP code boundaries to database")
+        if pipeline.changed:
+            write_label_artifact(conn, stamp_data_version(conn))
+        else:
+            log_progress("No inputs changed; data version left as is")
         
     except Exception as e:
         log_progress(f"Error creating boundaries table: {str(e)}")
@@ -125,11 +451,25 @@ def create_zip_boundaries_table():
     finally:
         if conn:
             conn.close()
-        # Clean up temporary files
-        if os.path.exists('temp'):
-            import shutil
-            shutil.rmtree('temp')
-            log_progress("Cleaned up temporary files")
 
 if __name__ == '__main__':
-    create_zip_boundaries_table()
+    if '--dissolve-only' in sys.argv:
+        # Refresh merged regions after demographics change, without re-downloading shapes
+        conn = sqlite3.connect('education_demographics.db')
+        try:
+            with GeometryPool() as pool:
+                create_merged_boundaries_table(conn, pool)
+            write_label_artifact(conn, stamp_data_version(conn))
+        finally:
+            conn.close()
+    else:
+        parser = argparse.ArgumentParser(description='Load ZIP code boundaries from the Census ZCTA shapefile')
+        parser.add_argument('--refresh', action='store_true', help='Re-download the shapefile even if a cached copy exists')
+        parser.add_argument('--max-memory-mb', type=int, default=INGEST_MAX_MEMORY_MB,
+                            help='Memory budget for each batch of boundaries read from the shapefile')
+        parser.add_argument('--bbox', help="Only load ZIPs intersecting 'west,south,east,north'")
+        parser.add_argument('--workers', type=int, default=GEOMETRY_WORKERS,
+                            help='Processes for geometry work (default: one per core)')
+        args = parser.parse_args()
+        bbox = tuple(float(v) for v in args.bbox.split(',')) if args.bbox else None
+        build_boundaries(args.refresh, args.max_memory_mb, bbox, args.workers)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import pandas as pd
+import requests
+
+# Downloaded inputs are kept here between runs instead of in a throwaway temp folder
+ARTIFACT_DIR = os.getenv('PIPELINE_ARTIFACT_DIR', 'artifacts')
+
+def log_progress(message):
+    """Log a message with timestamp"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}")
+
+def _placeholder(conn):
+    return '?' if conn.__class__.__module__.startswith('sqlite3') else '%s'
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_values(*values):
+    """SHA-256 of any JSON-serializable values, e.g. upstream hashes and settings"""
+    encoded = json.dumps(values, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def row_hashes(df):
+    """Per-row content hash, as 16 hex digits"""
+    hashed = pd.util.hash_pandas_object(df, index=False)
+    return hashed.map(lambda value: f"{value:016x}")
+
+def hash_dataframe(df):
+    """Content hash of a whole table, independent of row order"""
+    return hash_values(sorted(row_hashes(df.drop(columns=['row_hash'], errors='ignore'))))
+
+class ArtifactCache:
+    """Directory of downloaded pipeline inputs, reused until a refresh is asked for"""
+
+    def __init__(self, root=ARTIFACT_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def download(self, url, name, params=None, refresh=False, chunk_size=1 << 20):
+        """Path to a downloaded file, fetching it only when missing or refreshing"""
+        path = self.path(name)
+        if os.path.exists(path) and not refresh:
+            log_progress(f"Using cached {name}")
+            return path
+
+        log_progress(f"Downloading {name}...")
+        start_time = time.time()
+        # Write beside the final name so an interrupted download is never mistaken for a complete one
+        partial_path = path + '.part'
+        with requests.get(url, params=params, stream=True, timeout=60) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to download {name}: {response.status_code} {response.text[:200]}")
+            with open(partial_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+        os.replace(partial_path, path)
+        log_progress(f"Downloaded {os.path.getsize(path):,} bytes in {time.time() - start_time:.1f} seconds")
+        return path
+
+class Pipeline:
+    """Runs named stages, skipping any whose inputs are unchanged since it last completed"""
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self.changed = False  # Whether any stage produced different output
+        # Checkpoints live in the target database, so a run that fails part way
+        # resumes at the failed stage with every earlier stage already complete
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+                pipeline VARCHAR(64),
+                stage VARCHAR(64),
+                input_hash VARCHAR(64),
+                output_hash VARCHAR(64),
+                status VARCHAR(16),
+                updated_at VARCHAR(32),
+                PRIMARY KEY (pipeline, stage)
+            )
+        """)
+        conn.commit()
+        cursor.close()
+
+    def _checkpoint(self, stage):
+        p = _placeholder(self.conn)
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"SELECT input_hash, output_hash, status FROM pipeline_checkpoints WHERE pipeline = {p} AND stage = {p}",
+            (self.name, stage)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+        return row
+
+    def _record(self, stage, input_hash, output_hash, status):
+        p = _placeholder(self.conn)
+        cursor = self.conn.cursor()
+        cursor.execute(f"DELETE FROM pipeline_checkpoints WHERE pipeline = {p} AND stage = {p}", (self.name, stage))
+        cursor.execute(
+            f"""INSERT INTO pipeline_checkpoints (pipeline, stage, input_hash, output_hash, status, updated_at)
+                VALUES ({p}, {p}, {p}, {p}, {p}, {p})""",
+            (self.name, stage, input_hash, output_hash, status, datetime.now().isoformat())
+        )
+        self.conn.commit()
+        cursor.close()
+
+    def run_stage(self, stage, inputs, run, force=False):
+        """Run a stage unless it already completed with these inputs; returns its output hash"""
+        # Inputs are file hashes, settings and earlier stages' output hashes. A stage
+        # that reports no output hash of its own passes its input hash downstream
+        input_hash = hash_values(inputs)
+        checkpoint = self._checkpoint(stage)
+        if not force and checkpoint and checkpoint[2] == 'complete' and checkpoint[0] == input_hash:
+            log_progress(f"Stage {stage} is up to date, skipping")
+            return checkpoint[1]
+
+        log_progress(f"Running stage {stage}...")
+        start_time = time.time()
+        self._record(stage, input_hash, None, 'running')
+        try:
+            output_hash = run() or input_hash
+        except Exception:
+            self._record(stage, input_hash, None, 'failed')
+            raise
+        self._record(stage, input_hash, output_hash, 'complete')
+        # Rerunning a stage that reproduces its previous output changes nothing downstream
+        if not checkpoint or checkpoint[1] != output_hash:
+            self.changed = True
+        log_progress(f"Stage {stage} completed in {time.time() - start_time:.1f} seconds")
+        return output_hash
+
+def table_columns(conn, table):
+    """Column names of an existing table, on sqlite3 or MySQL"""
+    cursor = conn.cursor()
+    if _placeholder(conn) == '?':
+        cursor.execute(f"PRAGMA table_info({table})")
+        columns = [row[1] for row in cursor.fetchall()]
+    else:
+        cursor.execute(f"SHOW COLUMNS FROM {table}")
+        columns = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return columns
+
+def ensure_row_hash_column(conn, table):
+    """Add the row_hash column used for change detection to a table from an earlier run"""
+    if 'row_hash' not in table_columns(conn, table):
+        cursor = conn.cursor()
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN row_hash CHAR(16)")
+        conn.commit()
+        cursor.close()
+
+def delete_keys(conn, table, key_columns, keys, batch_size=1000):
+    """Delete rows by primary key"""
+    p = _placeholder(conn)
+    condition = ' AND '.join(f"{column} = {p}" for column in key_columns)
+    cursor = conn.cursor()
+    for i in range(0, len(keys), batch_size):
+        cursor.executemany(f"DELETE FROM {table} WHERE {condition}", keys[i:i + batch_size])
+    cursor.close()
+
+class RowSyncer:
+    """Syncs a table batch by batch, so the full dataset never has to be in memory at once"""
+
+    def __init__(self, conn, table, key_columns, batch_size=1000):
+        self.conn = conn
+        self.table = table
+        self.key_columns = key_columns
+        self.batch_size = batch_size
+        ensure_row_hash_column(conn, table)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(key_columns)}, row_hash FROM {table}")
+        self.existing = {tuple(row[:-1]): row[-1] for row in cursor.fetchall()}
+        cursor.close()
+        self.seen = set()
+        self.hashes = []
+        self.written = 0
+        self.replaced = 0
+
+    def diff(self, df):
+        """Rows of a batch that are new or changed, with a row_hash column, and the keys they replace"""
+        df = df.drop(columns=['row_hash'], errors='ignore').copy()
+        df['row_hash'] = row_hashes(df).to_numpy()
+        self.hashes.extend(df['row_hash'])
+
+        keys = list(df[self.key_columns].itertuples(index=False, name=None))
+        self.seen.update(keys)
+        is_changed = [self.existing.get(key) != row_hash for key, row_hash in zip(keys, df['row_hash'])]
+        stale_keys = [key for key, flag in zip(keys, is_changed) if flag and key in self.existing]
+        return df[is_changed], stale_keys
+
+    def removed_keys(self):
+        """Keys in the table that no batch so far contained"""
+        return [key for key in self.existing if key not in self.seen]
+
+    def write(self, df):
+        """Write the rows of one batch that are new or changed"""
+        changed, stale_keys = self.diff(df)
+        delete_keys(self.conn, self.table, self.key_columns, stale_keys, self.batch_size)
+
+        values = changed.astype(object).where(pd.notna(changed), None)
+        columns = ', '.join(values.columns)
+        placeholders = ', '.join([_placeholder(self.conn)] * len(values.columns))
+        rows = list(values.itertuples(index=False, name=None))
+        cursor = self.conn.cursor()
+        for i in range(0, len(rows), self.batch_size):
+            cursor.executemany(f"INSERT INTO {self.table} ({columns}) VALUES ({placeholders})",
+                               rows[i:i + self.batch_size])
+        self.conn.commit()
+        cursor.close()
+        self.written += len(changed)
+        self.replaced += len(stale_keys)
+
+    def finish(self):
+        """Delete rows no batch contained; returns the content hash of everything written"""
+        removed = self.removed_keys()
+        delete_keys(self.conn, self.table, self.key_columns, removed, self.batch_size)
+        self.conn.commit()
+        log_progress(f"{self.table}: {self.written:,} rows written, {len(self.hashes) - self.written:,} unchanged, "
+                     f"{self.replaced + len(removed):,} replaced or removed")
+        return hash_values(sorted(self.hashes))
+
+def diff_rows(conn, table, df, key_columns):
+    """Compare df to a table by row hash: (rows to write, keys to delete first, content hash of df)"""
+    syncer = RowSyncer(conn, table, key_columns)
+    changed, stale_keys = syncer.diff(df)
+    return changed, stale_keys + syncer.removed_keys(), hash_values(sorted(syncer.hashes))
+
+def sync_rows(conn, table, df, key_columns, batch_size=1000):
+    """Upsert only the rows that changed and drop the ones that disappeared; returns a content hash"""
+    syncer = RowSyncer(conn, table, key_columns, batch_size)
+    syncer.write(df)
+    return syncer.finish()
@@ -0,0 +1,139 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+# Miles per degree of latitude, a lower bound good enough to size the search box
+MILES_PER_DEGREE = 69.0
+# Half the Earth's circumference; no two points are further apart
+MAX_DISTANCE_MILES = math.pi * EARTH_RADIUS_MILES
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """Great-circle distance in miles; any argument may be an array"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+class GridIndex:
+    """Points bucketed into fixed latitude/longitude cells, for radius searches by haversine distance
+
+    Cells are numbered row by row, so the cells a search box covers in one row
+    are a single run of the sorted cell numbers and take two binary searches
+    """
+
+    def __init__(self, latitudes, longitudes, cell_degrees=0.5):
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        self.cell_degrees = cell_degrees
+        self.columns = math.ceil(360 / cell_degrees)
+        self.rows = math.ceil(180 / cell_degrees)
+
+        # Points without coordinates are never found
+        located = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+        cells = self._cell(latitudes[located], longitudes[located])
+        order = np.argsort(cells, kind='stable')
+        self.positions = located[order]  # Point positions, grouped by cell
+        self.cells = cells[order]
+        self.latitudes = latitudes[self.positions]
+        self.longitudes = longitudes[self.positions]
+
+    def _row(self, latitude):
+        return np.clip(np.floor((np.asarray(latitude) + 90) / self.cell_degrees).astype(int), 0, self.rows - 1)
+
+    def _column(self, longitude):
+        return np.floor((np.asarray(longitude) + 180) % 360 / self.cell_degrees).astype(int) % self.columns
+
+    def _cell(self, latitude, longitude):
+        return self._row(latitude) * self.columns + self._column(longitude)
+
+    def _candidates(self, latitude, longitude, radius_miles):
+        """Slots of the points in every cell the radius could reach"""
+        lat_degrees = radius_miles / MILES_PER_DEGREE
+        first_row, last_row = self._row(latitude - lat_degrees), self._row(latitude + lat_degrees)
+        # Longitude degrees shrink towards the poles; near them, search every column
+        cos_lat = math.cos(math.radians(min(abs(latitude) + lat_degrees, 90)))
+        lon_degrees = radius_miles / (MILES_PER_DEGREE * cos_lat) if cos_lat > 1e-6 else 360
+        if 2 * lon_degrees >= 360:
+            column_runs = [(0, self.columns - 1)]
+        else:
+            first_column, last_column = self._column(longitude - lon_degrees), self._column(longitude + lon_degrees)
+            # A box across the antimeridian wraps around to the first columns
+            column_runs = ([(first_column, last_column)] if first_column <= last_column
+                           else [(first_column, self.columns - 1), (0, last_column)])
+
+        slots = []
+        for row in range(first_row, last_row + 1):
+            for first_column, last_column in column_runs:
+                start = np.searchsorted(self.cells, row * self.columns + first_column, side='left')
+                end = np.searchsorted(self.cells, row * self.columns + last_column, side='right')
+                if end > start:
+                    slots.append(np.arange(start, end))
+        return np.concatenate(slots) if slots else np.zeros(0, dtype=int)
+
+    def within(self, latitude, longitude, radius_miles):
+        """Positions of the points within a radius, nearest first, and their distances in miles"""
+        slots = self._candidates(latitude, longitude, radius_miles)
+        distances = haversine_miles(latitude, longitude, self.latitudes[slots], self.longitudes[slots])
+        keep = distances <= radius_miles
+        slots, distances = slots[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return self.positions[slots[order]], distances[order]
+
+    def nearest(self, latitude, longitude, k, allowed=None):
+        """Positions of the k nearest points (only those allowed by a mask, if given), and their distances"""
+        # Widen the search until it holds k points; every point closer than the
+        # radius is in it, so its k nearest are the k nearest overall
+        radius_miles = self.cell_degrees * MILES_PER_DEGREE
+        while True:
+            positions, distances = self.within(latitude, longitude, radius_miles)
+            if allowed is not None:
+                keep = allowed[positions]
+                positions, distances = positions[keep], distances[keep]
+            if len(positions) >= k or radius_miles >= MAX_DISTANCE_MILES:
+                return positions[:k], distances[:k]
+            radius_miles = min(radius_miles * 4, MAX_DISTANCE_MILES)
+
+class LocatedRows:
+    """Rows with latitude/longitude, a grid index over them and their bucket labels, for one data version"""
+
+    def __init__(self, version, rows, key):
+        self.version = version
+        self.rows = rows
+        self.positions = {row[key]: position for position, row in enumerate(rows)}
+        self.index = GridIndex(
+            [np.nan if row['latitude'] is None else float(row['latitude']) for row in rows],
+            [np.nan if row['longitude'] is None else float(row['longitude']) for row in rows]
+        )
+        self.buckets = {
+            name: np.array([row[name] for row in rows], dtype=object)
+            for name in ('income_bucket', 'population_bucket')
+        }
+
+    def find(self, key):
+        """Row with this key, or None"""
+        position = self.positions.get(key)
+        return None if position is None else self.rows[position]
+
+    def mask(self, income_buckets=None, population_buckets=None):
+        """Mask of rows in the selected buckets, or None to allow all; None selects every bucket, an empty list none"""
+        allowed = None
+        for name, selected in (('income_bucket', income_buckets), ('population_bucket', population_buckets)):
+            if selected is not None:
+                selected_mask = np.isin(self.buckets[name], list(selected))
+                allowed = selected_mask if allowed is None else allowed & selected_mask
+        return allowed
+
+    def _matches(self, positions, distances):
+        return [(self.rows[position], float(distance)) for position, distance in zip(positions, distances)]
+
+    def within(self, latitude, longitude, radius_miles, allowed=None):
+        """(row, miles) for the rows within a radius (and a mask from mask(), if given), nearest first"""
+        positions, distances = self.index.within(latitude, longitude, radius_miles)
+        if allowed is not None:
+            keep = allowed[positions]
+            positions, distances = positions[keep], distances[keep]
+        return self._matches(positions, distances)
+
+    def nearest(self, latitude, longitude, k, allowed=None):
+        """(row, miles) for the k nearest rows (within a mask from mask(), if given), nearest first"""
+        return self._matches(*self.index.nearest(latitude, longitude, k, allowed))
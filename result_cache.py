@@ -0,0 +1,250 @@
+import gzip
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import brotli
+
+# Query parameters that never change the result, like the data version cache-buster
+IGNORED_PARAMS = {'v'}
+
+# Bodies smaller than this are not worth storing compressed
+MIN_COMPRESS_SIZE = 1024
+
+# Encodings a payload may be stored in, most compact first
+ENCODINGS = ('br', 'gzip')
+# Levels used while a request waits: about as compact as gzip -9 at a fraction of the time
+FAST_LEVELS = {'br': 4, 'gzip': 6}
+# Levels for compressing ahead of time (the warm-cache command); brotli 11 takes seconds per megabyte
+BEST_LEVELS = {'br': 11, 'gzip': 9}
+
+def compress(body, encoding, best=False):
+    """Body compressed in one of ENCODINGS, at the fast or the best level"""
+    level = (BEST_LEVELS if best else FAST_LEVELS)[encoding]
+    if encoding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+def make_cache_key(namespace, args):
+    """Stable key for a set of query parameters, independent of their order"""
+    normalized = sorted(
+        (name, sorted(values)) for name, values in args.lists() if name not in IGNORED_PARAMS
+    ) if hasattr(args, 'lists') else sorted(args.items())
+    return f"{namespace}:{json.dumps(normalized, separators=(',', ':'))}"
+
+class CompressedPayload(namedtuple('CompressedPayload', ['identity', 'gzip', 'br'])):
+    """Response body stored with whichever of its gzip and brotli encodings clients have asked for"""
+
+    @classmethod
+    def from_body(cls, body, encodings=(), best=False):
+        """Payload holding the body and its listed encodings; none by default"""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return cls(body, None, None).with_encodings(encodings, best)
+
+    def missing(self, encodings):
+        """Encodings among these worth storing that this payload lacks"""
+        if len(self.identity) < MIN_COMPRESS_SIZE:
+            return []
+        return [encoding for encoding in encodings if getattr(self, encoding) is None]
+
+    def with_encodings(self, encodings, best=False):
+        """Payload with these encodings added; best recompresses them even if stored"""
+        if len(self.identity) < MIN_COMPRESS_SIZE:
+            return self
+        todo = [encoding for encoding in encodings if best or getattr(self, encoding) is None]
+        if not todo:
+            return self
+        return self._replace(**{encoding: compress(self.identity, encoding, best) for encoding in todo})
+
+    def negotiate(self, accept_encodings):
+        """Pick the smallest stored encoding the client accepts, as (body, encoding)"""
+        if self.br is not None and accept_encodings['br']:
+            return self.br, 'br'
+        if self.gzip is not None and accept_encodings['gzip']:
+            return self.gzip, 'gzip'
+        return self.identity, None
+
+class DiskCacheBackend:
+    """SQLite file that several worker processes can share cache entries through
+
+    Entries are keyed by data version as well, because workers notice a new
+    version at different times: one still on the old version must neither
+    find nor delete what the others stored for the new one. Entries of old
+    versions are never read again and age out through the TTL and the LRU
+    """
+
+    def __init__(self, path, max_entries=4096, touch_interval=30):
+        self.path = path
+        self.max_entries = max_entries
+        # Hits are noted in memory and written back at most this often (seconds),
+        # so reads from every worker do not queue on SQLite's write lock
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._touch_lock = threading.Lock()
+        self._touched = {}
+        self._touched_at = time.time()
+        conn = self._connection()
+        # Files written before entries were keyed by version hold nothing worth keeping
+        columns = conn.execute("PRAGMA table_info(cache)").fetchall()
+        primary_key = [name for _, name, _, _, _, position in sorted(columns, key=lambda column: column[5]) if position]
+        if primary_key and primary_key != ['key', 'version']:
+            conn.execute("DROP TABLE cache")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT,
+                version TEXT,
+                expires_at REAL,
+                last_used REAL,
+                value BLOB,
+                value_gzip BLOB,
+                value_br BLOB,
+                PRIMARY KEY (key, version)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache(last_used)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, version):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, value_gzip, value_br FROM cache WHERE key = ? AND version = ? AND expires_at > ?",
+            (key, version, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        self._touch(key, version)
+        return CompressedPayload(*(bytes(v) if v is not None else None for v in row))
+
+    def _touch(self, key, version):
+        """Note a hit, writing the pending ones back once touch_interval has passed"""
+        now = time.time()
+        with self._touch_lock:
+            self._touched[(key, version)] = now
+            if now - self._touched_at < self.touch_interval:
+                return
+        self._write_touches()
+
+    def _write_touches(self):
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+            self._touched_at = time.time()
+        if not touched:
+            return
+        conn = self._connection()
+        try:
+            conn.executemany("UPDATE cache SET last_used = ? WHERE key = ? AND version = ?",
+                             [(used, key, version) for (key, version), used in touched.items()])
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Only the LRU order depends on these; losing some is harmless
+            conn.rollback()
+
+    def set(self, key, version, payload, ttl):
+        self._write_touches()
+        conn = self._connection()
+        now = time.time()
+        conn.execute(
+            """INSERT OR REPLACE INTO cache (key, version, expires_at, last_used, value, value_gzip, value_br)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (key, version, now + ttl, now, *payload)
+        )
+        # Drop expired rows, then the least recently used overflow
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+        conn.execute("""
+            DELETE FROM cache WHERE rowid IN (
+                SELECT rowid FROM cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+        conn.commit()
+
+class ResultCache:
+    """Size-bounded LRU of CompressedPayload API results with a TTL and data-version invalidation"""
+
+    def __init__(self, max_entries=256, ttl=300, disk_backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_backend = disk_backend
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, expires_at, value)
+        self._version = None
+        self._stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _check_version(self, version):
+        """Forget every in-memory entry once the data version moves on"""
+        if version != self._version:
+            if self._version is not None:
+                self._stats['invalidations'] += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[2]
+                del self._entries[key]
+
+        if self.disk_backend is not None:
+            value = self.disk_backend.get(key, version)
+            if value is not None:
+                with self._lock:
+                    self._stats['disk_hits'] += 1
+                self._store(key, version, value)
+                return value
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def _store(self, key, version, value):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def set(self, key, version, value):
+        self._store(key, version, value)
+        if self.disk_backend is not None:
+            self.disk_backend.set(key, version, value, self.ttl)
+
+    def get_or_set(self, key, version, compute):
+        """Cached value for a key, computing and storing it on a miss"""
+        value = self.get(key, version)
+        if value is None:
+            value = compute()
+            self.set(key, version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+            stats['ttl'] = self.ttl
+            stats['version'] = self._version
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,138 @@
+from itertools import combinations
+
+import pandas as pd
+
+from pipeline import Pipeline, hash_dataframe
+
+# Pre-aggregated college and ZIP figures for every combination of these
+# dimensions, so summaries are one indexed lookup instead of a scan. Built by
+# the setup scripts whenever the colleges, demographics or ZCTA assignments change
+DIMENSIONS = ['state', 'countyfips', 'income_bucket', 'population_bucket']
+INCOME_PERCENTILES = [25, 50, 75, 90]
+ROLLUP_TABLE = 'demographic_rollups'
+# Bumped whenever the figures are computed differently, so built cubes are redone
+ROLLUP_LAYOUT = 2
+# Pipeline the rollup stage's checkpoint is kept under, whichever script runs it
+ROLLUP_PIPELINE = 'demographic_rollups'
+
+def dimension_sets():
+    """Every combination of dimensions, from the national total to all four"""
+    return [list(dims) for size in range(len(DIMENSIONS) + 1) for dims in combinations(DIMENSIONS, size)]
+
+def rollup_sources(conn):
+    """College and ZIP rows with their dimension values"""
+    colleges = pd.read_sql_query("""
+        SELECT STATE AS state, COUNTYFIPS AS countyfips, income_bucket, population_bucket,
+               POPULATION AS enrollment
+        FROM college_context
+    """, conn)
+    # ZCTAs cross county lines and there is no ZIP-to-county table, so ZIPs have no county
+    zips = pd.read_sql_query("""
+        SELECT d.zip_code, c.state, d.income_bucket, d.population_bucket,
+               d.population, d.median_household_income
+        FROM zip_demographics d
+        LEFT JOIN zip_coordinates c ON c.zip_code = d.zip_code
+    """, conn)
+    return colleges, zips
+
+def _grouped(df, dims):
+    """GroupBy over dims; the whole frame as one group when dims is empty"""
+    return df.groupby(dims if dims else (lambda _: 0))
+
+def aggregate_rollups(colleges, zips):
+    """One row per group of every dimension set, with college counts, ZIP counts, population and income percentiles"""
+    # Missing values form their own group, stored as NULL; grouped as '' so
+    # they sort and join like any other value
+    colleges = colleges.fillna({dim: '' for dim in DIMENSIONS})
+    zips = zips.fillna({dim: '' for dim in DIMENSIONS if dim in zips})
+    # The ACS marks suppressed medians with negative sentinels like -666666666;
+    # they count as ZIPs but stay out of the percentiles
+    incomes = zips['median_household_income']
+    zips = zips.assign(median_household_income=incomes.where(incomes >= 0))
+    
+    frames = []
+    for dims in dimension_sets():
+        college_figures = _grouped(colleges, dims).agg(
+            college_count=('enrollment', 'size'),
+            enrollment=('enrollment', 'sum')
+        )
+        if 'countyfips' in dims:
+            # ZIP figures are left empty for county groups, see rollup_sources
+            figures = college_figures
+        else:
+            grouped = _grouped(zips, dims)
+            zip_figures = grouped.agg(zip_count=('zip_code', 'size'), population=('population', 'sum'))
+            percentiles = grouped['median_household_income'].quantile([p / 100 for p in INCOME_PERCENTILES]).unstack()
+            percentiles.columns = [f"income_p{p}" for p in INCOME_PERCENTILES]
+            figures = college_figures.join(zip_figures.join(percentiles), how='outer')
+            figures['zip_count'] = figures['zip_count'].fillna(0)
+        figures = figures.reset_index()
+        if not dims:
+            figures = figures.drop(columns=figures.columns[0])
+        figures.insert(0, 'dimensions', ','.join(dims))
+        figures.insert(0, 'rollup_key', '')
+        for position, dim in enumerate(dims):
+            values = f"{dim}=" + figures[dim].astype(str)
+            figures['rollup_key'] = values if position == 0 else figures['rollup_key'] + '|' + values
+        frames.append(figures)
+
+    df = pd.concat(frames, ignore_index=True)
+    for column in DIMENSIONS:
+        if column not in df:
+            df[column] = None
+    dimensions = df[DIMENSIONS].astype(object)
+    df[DIMENSIONS] = dimensions.where(dimensions.notna() & (dimensions != ''), None)
+    df['college_count'] = df['college_count'].fillna(0).astype(int)
+    df['zip_count'] = df['zip_count'].astype('Int64')
+    columns = (['rollup_key', 'dimensions'] + DIMENSIONS +
+               ['college_count', 'enrollment', 'zip_count', 'population'] +
+               [f"income_p{p}" for p in INCOME_PERCENTILES])
+    return df[columns]
+
+def build_rollups(conn, colleges, zips):
+    """Replace the rollup table with freshly aggregated figures; returns their content hash"""
+    df = aggregate_rollups(colleges, zips)
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {ROLLUP_TABLE}_new")
+    cursor.execute(f'''
+    CREATE TABLE {ROLLUP_TABLE}_new (
+        rollup_key TEXT PRIMARY KEY,  -- dimension=value pairs, '' for the national total
+        dimensions TEXT,  -- Comma-separated dimensions grouped by
+        state TEXT,
+        countyfips TEXT,
+        income_bucket TEXT,
+        population_bucket TEXT,
+        college_count INTEGER,
+        enrollment INTEGER,  -- Sum of the colleges' POPULATION
+        zip_count INTEGER,  -- ZIP figures are NULL for county groups
+        population INTEGER,
+        income_p25 REAL,
+        income_p50 REAL,
+        income_p75 REAL,
+        income_p90 REAL
+    )
+    ''')
+    df.to_sql(f"{ROLLUP_TABLE}_new", conn, if_exists='append', index=False)
+    conn.commit()
+
+    # Swap the new copy in within one transaction, like college_context
+    cursor.execute("BEGIN")
+    cursor.execute(f"DROP TABLE IF EXISTS {ROLLUP_TABLE}")
+    cursor.execute(f"ALTER TABLE {ROLLUP_TABLE}_new RENAME TO {ROLLUP_TABLE}")
+    cursor.execute(f"CREATE INDEX idx_{ROLLUP_TABLE}_dimensions ON {ROLLUP_TABLE}(dimensions)")
+    conn.commit()
+    return hash_dataframe(df)
+
+def run_rollup_stage(conn):
+    """Rebuild the rollups unless their sources are unchanged since the last build; True if the figures changed
+
+    Both setup scripts call this, and the checkpoint is shared, so neither
+    rebuilds a cube the other just built
+    """
+    colleges, zips = rollup_sources(conn)
+    pipeline = Pipeline(conn, ROLLUP_PIPELINE)
+    pipeline.run_stage(
+        'demographic_rollups', [hash_dataframe(colleges), hash_dataframe(zips), ROLLUP_LAYOUT],
+        lambda: build_rollups(conn, colleges, zips)
+    )
+    return pipeline.changed
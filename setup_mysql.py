@@ -1,10 +1,20 @@
 import mysql.connector
 import sqlite3
 import pandas as pd
+import shapely
 import json
 from pathlib import Path
 import os
+import re
+import math
+import time
+import tempfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from data_version import stamp_data_version
+from buckets import write_label_artifact
+from pipeline import Pipeline, delete_keys, diff_rows, hash_dataframe, row_hashes
 
 # Load environment variables
 load_dotenv()
@@ -44,66 +54,541 @@ def create_database():
         cursor.close()
         conn.close()
 
+# Column definitions of every MySQL table. Tables are kept between runs and
+# only rows that changed in SQLite are rewritten; row_hash holds each row's
+# content hash for that comparison
+TABLE_SCHEMAS = {
+    'colleges': """
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        NAME VARCHAR(255),
+        ADDRESS VARCHAR(255),
+        CITY VARCHAR(100),
+        STATE VARCHAR(2),
+        ZIP VARCHAR(10),
+        TELEPHONE VARCHAR(20),
+        POPULATION INT,
+        COUNTY VARCHAR(100),
+        COUNTYFIPS VARCHAR(10),
+        WEBSITE VARCHAR(255),
+        row_hash CHAR(16)
+    """,
+    'zip_demographics': """
+        zip_code VARCHAR(10) PRIMARY KEY,
+        median_household_income INT,
+        population INT,
+        income_bucket VARCHAR(50),
+        population_bucket VARCHAR(50),
+        row_hash CHAR(16)
+    """,
+    'zip_coordinates': """
+        zip_code VARCHAR(10) PRIMARY KEY,
+        city VARCHAR(100),
+        state VARCHAR(2),
+        latitude DECIMAL(10, 6),
+        longitude DECIMAL(10, 6),
+        row_hash CHAR(16)
+    """,
+    'zip_boundaries': """
+        zip_code VARCHAR(10) PRIMARY KEY,
+        geometry LONGTEXT,
+        geometry_packed LONGBLOB,
+        area_sq_meters DOUBLE,
+        perimeter_meters DOUBLE,
+        population_density DOUBLE,
+        min_lon DOUBLE,
+        min_lat DOUBLE,
+        max_lon DOUBLE,
+        max_lat DOUBLE,
+        shape GEOMETRY NOT NULL SRID 0,  -- Same polygon as WKB, for the SPATIAL index; see spatial_sql.py
+        row_hash CHAR(16)
+    """,
+    'zip_boundary_lods': """
+        zip_code VARCHAR(10),
+        lod TINYINT,
+        geometry MEDIUMTEXT,
+        geometry_packed MEDIUMBLOB,
+        vertex_count INT,
+        row_hash CHAR(16),
+        PRIMARY KEY (zip_code, lod)
+    """,
+    'merged_boundaries': """
+        income_bucket VARCHAR(50),
+        population_bucket VARCHAR(50),
+        region_id INT,
+        geometry LONGTEXT,
+        geometry_packed LONGBLOB,
+        zip_count INT,
+        zip_codes MEDIUMTEXT,
+        min_lon DOUBLE,
+        min_lat DOUBLE,
+        max_lon DOUBLE,
+        max_lat DOUBLE,
+        row_hash CHAR(16),
+        PRIMARY KEY (income_bucket, population_bucket, region_id)
+    """,
+    # Always reloaded in full beside the live table and swapped in
+    'college_context': """
+        id INT PRIMARY KEY,
+        NAME VARCHAR(255),
+        ADDRESS VARCHAR(255),
+        CITY VARCHAR(100),
+        STATE VARCHAR(2),
+        ZIP VARCHAR(10),
+        TELEPHONE VARCHAR(20),
+        POPULATION INT,
+        COUNTY VARCHAR(100),
+        COUNTYFIPS VARCHAR(10),
+        WEBSITE VARCHAR(255),
+        LATITUDE DECIMAL(10, 6),
+        LONGITUDE DECIMAL(10, 6),
+        median_household_income INT,
+        zip_population INT,
+        income_bucket VARCHAR(50),
+        population_bucket VARCHAR(50),
+        latitude_zip DECIMAL(10, 6),
+        longitude_zip DECIMAL(10, 6),
+        population_density DOUBLE,
+        zcta VARCHAR(5),
+        zcta_method VARCHAR(10)
+    """,
+    # Built by rollups.py; always reloaded in full like college_context
+    'demographic_rollups': """
+        rollup_key VARCHAR(255) PRIMARY KEY,
+        dimensions VARCHAR(64),
+        state VARCHAR(2),
+        countyfips VARCHAR(10),
+        income_bucket VARCHAR(50),
+        population_bucket VARCHAR(50),
+        college_count INT,
+        enrollment BIGINT,
+        zip_count INT,
+        population BIGINT,
+        income_p25 DOUBLE,
+        income_p50 DOUBLE,
+        income_p75 DOUBLE,
+        income_p90 DOUBLE
+    """
+}
+
+# Secondary indexes, kept apart from the schemas so bulk loads can build them after the data
+# is in, as (name, columns) or (name, columns, kind)
+TABLE_INDEXES = {
+    'colleges': [('idx_colleges_zip', 'ZIP')],
+    'zip_demographics': [
+        ('idx_zip_demographics_income', 'income_bucket'),
+        ('idx_zip_demographics_population', 'population_bucket')
+    ],
+    'zip_coordinates': [('idx_zip_coordinates_lat_lon', 'latitude, longitude')],
+    'zip_boundaries': [
+        ('idx_zip_boundaries_bbox', 'min_lon, max_lon, min_lat, max_lat'),
+        ('idx_zip_boundaries_density', 'population_density'),
+        ('idx_zip_boundaries_shape', 'shape', 'SPATIAL')
+    ],
+    'zip_boundary_lods': [],
+    'merged_boundaries': [],
+    'college_context': [
+        ('idx_college_context_income', 'median_household_income, zip_population'),
+        ('idx_college_context_population', 'zip_population, median_household_income'),
+        ('idx_college_context_buckets', 'income_bucket, population_bucket'),
+        # Functional key parts on where the app places each college, see app.COLLEGE_LATITUDE
+        ('idx_college_context_location', '(COALESCE(LATITUDE, latitude_zip)), (COALESCE(LONGITUDE, longitude_zip))'),
+        ('idx_college_context_density', 'population_density'),
+        ('idx_college_context_zcta', 'zcta'),
+        # Sort keys and name/city search of the college table, see database_setup.py and text_search.py
+        ('idx_college_context_sort_name', 'NAME'),
+        ('idx_college_context_sort_city', 'CITY'),
+        ('idx_college_context_sort_state', 'STATE'),
+        ('idx_college_context_sort_enrollment', 'POPULATION'),
+        ('idx_college_context_sort_income', 'median_household_income'),
+        ('idx_college_context_sort_zip_population', 'zip_population'),
+        ('ft_college_context_search', 'NAME, CITY', 'FULLTEXT')
+    ],
+    'demographic_rollups': [('idx_demographic_rollups_dimensions', 'dimensions')]
+}
+
 def create_tables(mysql_conn):
+    """Create the synced tables, bringing ones left by earlier runs up to date; returns the tables migrated"""
     cursor = mysql_conn.cursor()
     
-    # Drop existing tables to avoid duplicates
-    cursor.execute("DROP TABLE IF EXISTS colleges")
-    cursor.execute("DROP TABLE IF EXISTS zip_demographics")
-    cursor.execute("DROP TABLE IF EXISTS zip_coordinates")
-    cursor.execute("DROP TABLE IF EXISTS zip_boundaries")
+    # Create the incrementally synced tables
+    for table in TABLE_KEYS:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({TABLE_SCHEMAS[table]})")
+
+    # Tables kept from earlier runs may predate columns or types in TABLE_SCHEMAS
+    # (the first schema stored geometry as TEXT, which cuts GeoJSON at 64 KB)
+    migrated = set()
+    for table in TABLE_KEYS:
+        spatial_column = SPATIAL_COLUMNS.get(table)
+        if ensure_columns(cursor, table, {
+            name: definition for name, definition in schema_columns(table).items() if name != spatial_column
+        }):
+            migrated.add(table)
+
+    for table, column in SPATIAL_COLUMNS.items():
+        if ensure_spatial_column(cursor, table, column):
+            migrated.add(table)
+
+    # Create indexes
+    for table in TABLE_KEYS:
+        for name, columns, *kind in TABLE_INDEXES[table]:
+            create_index(cursor, name, table, columns, *kind)
     
-    # Create tables
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS colleges (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            NAME VARCHAR(255),
-            ADDRESS VARCHAR(255),
-            CITY VARCHAR(100),
-            STATE VARCHAR(2),
-            ZIP VARCHAR(10),
-            TELEPHONE VARCHAR(20),
-            POPULATION INT,
-            COUNTY VARCHAR(100),
-            COUNTYFIPS VARCHAR(10),
-            WEBSITE VARCHAR(255)
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS zip_demographics (
-            zip_code VARCHAR(10) PRIMARY KEY,
-            median_household_income INT,
-            population INT,
-            income_bucket VARCHAR(50),
-            population_bucket VARCHAR(50)
+    mysql_conn.commit()
+    return migrated
+
+def schema_columns(table):
+    """{column: definition} of a table in TABLE_SCHEMAS, without table-level keys or comments"""
+    columns = {}
+    for line in TABLE_SCHEMAS[table].splitlines():
+        line = line.split('--')[0].strip().rstrip(',')
+        if not line or line.upper().startswith(('PRIMARY KEY', 'KEY ', 'INDEX ', 'UNIQUE ')):
+            continue
+        name, definition = line.split(None, 1)
+        # Keys are not redeclared when a column is added or changed
+        columns[name] = re.sub(r'\s+PRIMARY KEY', '', definition, flags=re.IGNORECASE)
+    return columns
+
+def column_type(definition):
+    """Type of a column definition as information_schema spells it, e.g. 'decimal(10,6)'"""
+    column_type = re.match(r'\s*(\w+(?:\s*\([^)]*\))?)', definition).group(1)
+    column_type = re.sub(r'\s+', '', column_type).lower()
+    # Integer display widths (int(11)) are cosmetic and gone in MySQL 8.0.19+
+    return re.sub(r'^(tinyint|smallint|mediumint|int|bigint)\(\d+\)$', r'\1', column_type)
+
+def ensure_columns(cursor, table, columns):
+    """Add missing columns, and retype existing ones, of a table created by an earlier run; True if any changed"""
+    cursor.execute(
+        "SELECT column_name, column_type FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,)
+    )
+    existing = {name.lower(): column_type(existing_type) for name, existing_type in cursor.fetchall()}
+    changed = False
+    for name, definition in columns.items():
+        if name.lower() not in existing:
+            print(f"Adding column {table}.{name} {definition}")
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN `{name}` {definition}")
+            changed = True
+        elif existing[name.lower()] != column_type(definition):
+            print(f"Changing column {table}.{name} from {existing[name.lower()]} to {definition}")
+            cursor.execute(f"ALTER TABLE {table} MODIFY COLUMN `{name}` {definition}")
+            changed = True
+    return changed
+
+# Rows read per batch while filling a newly added spatial column
+SPATIAL_BACKFILL_BATCH = 500
+
+def ensure_spatial_column(cursor, table, column):
+    """Add and fill the spatial column on a table created before it existed; True if rows were dropped"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (table, column)
+    )
+    if cursor.fetchone()[0] > 0:
+        return False
+
+    # A SPATIAL index needs NOT NULL, so existing rows are filled from their GeoJSON first.
+    # Rows from older runs may hold GeoJSON that is invalid or was cut short, which
+    # ST_GeomFromGeoJSON would fail the whole UPDATE on; they are parsed here instead,
+    # and the ones that do not parse are deleted so the sync writes them again
+    key = TABLE_KEYS[table][0]
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} GEOMETRY SRID 0")
+    unparseable = []
+    last_key = ''
+    while True:
+        cursor.execute(
+            f"SELECT {key}, geometry FROM {table} WHERE {key} > %s ORDER BY {key} LIMIT {SPATIAL_BACKFILL_BATCH}",
+            (last_key,)
         )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS zip_coordinates (
-            zip_code VARCHAR(10) PRIMARY KEY,
-            city VARCHAR(100),
-            state VARCHAR(2),
-            latitude DECIMAL(10, 6),
-            longitude DECIMAL(10, 6)
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        keys = [row[0] for row in rows]
+        shapes = shapely.to_wkb(shapely.from_geojson([row[1] or '' for row in rows], on_invalid='ignore'))
+        cursor.executemany(
+            f"UPDATE {table} SET {column} = ST_GeomFromWKB(%s) WHERE {key} = %s",
+            [(shape, row_key) for row_key, shape in zip(keys, shapes) if shape is not None]
         )
-    """)
+        unparseable.extend(row_key for row_key, shape in zip(keys, shapes) if shape is None)
+        last_key = keys[-1]
 
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS zip_boundaries (
-            zip_code VARCHAR(10) PRIMARY KEY,
-            geometry TEXT,
-            perimeter_meters DECIMAL(10, 6)
-        )
-    """)
+    if unparseable:
+        print(f"Deleting {len(unparseable)} {table} rows whose geometry does not parse "
+              f"(e.g. {', '.join(unparseable[:5])}); the sync writes them again")
+        cursor.executemany(f"DELETE FROM {table} WHERE {key} = %s", [(row_key,) for row_key in unparseable])
+    cursor.execute(f"ALTER TABLE {table} MODIFY COLUMN {column} GEOMETRY NOT NULL SRID 0")
+    return bool(unparseable)
 
-    # Create indexes
-    cursor.execute("CREATE INDEX idx_colleges_zip ON colleges(ZIP)")
-    cursor.execute("CREATE INDEX idx_zip_demographics_income ON zip_demographics(income_bucket)")
-    cursor.execute("CREATE INDEX idx_zip_demographics_population ON zip_demographics(population_bucket)")
+def create_index(cursor, name, table, columns, kind=''):
+    """Create an index unless an earlier run already did"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, name)
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE {kind} INDEX {name} ON {table}({columns})")
+
+def create_staging_table(cursor, table):
+    """Empty copy of a table, without secondary indexes, to load before swapping it in"""
+    # Tables are loaded beside the live ones and swapped in afterwards,
+    # so the app never sees them empty or half-loaded
+    cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+    cursor.execute(f"CREATE TABLE {table}_new ({TABLE_SCHEMAS[table]})")
+
+def index_staging_table(cursor, table):
+    """Build a staging table's secondary indexes once its rows are in, which is faster than maintaining them per row"""
+    for name, columns, *kind in TABLE_INDEXES[table]:
+        cursor.execute(f"CREATE {' '.join(kind)} INDEX {name} ON {table}_new({columns})")
+
+def swap_in_tables(mysql_conn, tables):
+    """Atomically replace the live tables with their loaded staging copies"""
+    cursor = mysql_conn.cursor()
+    for table in tables:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} LIKE {table}_new")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_old")
+
+    # RENAME TABLE moves every name in one atomic step, so readers see
+    # either all of the old tables or all of the new ones
+    renames = [f"{table} TO {table}_old, {table}_new TO {table}" for table in tables]
+    cursor.execute(f"RENAME TABLE {', '.join(renames)}")
+    for table in tables:
+        cursor.execute(f"DROP TABLE {table}_old")
+    mysql_conn.commit()
+    print(f"Swapped in new {', '.join(tables)} tables")
+
+# Primary key of each migrated table, used to match rows between SQLite and MySQL
+TABLE_KEYS = {
+    'colleges': ['id'],
+    'zip_demographics': ['zip_code'],
+    'zip_coordinates': ['zip_code'],
+    'zip_boundaries': ['zip_code'],
+    'zip_boundary_lods': ['zip_code', 'lod'],
+    'merged_boundaries': ['income_bucket', 'population_bucket', 'region_id']
+}
+
+def read_sqlite_table(sqlite_conn, table, chunksize=None):
+    """Rows of a SQLite table in the shape the MySQL table expects, or an iterator of chunks of them"""
+    query = f"SELECT * FROM {table}"
+    if table == 'colleges':
+        # Select only the columns we need for colleges; rowid is the stable id college_context uses
+        columns = ['NAME', 'ADDRESS', 'CITY', 'STATE', 'ZIP', 'TELEPHONE', 'POPULATION', 'COUNTY', 'COUNTYFIPS', 'WEBSITE']
+        query = f"SELECT rowid AS id, {', '.join(columns)} FROM {table}"
+    elif table == 'zip_boundaries':
+        # For zip_boundaries, select specific columns. Geometry goes into a
+        # LONGTEXT column as-is; cutting it short would corrupt the JSON
+        query = """
+            SELECT zip_code, geometry, geometry_packed, area_sq_meters, perimeter_meters, population_density,
+                   min_lon, min_lat, max_lon, max_lat
+            FROM zip_boundaries
+        """
+    if chunksize is None:
+        return with_spatial_column(table, pd.read_sql_query(query, sqlite_conn))
+    return (with_spatial_column(table, chunk) for chunk in pd.read_sql_query(query, sqlite_conn, chunksize=chunksize))
+
+# Native geometry columns, stored as WKB built from the table's GeoJSON
+SPATIAL_COLUMNS = {'zip_boundaries': 'shape'}
+
+def with_spatial_column(table, df):
+    """Add the WKB for a table's spatial column, if it has one, skipping rows whose geometry does not parse"""
+    column = SPATIAL_COLUMNS.get(table)
+    if column:
+        df[column] = shapely.to_wkb(shapely.from_geojson(df['geometry'].fillna('').to_numpy(), on_invalid='ignore'))
+        # The column is NOT NULL, so one bad geometry would fail its whole batch
+        invalid = df[column].isna()
+        if invalid.any():
+            keys = df.loc[invalid, TABLE_KEYS[table]].astype(str).agg('/'.join, axis=1)
+            print(f"Skipping {int(invalid.sum())} {table} rows whose geometry does not parse "
+                  f"(e.g. {', '.join(keys.head(5))})")
+            df = df[~invalid].reset_index(drop=True)
+    return df
+
+# Share of max_allowed_packet one multi-row INSERT may fill; escaping can
+# double binary values, and the statement text needs room too
+PACKET_FILL = 0.5
+MAX_BATCH_ROWS = 1000
+
+def max_allowed_packet(cursor):
+    cursor.execute("SELECT @@max_allowed_packet")
+    return int(cursor.fetchone()[0])
+
+def row_bytes(row):
+    """Rough size of a row in an INSERT statement"""
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row) + 4 * len(row)
+
+def byte_batches(rows, max_bytes, max_rows=MAX_BATCH_ROWS):
+    """Split rows into batches of at most max_bytes each, and at most max_rows"""
+    batch, size = [], 0
+    for row in rows:
+        size_of_row = row_bytes(row)
+        if batch and (size + size_of_row > max_bytes or len(batch) >= max_rows):
+            yield batch
+            batch, size = [], 0
+        batch.append(row)
+        size += size_of_row
+    if batch:
+        yield batch
+
+def insert_rows(mysql_conn, table, target_table, df):
+    """Insert a DataFrame into MySQL in batches sized to fit the server's packet limit"""
+    # Missing values must reach MySQL as NULL, not NaN
+    df = df.astype(object).where(pd.notna(df), None)
+    
+    # Prepare MySQL cursor
+    mysql_cursor = mysql_conn.cursor()
+    packet_limit = max_allowed_packet(mysql_cursor)
     
+    # Generate placeholders for the INSERT statement; spatial columns arrive as WKB
+    spatial_column = SPATIAL_COLUMNS.get(table)
+    placeholders = ', '.join('ST_GeomFromWKB(%s)' if col == spatial_column else '%s' for col in df.columns)
+    columns = ', '.join(f"`{col}`" for col in df.columns)
+    
+    # Batches are sized by bytes rather than rows, so a run of large boundaries never overflows the packet
+    rows = (tuple(row) for row in df.itertuples(index=False, name=None))
+    for batch in byte_batches(rows, int(packet_limit * PACKET_FILL)):
+        if len(batch) == 1 and row_bytes(batch[0]) * 2 > packet_limit:
+            # Never drop or cut a row; the server limit has to go up instead
+            raise ValueError(f"A {table} row of {row_bytes(batch[0]):,} bytes may not fit max_allowed_packet "
+                             f"({packet_limit:,} bytes); raise max_allowed_packet on the MySQL server")
+        mysql_cursor.executemany(
+            f"INSERT INTO {target_table} ({columns}) VALUES ({placeholders})",
+            batch
+        )
+        mysql_conn.commit()
+        print(f"Inserted batch of {len(batch)} rows into {table}")
+
+def sync_table(mysql_conn, table, df):
+    """Bring a MySQL table in line with its SQLite copy, touching only changed rows"""
+    key_columns = TABLE_KEYS[table]
+    changed, stale_keys, content_hash = diff_rows(mysql_conn, table, df, key_columns)
+    print(f"{table}: {len(changed)} new or changed rows, {len(df) - len(changed)} unchanged")
+    delete_keys(mysql_conn, table, key_columns, stale_keys)
     mysql_conn.commit()
+    insert_rows(mysql_conn, table, table, changed)
+    return content_hash
+
+# Derived tables rebuilt wholesale by the setup scripts, so copied in full rather than synced by key
+FULL_RELOAD_TABLES = ['college_context', 'demographic_rollups']
+
+def load_full_table(mysql_conn, table, df):
+    """Reload a table in full beside the live one and swap it in"""
+    cursor = mysql_conn.cursor()
+    create_staging_table(cursor, table)
+    insert_rows(mysql_conn, table, f"{table}_new", df)
+    index_staging_table(cursor, table)
+    swap_in_tables(mysql_conn, [table])
+
+# Bulk loads: SQLite rows read per chunk while writing the load file, tables
+# loaded at once, and where the load files go (the system temp dir by default)
+BULK_CHUNK_SIZE = 10000
+BULK_LOAD_WORKERS = int(os.getenv('MYSQL_LOAD_WORKERS', '4'))
+BULK_LOAD_TMPDIR = os.getenv('MYSQL_LOAD_TMPDIR')
+
+def tsv_value(value):
+    """One field in LOAD DATA's default text format; binary values are hex, decoded with UNHEX on load"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, float):
+        # Integer columns holding NULLs come out of SQLite as floats
+        return str(int(value)) if value.is_integer() else repr(value)
+    if isinstance(value, str):
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+    return str(value)
+
+def write_tsv_chunk(f, df):
+    """Append a DataFrame to a load file, one line per row"""
+    lines = ['\t'.join(tsv_value(value) for value in row) for row in df.astype(object).itertuples(index=False, name=None)]
+    if lines:
+        f.write('\n'.join(lines) + '\n')
+
+def binary_columns(cursor, table):
+    """Binary and spatial columns of a MySQL table, with the expression decoding each from hex"""
+    cursor.execute(
+        "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,)
+    )
+    decoders = {}
+    for column, data_type in cursor.fetchall():
+        if data_type.lower() in ('blob', 'mediumblob', 'longblob'):
+            decoders[column] = f"UNHEX(@{column})"
+        elif data_type.lower() == 'geometry':
+            decoders[column] = f"ST_GeomFromWKB(UNHEX(@{column}))"
+    return decoders
+
+def bulk_load_table(table):
+    """Stream one SQLite table to a load file and LOAD DATA it into a fresh staging table"""
+    start_time = time.time()
+    sqlite_conn = sqlite3.connect('education_demographics.db')
+    mysql_conn = get_mysql_connection(with_database=True)
+    fd, path = tempfile.mkstemp(prefix=f"{table}_", suffix='.tsv', dir=BULK_LOAD_TMPDIR)
+    try:
+        # Write the rows out chunk by chunk, so a table never has to fit in memory
+        rows = 0
+        columns = []
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            for chunk in read_sqlite_table(sqlite_conn, table, chunksize=BULK_CHUNK_SIZE):
+                if table in TABLE_KEYS:
+                    # Hashed as sync_table hashes rows, so later incremental runs diff against this load
+                    # (a chunk whose column types differ from the whole table's is just rewritten once)
+                    chunk = chunk.drop(columns=['row_hash'], errors='ignore')
+                    chunk['row_hash'] = row_hashes(chunk).to_numpy()
+                write_tsv_chunk(f, chunk)
+                rows += len(chunk)
+                columns = list(chunk.columns)
+        export_time = time.time() - start_time
+
+        cursor = mysql_conn.cursor()
+        create_staging_table(cursor, table)
+        if rows:
+            # Binary and spatial columns arrive as hex in user variables and are decoded on the way in
+            binary = binary_columns(cursor, f"{table}_new")
+            targets = ', '.join(f"@{column}" if column in binary else f"`{column}`" for column in columns)
+            decode = ', '.join(f"`{column}` = {binary[column]}" for column in columns if column in binary)
+            cursor.execute(
+                f"""LOAD DATA LOCAL INFILE %s INTO TABLE {table}_new CHARACTER SET utf8mb4
+                    FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'
+                    ({targets}){f' SET {decode}' if decode else ''}""",
+                (path,)
+            )
+        load_time = time.time() - start_time - export_time
+        index_staging_table(cursor, table)
+        mysql_conn.commit()
+
+        elapsed = time.time() - start_time
+        print(f"Loaded {rows:,} rows into {table}_new in {elapsed:.1f} seconds ({rows / elapsed:,.0f} rows/sec; "
+              f"export {export_time:.1f}s, load {load_time:.1f}s, indexes {elapsed - export_time - load_time:.1f}s)")
+        return rows, elapsed
+    finally:
+        os.remove(path)
+        sqlite_conn.close()
+        mysql_conn.close()
+
+def bulk_migrate(workers=BULK_LOAD_WORKERS):
+    """Reload every table in full with LOAD DATA LOCAL INFILE, several at a time, then swap them all in at once"""
+    print("Starting bulk data migration...")
+    start_time = time.time()
+    create_database()
+    tables = list(TABLE_KEYS) + FULL_RELOAD_TABLES
+
+    # Each load uses its own connections; the live tables are untouched until every one succeeded
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = dict(zip(tables, executor.map(bulk_load_table, tables)))
+
+    mysql_conn = get_mysql_connection(with_database=True)
+    try:
+        swap_in_tables(mysql_conn, tables)
+        version = stamp_data_version(mysql_conn)
+        write_label_artifact(mysql_conn, version)
+        print(f"Data version is now {version}")
+    finally:
+        mysql_conn.close()
+
+    elapsed = time.time() - start_time
+    total_rows = sum(rows for rows, _ in results.values())
+    for table, (rows, table_time) in results.items():
+        print(f"{table}: {rows:,} rows in {table_time:.1f} seconds ({rows / table_time:,.0f} rows/sec)")
+    print(f"Bulk migration of {total_rows:,} rows finished in {elapsed:.1f} seconds ({total_rows / elapsed:,.0f} rows/sec)")
 
 def migrate_data():
     print("Starting data migration...")
@@ -115,79 +600,38 @@ def migrate_data():
         mysql_conn = get_mysql_connection(with_database=True)
         sqlite_conn = sqlite3.connect('education_demographics.db')
         
-        # Create tables in MySQL
-        create_tables(mysql_conn)
+        # Create tables in MySQL; tables whose rows a migration touched are synced again
+        migrated = create_tables(mysql_conn)
+        
+        # Tables whose SQLite content is unchanged since the last migration are skipped,
+        # and an interrupted migration resumes at the table it stopped on
+        pipeline = Pipeline(mysql_conn, 'setup_mysql')
         
         # Migrate data from SQLite to MySQL
-        tables = ['colleges', 'zip_demographics', 'zip_coordinates', 'zip_boundaries']
+        tables = ['colleges', 'zip_demographics', 'zip_coordinates', 'zip_boundaries', 'zip_boundary_lods', 'merged_boundaries'] + FULL_RELOAD_TABLES
         
         for table in tables:
             print(f"Migrating {table}...")
             
             # Read data from SQLite
-            if table == 'colleges':
-                # Select only the columns we need for colleges
-                columns = ['NAME', 'ADDRESS', 'CITY', 'STATE', 'ZIP', 'TELEPHONE', 'POPULATION', 'COUNTY', 'COUNTYFIPS', 'WEBSITE']
-                df = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM {table}", sqlite_conn)
-            elif table == 'zip_boundaries':
-                # For zip_boundaries, process in smaller chunks and select specific columns
-                df = pd.read_sql_query("SELECT zip_code, geometry, perimeter_meters FROM zip_boundaries", sqlite_conn)
-                # Convert geometry to smaller format if needed
-                if 'geometry' in df.columns:
-                    # Truncate or simplify geometry if it's too large
-                    def truncate_geometry(geom):
-                        if len(geom) > 65000:  # MySQL's default max packet size is usually around 16MB
-                            return geom[:65000]
-                        return geom
-                    df['geometry'] = df['geometry'].apply(truncate_geometry)
-            else:
-                df = pd.read_sql_query(f"SELECT * FROM {table}", sqlite_conn)
-            
+            df = read_sqlite_table(sqlite_conn, table)
             print(f"Read {len(df)} rows from SQLite")
             
-            if len(df) == 0:
-                print(f"No data found in {table}, skipping...")
-                continue
-                
-            # Prepare MySQL cursor
-            mysql_cursor = mysql_conn.cursor()
-            
-            # Generate placeholders for the INSERT statement
-            placeholders = ', '.join(['%s'] * len(df.columns))
-            columns = ', '.join(f"`{col}`" for col in df.columns)
-            
-            # Insert data in batches
-            batch_size = 100 if table == 'zip_boundaries' else 1000  # Smaller batch size for boundaries
-            for i in range(0, len(df), batch_size):
-                batch = df.iloc[i:i + batch_size]
-                values = [tuple(row) for row in batch.values]
-                
-                try:
-                    mysql_cursor.executemany(
-                        f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
-                        values
-                    )
-                    mysql_conn.commit()
-                    print(f"Inserted batch of {len(batch)} rows into {table}")
-                except Exception as e:
-                    print(f"Error inserting batch into {table}: {str(e)}")
-                    mysql_conn.rollback()
-                    if "max_allowed_packet" in str(e):
-                        print("Reducing batch size due to packet size limit")
-                        # Try inserting one at a time for this batch
-                        for row in values:
-                            try:
-                                mysql_cursor.execute(
-                                    f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
-                                    row
-                                )
-                                mysql_conn.commit()
-                                print("Inserted single row successfully")
-                            except Exception as e2:
-                                print(f"Error inserting single row: {str(e2)}")
-                                mysql_conn.rollback()
+            if table in FULL_RELOAD_TABLES:
+                pipeline.run_stage(table, [hash_dataframe(df)], lambda: load_full_table(mysql_conn, table, df))
+            else:
+                pipeline.run_stage(table, [hash_dataframe(df)], lambda: sync_table(mysql_conn, table, df),
+                                   force=table in migrated)
             
             print(f"Completed migration of {table}")
+        
+        # Invalidate the app's cached results
+        if pipeline.changed:
+            version = stamp_data_version(mysql_conn)
+            write_label_artifact(mysql_conn, version)
+            print(f"Data version is now {version}")
+        else:
+            print("No tables changed; data version left as is")
             
     except Exception as e:
         print(f"Error during migration: {str(e)}")
@@ -200,4 +644,13 @@ def migrate_data():
             mysql_conn.close()
 
 if __name__ == "__main__":
-    migrate_data()
+    parser = argparse.ArgumentParser(description='Copy education_demographics.db into MySQL')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Reload every table with LOAD DATA LOCAL INFILE instead of syncing changed rows')
+    parser.add_argument('--workers', type=int, default=BULK_LOAD_WORKERS,
+                        help='Tables loaded at once in bulk mode')
+    args = parser.parse_args()
+    if args.bulk:
+        bulk_migrate(args.workers)
+    else:
+        migrate_data()
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Numeric college_context columns kept as float arrays (NULL becomes NaN, which
+# fails every comparison just as NULL does in SQL), and the ones with a sorted
+# index for range filters
+NUMERIC_COLUMNS = ['median_household_income', 'zip_population', 'population_density', 'latitude', 'longitude']
+SORTED_COLUMNS = ['median_household_income', 'zip_population', 'population_density']
+
+class DataSnapshot:
+    """Immutable columnar copy of college_context for one data version, filtered with NumPy masks"""
+
+    def __init__(self, version, colleges, demographics):
+        self.version = version
+        self.rows = colleges  # Result rows, in id order
+        self.demographics = demographics  # The /api/demographics summary
+
+        self.columns = {}
+        for name in NUMERIC_COLUMNS:
+            values = np.array([np.nan if row[name] is None else float(row[name]) for row in colleges], dtype=float)
+            values.flags.writeable = False
+            self.columns[name] = values
+
+        # Buckets as small integer codes, -1 for NULL
+        self.bucket_codes = {}
+        for name in ('income_bucket', 'population_bucket'):
+            code_of = {}
+            codes = np.array([-1 if row[name] is None else code_of.setdefault(row[name], len(code_of))
+                              for row in colleges], dtype=np.int16)
+            codes.flags.writeable = False
+            self.bucket_codes[name] = (codes, code_of)
+
+        # Positions sorted by value (NaN last), so a range is two binary searches
+        self.sorted_index = {}
+        for name in SORTED_COLUMNS:
+            order = np.argsort(self.columns[name], kind='stable')
+            self.sorted_index[name] = (order, self.columns[name][order])
+
+    def _range_candidates(self, name, low, high):
+        """Positions whose value lies in [low, high], from the sorted index"""
+        order, sorted_values = self.sorted_index[name]
+        start = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+        # NaNs sort last and never match, so an open upper end stops before them
+        end = (np.searchsorted(sorted_values, high, side='right') if high is not None
+               else np.count_nonzero(~np.isnan(sorted_values)))
+        return order[start:end]
+
+    def _select(self, ranges, buckets=None):
+        """Rows matching every (low, high) range and bucket list, in id order"""
+        ranges = {name: bounds for name, bounds in ranges.items() if bounds != (None, None)}
+        indexed = [name for name in ranges if name in self.sorted_index]
+        if indexed:
+            # Start from the narrowest indexed range and mask the rest
+            candidates = min((self._range_candidates(name, *ranges[name]) for name in indexed), key=len)
+        else:
+            candidates = np.arange(len(self.rows))
+
+        mask = np.ones(len(candidates), dtype=bool)
+        for name, (low, high) in ranges.items():
+            values = self.columns[name][candidates]
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        for name, selected in (buckets or {}).items():
+            # None means no filter; an empty list matches nothing, as in bucket_filter
+            if selected is not None:
+                codes, code_of = self.bucket_codes[name]
+                mask &= np.isin(codes[candidates], [code_of[label] for label in selected if label in code_of])
+
+        positions = np.sort(candidates[mask])
+        return [self.rows[i] for i in positions]
+
+    def select_colleges(self, min_income=None, max_income=None, min_population=None, max_population=None,
+                        min_density=None, max_density=None):
+        """Same rows as the /api/colleges query"""
+        return self._select({
+            'median_household_income': (min_income, max_income),
+            'zip_population': (min_population, max_population),
+            'population_density': (min_density, max_density)
+        })
+
+    def colleges_in_bbox(self, west, south, east, north, income_buckets=None, population_buckets=None,
+                         min_density=None, max_density=None):
+        """Same rows as the viewport's college query"""
+        return self._select(
+            {
+                'latitude': (south, north),
+                'longitude': (west, east),
+                'population_density': (min_density, max_density)
+            },
+            {'income_bucket': income_buckets, 'population_bucket': population_buckets}
+        )
+
+class SnapshotManager:
+    """Holds the current snapshot and swaps in a freshly loaded one when the data version changes"""
+
+    def __init__(self, load, current_version):
+        self._load = load
+        self._current_version = current_version
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._load_seconds = None
+
+    def get(self):
+        """Snapshot for the current data version, loading it first if needed"""
+        version = self._current_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        # One thread loads; the others wait for it rather than serve a snapshot
+        # whose results would be cached under the new version
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                start_time = time.time()
+                snapshot = self._load(version)
+                # Readers hold a reference to whole snapshots, so swapping this one reference is atomic for them
+                self._snapshot = snapshot
+                self._loaded_at = time.time()
+                self._load_seconds = self._loaded_at - start_time
+                logger.info(f"Loaded data snapshot {version}: {len(snapshot.rows)} colleges "
+                            f"in {self._load_seconds:.2f} seconds")
+            return self._snapshot
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version if snapshot else None,
+            'colleges': len(snapshot.rows) if snapshot else 0,
+            'loaded_at': self._loaded_at,
+            'load_seconds': self._load_seconds
+        }
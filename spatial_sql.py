@@ -0,0 +1,16 @@
+# Bounding-box filters answered by the SPATIAL index on zip_boundaries.shape.
+#
+# shape holds each ZIP's polygon as native MySQL geometry with SRID 0, so
+# longitude and latitude are plain x/y and MBR tests on it are Cartesian in
+# degrees, exactly like the min/max_lon/lat columns they replace. Written by
+# setup_mysql.py from the GeoJSON in the SQLite build.
+
+def envelope_wkt(west, south, east, north):
+    """WKT polygon of a longitude/latitude bbox"""
+    return (f"POLYGON(({west!r} {south!r}, {east!r} {south!r}, {east!r} {north!r}, "
+            f"{west!r} {north!r}, {west!r} {south!r}))")
+
+def bbox_condition(table_alias, west, south, east, north, params):
+    """SQL condition matching rows whose shape's bounding box overlaps a bbox"""
+    params.append(envelope_wkt(west, south, east, north))
+    return f"MBRIntersects({table_alias}.shape, ST_GeomFromText(%s))"
@@ -1,33 +1,240 @@
 let map;
-let markers = [];
-let polygons = [];
-let allColleges = null;  // Changed to null to indicate not loaded
-let allBoundaries = null;  // Changed to null to indicate not loaded
+let collegeLayer;  // Cluster and college markers for the current view
+let boundaryLayer;  // Vector tile layer with every ZIP boundary
+let mergedLayer = null;  // Dissolved regions for the selected buckets
+let mergedRequest = null;
+let viewportRequest = null;  // AbortController for the in-flight viewport fetch
+let fetchTimer = null;
 let dataTable;
+let tableCursors = new Map();  // Keyset cursor for each page start, for the current filters, sort and search
+let tableQuery = '';  // The filters, sort and search those cursors belong to
+let dataVersion = '';  // Appended as ?v= so responses for this data build can be cached forever
+let boundaryFilter = { income: new Set(), population: new Set(), minDensity: null, maxDensity: null };  // What the tile layer draws
+const MERGED_MAX_ZOOM = 8;  // Up to this zoom draw dissolved regions instead of per-ZIP tiles
+const PACKED_GEOMETRY_MIMETYPE = 'application/vnd.zipgeom';  // See geometry_codec.py
+
+const boundaryFillStyle = {
+    fill: true,
+    fillColor: '#4a0080',
+    fillOpacity: 0.35,
+    stroke: false
+};
 
 // Initialize the map
 function initMap() {
     console.log('Initializing map...');
     try {
+        dataVersion = document.getElementById('map').dataset.version || '';
         map = L.map('map').setView([39.8283, -98.5795], 4); // Center of US
         L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
             maxZoom: 19,
             attribution: ' OpenStreetMap contributors'
         }).addTo(map);
+        initBoundaryLayer();
+        collegeLayer = L.layerGroup().addTo(map);
         console.log('Map initialized successfully');
     } catch (error) {
         console.error('Error initializing map:', error);
     }
 }
 
-// Initialize DataTable
-function initDataTable(data) {
-    if (dataTable) {
-        dataTable.destroy();
+// Whether a population density falls inside the selected range; null bounds are open
+function inDensityRange(density, minDensity, maxDensity) {
+    if (minDensity === null && maxDensity === null) {
+        return true;
+    }
+    if (density === undefined || density === null) {
+        return false;
+    }
+    return (minDensity === null || density >= minDensity) && (maxDensity === null || density <= maxDensity);
+}
+
+// Style for a ZIP boundary tile feature, hidden unless its buckets and density are selected
+function boundaryStyle(properties) {
+    if (boundaryFilter.income.has(properties.income_bucket) &&
+        boundaryFilter.population.has(properties.population_bucket) &&
+        inDensityRange(properties.population_density, boundaryFilter.minDensity, boundaryFilter.maxDensity)) {
+        return boundaryFillStyle;
+    }
+    return { fill: false, stroke: false };
+}
+
+// ZIP boundaries come from pre-rendered vector tiles and are filtered by
+// restyling, so changing buckets never refetches polygons
+function initBoundaryLayer() {
+    boundaryLayer = L.vectorGrid.protobuf(`/tiles/{z}/{x}/{y}.mvt?v=${encodeURIComponent(dataVersion)}`, {
+        vectorTileLayerStyles: {
+            zip_boundaries: boundaryStyle
+        },
+        minZoom: MERGED_MAX_ZOOM + 1,
+        maxNativeZoom: 14,
+        interactive: false
+    }).addTo(map);
+}
+
+// Decode a packed geometry collection into GeoJSON MultiPolygon features.
+// Offsets and coordinates are read as typed-array views over the response
+// buffer, so nothing is parsed as text except the small properties array.
+function decodePackedGeometries(buffer) {
+    const header = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'ZGEO' || header.getUint16(4, true) !== 1) {
+        throw new Error('Unsupported packed geometry format');
+    }
+    const featureCount = header.getUint32(8, true);
+    const polygonCount = header.getUint32(12, true);
+    const ringCount = header.getUint32(16, true);
+    const coordCount = header.getUint32(20, true);
+    const scale = header.getFloat64(24, true);
+    const propertiesLength = header.getUint32(32, true);
+
+    let offset = 36;
+    const featureOffsets = new Uint32Array(buffer, offset, featureCount + 1);
+    offset += 4 * (featureCount + 1);
+    const polygonOffsets = new Uint32Array(buffer, offset, polygonCount + 1);
+    offset += 4 * (polygonCount + 1);
+    const ringOffsets = new Uint32Array(buffer, offset, ringCount + 1);
+    offset += 4 * (ringCount + 1);
+    const coords = new Int32Array(buffer, offset, coordCount * 2);
+    offset += 8 * coordCount;
+    const properties = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, offset, propertiesLength)));
+
+    const features = [];
+    for (let f = 0; f < featureCount; f++) {
+        const polygons = [];
+        for (let p = featureOffsets[f]; p < featureOffsets[f + 1]; p++) {
+            const rings = [];
+            for (let r = polygonOffsets[p]; r < polygonOffsets[p + 1]; r++) {
+                const ring = [];
+                for (let c = ringOffsets[r]; c < ringOffsets[r + 1]; c++) {
+                    ring.push([coords[2 * c] / scale, coords[2 * c + 1] / scale]);
+                }
+                rings.push(ring);
+            }
+            polygons.push(rings);
+        }
+        features.push({
+            type: 'Feature',
+            geometry: { type: 'MultiPolygon', coordinates: polygons },
+            properties: properties[f]
+        });
+    }
+    return features;
+}
+
+// Fetch the dissolved regions for the selected buckets; tens of polygons
+// cover what would otherwise be thousands of ZIP shapes at low zoom
+async function fetchMergedBoundaries() {
+    if (mergedRequest) {
+        mergedRequest.abort();
+        mergedRequest = null;
+    }
+    if (mergedLayer) {
+        map.removeLayer(mergedLayer);
+        mergedLayer = null;
+    }
+    if (boundaryFilter.income.size === 0 || boundaryFilter.population.size === 0) {
+        return;
+    }
+
+    const params = new URLSearchParams({ v: dataVersion });
+    boundaryFilter.income.forEach(bucket => params.append('income_bucket', bucket));
+    boundaryFilter.population.forEach(bucket => params.append('population_bucket', bucket));
+
+    mergedRequest = new AbortController();
+    try {
+        // Packed binary geometry is about half the size of GeoJSON and skips JSON.parse per region
+        const response = await fetch(`/api/merged_boundaries?${params}`, {
+            signal: mergedRequest.signal,
+            headers: { 'Accept': PACKED_GEOMETRY_MIMETYPE }
+        });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const regions = decodePackedGeometries(await response.arrayBuffer());
+        console.log(`Received ${regions.length} merged regions`);
+        mergedLayer = L.geoJSON(regions, { style: boundaryFillStyle, interactive: false });
+        updateMergedLayerVisibility();
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('Error fetching merged boundaries:', error);
+        }
+    }
+}
+
+// Show merged regions only at the zooms where the tile layer is hidden
+function updateMergedLayerVisibility() {
+    if (!mergedLayer) {
+        return;
+    }
+    if (map.getZoom() <= MERGED_MAX_ZOOM) {
+        mergedLayer.addTo(map);
+    } else {
+        map.removeLayer(mergedLayer);
+    }
+}
+
+// Filter parameters for the colleges in view, or null when none are shown
+function tableFilterParams() {
+    const { selectedIncome, selectedPopulation, showColleges, minDensity, maxDensity } = getSelectedFilters();
+    if (!showColleges || selectedIncome.length === 0 || selectedPopulation.length === 0) {
+        return null;
+    }
+    const bounds = map.getBounds();
+    const params = new URLSearchParams({
+        bbox: [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()].join(',')
+    });
+    selectedIncome.forEach(bucket => params.append('income_bucket', bucket));
+    selectedPopulation.forEach(bucket => params.append('population_bucket', bucket));
+    if (minDensity !== null) params.append('min_density', minDensity);
+    if (maxDensity !== null) params.append('max_density', maxDensity);
+    return params;
+}
+
+// DataTables ajax source: fetch just the requested page. The server sorts and
+// searches; each page returns a cursor that the next page seeks from
+async function fetchTablePage(request, callback) {
+    const empty = { draw: request.draw, recordsTotal: 0, recordsFiltered: 0, data: [] };
+    const params = tableFilterParams();
+    if (!params) {
+        callback(empty);
+        return;
+    }
+    const sort = request.order[0] || { column: 0, dir: 'asc' };
+    params.append('order[0][column]', sort.column);
+    params.append('order[0][dir]', sort.dir);
+    params.append(`columns[${sort.column}][data]`, request.columns[sort.column].data);
+    params.append('search[value]', request.search.value);
+
+    // Cursors are only valid for the filters, sort and search they came from
+    const query = params.toString();
+    if (query !== tableQuery) {
+        tableCursors = new Map();
+        tableQuery = query;
     }
-    
+    const cursor = tableCursors.get(request.start);
+    if (cursor) params.append('after', JSON.stringify(cursor));
+    params.append('draw', request.draw);
+    params.append('start', request.start);
+    params.append('length', request.length);
+
+    try {
+        const response = await fetch(`/api/colleges/table?${params}`);
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const page = await response.json();
+        if (page.next) tableCursors.set(request.start + page.data.length, page.next);
+        callback(page);
+    } catch (error) {
+        console.error('Error fetching college table:', error);
+        callback(empty);
+    }
+}
+
+// Initialize DataTable; pages are loaded from the server as they are shown
+function initDataTable() {
     dataTable = $('#collegeTable').DataTable({
-        data: data || [],  // Use empty array if no data
+        serverSide: true,
+        processing: true,
+        ajax: fetchTablePage,
+        searchDelay: 300,
         columns: [
             { 
                 data: 'NAME',
@@ -35,7 +242,8 @@ function initDataTable(data) {
             },
             { 
                 data: 'ADDRESS',
-                defaultContent: ''
+                defaultContent: '',
+                orderable: false
             },
             { 
                 data: 'CITY',
@@ -47,11 +255,13 @@ function initDataTable(data) {
             },
             { 
                 data: 'ZIP',
-                defaultContent: ''
+                defaultContent: '',
+                orderable: false
             },
             { 
                 data: 'TELEPHONE',
-                defaultContent: ''
+                defaultContent: '',
+                orderable: false
             },
             { 
                 data: 'POPULATION',
@@ -59,15 +269,18 @@ function initDataTable(data) {
             },
             { 
                 data: 'COUNTY',
-                defaultContent: ''
+                defaultContent: '',
+                orderable: false
             },
             { 
                 data: 'COUNTYFIPS',
-                defaultContent: ''
+                defaultContent: '',
+                orderable: false
             },
             { 
                 data: 'WEBSITE',
                 defaultContent: '',
+                orderable: false,
                 render: function(data) {
                     return data ? `<a href="${data}" target="_blank">${data}</a>` : '';
                 }
@@ -79,132 +292,197 @@ function initDataTable(data) {
             { 
                 data: 'population_bucket',
                 defaultContent: ''
+            },
+            {
+                data: 'population_density',
+                defaultContent: '',
+                orderable: false,
+                render: function(data) {
+                    return data === null || data === undefined ? '' : Number(data).toFixed(1);
+                }
             }
         ],
         pageLength: 25,
+        lengthMenu: [10, 25, 50, 100],
         order: [[0, 'asc']], // Sort by name by default
+        orderMulti: false,
         scrollX: true
     });
 }
 
-// Fetch data based on current filters
-async function fetchFilteredData() {
+// Get the currently selected filter values
+function getSelectedFilters() {
     const selectedIncome = Array.from(document.querySelectorAll('input[data-filter-type="income"]:checked'))
         .map(cb => cb.value);
     const selectedPopulation = Array.from(document.querySelectorAll('input[data-filter-type="population"]:checked'))
         .map(cb => cb.value);
     const showColleges = document.querySelector('input[data-filter-type="business"][value="colleges"]').checked;
+    const minDensity = parseDensity(document.getElementById('density-min').value);
+    const maxDensity = parseDensity(document.getElementById('density-max').value);
+    return { selectedIncome, selectedPopulation, showColleges, minDensity, maxDensity };
+}
 
-    try {
-        // Only fetch colleges if they haven't been fetched and are needed
-        if (showColleges && allColleges === null && (selectedIncome.length > 0 && selectedPopulation.length > 0)) {
-            console.log('Fetching colleges...');
-            const response = await fetch('/get_colleges');
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            allColleges = await response.json();
-            console.log(`Received ${allColleges.length} colleges from server`);
-        }
+// Density input value as a number, or null when left blank
+function parseDensity(value) {
+    const density = parseFloat(value);
+    return Number.isFinite(density) ? density : null;
+}
 
-        // Only fetch boundaries if they haven't been fetched and filters are selected
-        if (allBoundaries === null && (selectedIncome.length > 0 && selectedPopulation.length > 0)) {
-            console.log('Fetching boundaries...');
-            const response = await fetch('/get_boundaries');
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            allBoundaries = await response.json();
-            console.log(`Received ${allBoundaries.length} boundaries from server`);
-        }
+// Fetch the college clusters inside the current map view
+async function fetchFilteredData() {
+    const { selectedIncome, selectedPopulation, showColleges, minDensity, maxDensity } = getSelectedFilters();
+
+    // Cancel any request for a view we have already moved away from
+    if (viewportRequest) {
+        viewportRequest.abort();
+        viewportRequest = null;
+    }
 
-        updateMap();
+    if (!showColleges || selectedIncome.length === 0 || selectedPopulation.length === 0) {
+        updateMap({ clusters: [] });
+        return;
+    }
+
+    const bounds = map.getBounds();
+    const params = new URLSearchParams({
+        bbox: [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()].join(','),
+        zoom: map.getZoom(),
+        v: dataVersion
+    });
+    selectedIncome.forEach(bucket => params.append('income_bucket', bucket));
+    selectedPopulation.forEach(bucket => params.append('population_bucket', bucket));
+    if (minDensity !== null) params.append('min_density', minDensity);
+    if (maxDensity !== null) params.append('max_density', maxDensity);
+
+    viewportRequest = new AbortController();
+    try {
+        console.log('Fetching clusters...');
+        // Clustered on the server, so the response stays about the same size however many colleges match
+        const response = await fetch(`/api/clusters?${params}`, { signal: viewportRequest.signal });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const data = await response.json();
+        console.log(`Received ${data.clusters.length} clusters in view`);
+        updateMap(data);
     } catch (error) {
-        console.error('Error fetching data:', error);
+        if (error.name !== 'AbortError') {
+            console.error('Error fetching data:', error);
+        }
     }
 }
 
+// Restyle the boundary tiles and refetch colleges for a new bucket selection
+function onFilterChange() {
+    const { selectedIncome, selectedPopulation, minDensity, maxDensity } = getSelectedFilters();
+    boundaryFilter = {
+        income: new Set(selectedIncome),
+        population: new Set(selectedPopulation),
+        minDensity,
+        maxDensity
+    };
+    // Tiles carry the bucket and density attributes, so this re-renders without new data.
+    // Merged regions are dissolved by bucket only and ignore the density range
+    boundaryLayer.redraw();
+    fetchMergedBoundaries();
+    fetchFilteredData();
+}
+
+// Refetch after the map stops moving, at most once per pause
+function scheduleFetch() {
+    clearTimeout(fetchTimer);
+    fetchTimer = setTimeout(fetchFilteredData, 150);
+}
+
 // Clear all map layers
 function clearMapLayers() {
-    markers.forEach(marker => map.removeLayer(marker));
-    markers = [];
-    
-    polygons.forEach(polygon => map.removeLayer(polygon));
-    polygons = [];
+    collegeLayer.clearLayers();
 }
 
-// Update markers and polygons based on current filters
-function updateMap() {
-    console.log('Updating map...');
-    try {
-        clearMapLayers();
+// Full record of one college, loaded when its popup first opens
+async function loadCollege(id) {
+    const response = await fetch(`/api/colleges/${id}?v=${encodeURIComponent(dataVersion)}`);
+    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+    return response.json();
+}
 
-        const selectedIncome = Array.from(document.querySelectorAll('input[data-filter-type="income"]:checked'))
-            .map(cb => cb.value);
-        const selectedPopulation = Array.from(document.querySelectorAll('input[data-filter-type="population"]:checked'))
-            .map(cb => cb.value);
-        const showColleges = document.querySelector('input[data-filter-type="business"][value="colleges"]').checked;
+function collegePopupHtml(college) {
+    return `
+        <strong>${college.NAME}</strong><br>
+        ${college.ADDRESS || ''}<br>
+        ${college.CITY || ''}, ${college.STATE || ''} ${college.ZIP || ''}<br>
+        Income Bucket: ${college.income_bucket}<br>
+        Population Bucket: ${college.population_bucket}<br>
+        Density: ${college.population_density != null ? Number(college.population_density).toFixed(1) + ' per km&sup2;' : 'Unknown'}
+    `;
+}
 
-        // Only process data if we have selections
-        if (selectedIncome.length === 0 || selectedPopulation.length === 0) {
-            initDataTable([]); // Clear the table
-            return; // Exit early if no filters selected
+// Popup filled in from the server the first time it opens
+function bindLazyPopup(marker, ids) {
+    let loaded = false;
+    marker.bindPopup('Loading...', { maxHeight: 300 });
+    marker.on('popupopen', async () => {
+        if (loaded) return;
+        try {
+            const colleges = await Promise.all(ids.map(loadCollege));
+            marker.setPopupContent(colleges.map(collegePopupHtml).join('<hr>'));
+            loaded = true;
+        } catch (error) {
+            console.error('Error loading college details:', error);
+            marker.setPopupContent('Could not load college details');
         }
+    });
+}
 
-        // Filter colleges if we have them
-        const filteredColleges = allColleges ? allColleges.filter(college => 
-            selectedIncome.includes(college.income_bucket) &&
-            selectedPopulation.includes(college.population_bucket)
-        ) : [];
-
-        // Filter boundaries if we have them
-        const filteredBoundaries = allBoundaries ? allBoundaries.filter(boundary => 
-            selectedIncome.includes(boundary.income_bucket) &&
-            selectedPopulation.includes(boundary.population_bucket)
-        ) : [];
-
-        console.log(`Displaying ${filteredColleges.length} colleges and ${filteredBoundaries.length} boundaries after filtering`);
-
-        // Update table with filtered college data
-        initDataTable(filteredColleges);
-
-        // Add ZIP code polygons
-        if (filteredBoundaries.length > 0) {
-            filteredBoundaries.forEach(boundary => {
-                if (boundary.geometry) {
-                    try {
-                        const geojson = JSON.parse(boundary.geometry);
-                        const polygon = L.geoJSON(geojson, {
-                            style: {
-                                fillColor: '#4a0080',
-                                fillOpacity: 0.35,
-                                color: '#4a0080',
-                                weight: 0,
-                                stroke: false
-                            }
-                        });
-                        polygons.push(polygon);
-                        polygon.addTo(map);
-                    } catch (e) {
-                        console.error('Error adding polygon for ZIP:', boundary.zip_code, e);
-                    }
-                }
-            });
-        }
+// Bucket counts of a cluster, largest first
+function breakdownHtml(title, counts) {
+    const lines = Object.entries(counts)
+        .sort((a, b) => b[1] - a[1])
+        .map(([label, count]) => `${label}: ${count}`);
+    return lines.length ? `<em>${title}</em><br>${lines.join('<br>')}` : '';
+}
 
-        // Add college markers if needed
-        if (showColleges && filteredColleges.length > 0) {
-            filteredColleges.forEach(college => {
-                if (college.latitude && college.longitude) {
-                    const marker = L.marker([college.latitude, college.longitude])
-                        .bindPopup(`
-                            <strong>${college.NAME}</strong><br>
-                            ${college.ADDRESS || ''}<br>
-                            ${college.CITY || ''}, ${college.STATE || ''} ${college.ZIP || ''}<br>
-                            Income Bucket: ${college.income_bucket}<br>
-                            Population Bucket: ${college.population_bucket}
-                        `);
-                    markers.push(marker);
-                    marker.addTo(map);
-                }
-            });
-        }
+function clusterMarker(cluster) {
+    const size = 30 + 8 * Math.min(Math.floor(Math.log10(cluster.count)), 3);
+    const marker = L.marker([cluster.latitude, cluster.longitude], {
+        icon: L.divIcon({
+            html: `<div><span>${cluster.count}</span></div>`,
+            className: 'college-cluster',
+            iconSize: L.point(size, size)
+        })
+    });
+    marker.bindTooltip([
+        `<strong>${cluster.count} colleges</strong>`,
+        breakdownHtml('Income', cluster.income_buckets),
+        breakdownHtml('Population', cluster.population_buckets)
+    ].filter(Boolean).join('<br>'));
+    if (cluster.ids) {
+        // Zooming in would not separate these, so list them instead
+        bindLazyPopup(marker, cluster.ids);
+    } else {
+        const [west, south, east, north] = cluster.bounds;
+        marker.on('click', () => map.fitBounds([[south, west], [north, east]]));
+    }
+    return marker;
+}
+
+// Replace markers with the clusters for the current view
+function updateMap(data) {
+    console.log('Updating map...');
+    try {
+        clearMapLayers();
+
+        // Reload the table's first page for the new view and filters
+        dataTable.ajax.reload();
+
+        // One marker per cluster; single colleges get a marker whose popup loads on demand
+        (data.clusters || []).forEach(cluster => {
+            if (cluster.count === 1) {
+                const marker = L.marker([cluster.latitude, cluster.longitude]);
+                bindLazyPopup(marker, [cluster.id]);
+                collegeLayer.addLayer(marker);
+            } else {
+                collegeLayer.addLayer(clusterMarker(cluster));
+            }
+        });
     } catch (error) {
         console.error('Error updating map:', error);
     }
@@ -214,10 +492,17 @@ function updateMap() {
 document.addEventListener('DOMContentLoaded', () => {
     console.log('Page loaded, initializing application...');
     initMap();
-    initDataTable([]); // Initialize with empty data
+    initDataTable();
 
     // Add event listeners to checkboxes
     document.querySelectorAll('.filter-checkbox').forEach(checkbox => {
-        checkbox.addEventListener('change', fetchFilteredData);
+        checkbox.addEventListener('change', onFilterChange);
+    });
+    document.querySelectorAll('.density-filter').forEach(input => {
+        input.addEventListener('change', onFilterChange);
     });
+
+    // Only the visible area is loaded, so refetch whenever the view changes
+    map.on('moveend', scheduleFetch);
+    map.on('zoomend', updateMergedLayerVisibility);
 });
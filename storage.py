@@ -0,0 +1,183 @@
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import pymysql
+
+from db_pool import ConnectionPool
+from spatial_sql import bbox_condition as spatial_bbox_condition
+from text_search import COLLEGE_SEARCH_TABLE, boolean_mode_query, fts5_query
+
+logger = logging.getLogger(__name__)
+
+# Bytes of the SQLite file each connection maps into memory
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+
+class MySQLStorage:
+    """The MySQL database built by setup_mysql.py, reached through a connection pool"""
+
+    name = 'mysql'
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    def from_env(cls):
+        def connect():
+            return pymysql.connect(
+                host=os.getenv('MYSQL_HOST'),
+                user=os.getenv('MYSQL_USER'),
+                password=os.getenv('MYSQL_PASSWORD'),
+                database=os.getenv('MYSQL_DATABASE'),
+                cursorclass=pymysql.cursors.DictCursor,
+                autocommit=True
+            )
+
+        # Shared connection pool so requests reuse connections instead of reconnecting
+        return cls(ConnectionPool(
+            connect,
+            max_size=int(os.getenv('MYSQL_POOL_SIZE', '10')),
+            acquire_timeout=float(os.getenv('MYSQL_POOL_TIMEOUT', '5')),
+            recycle_seconds=float(os.getenv('MYSQL_POOL_RECYCLE', '3600')),
+            idle_timeout=float(os.getenv('MYSQL_POOL_IDLE_TIMEOUT', '300')),
+            ping_interval=float(os.getenv('MYSQL_POOL_PING_INTERVAL', '30'))
+        ))
+
+    @contextmanager
+    def cursor(self, streaming=False):
+        """Borrow a pooled connection and yield a dict cursor"""
+        with self.pool.connection() as conn:
+            # Unbuffered cursors fetch rows from the server as they are read
+            cursor = conn.cursor(pymysql.cursors.SSDictCursor if streaming else None)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def bbox_condition(self, table_alias, west, south, east, north, params):
+        """SQL condition matching ZIP boundaries overlapping a bbox, answered from the SPATIAL index"""
+        return spatial_bbox_condition(table_alias, west, south, east, north, params)
+
+    def college_search_condition(self, terms, params):
+        """SQL condition matching colleges whose name or city has words starting with every term, from the FULLTEXT index"""
+        params.append(boolean_mode_query(terms))
+        return "MATCH(NAME, CITY) AGAINST (%s IN BOOLEAN MODE)"
+
+    def stats(self):
+        return dict(self.pool.stats(), backend=self.name)
+
+class SQLiteCursor:
+    """sqlite3 cursor that accepts the app's %s placeholders and returns dict rows, like pymysql's DictCursor"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace('%s', '?'), tuple(params))
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [dict(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size):
+        return [dict(row) for row in self._cursor.fetchmany(size)]
+
+    def close(self):
+        self._cursor.close()
+
+class SQLiteStorage:
+    """The SQLite file built by the setup scripts, opened read-only with one connection per thread"""
+
+    name = 'sqlite'
+
+    def __init__(self, path, mmap_size=DEFAULT_MMAP_SIZE):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"SQLite database {path} not found; run database_setup.py first")
+        self.path = os.path.abspath(path)
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._wal_checked = False
+
+    def _enable_wal(self):
+        # The journal mode is stored in the file, so this needs one writable
+        # connection. In WAL mode the setup scripts can rebuild tables while
+        # the app keeps reading the last committed data
+        try:
+            conn = sqlite3.connect(self.path, timeout=5)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not switch {self.path} to WAL mode, reading it as is: {str(e)}")
+
+    def _connection(self):
+        """One read-only connection per thread; sqlite3 connections must not be shared across threads"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Deferred to the first query so importing the app touches no database
+            with self._lock:
+                if not self._wal_checked:
+                    self._enable_wal()
+                    self._wal_checked = True
+            conn = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", uri=True, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # Map the file into memory so reads skip the read() syscalls and page cache copies
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections += 1
+        return conn
+
+    @contextmanager
+    def cursor(self, streaming=False):
+        """Yield a dict cursor on this thread's connection"""
+        # sqlite3 steps through results as they are fetched, so streaming needs nothing extra
+        cursor = SQLiteCursor(self._connection().cursor())
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def bbox_condition(self, table_alias, west, south, east, north, params):
+        """SQL condition matching ZIP boundaries overlapping a bbox, answered from the bounding box index"""
+        params.extend([east, west, north, south])
+        return (f"{table_alias}.min_lon <= %s AND {table_alias}.max_lon >= %s "
+                f"AND {table_alias}.min_lat <= %s AND {table_alias}.max_lat >= %s")
+
+    def college_search_condition(self, terms, params):
+        """SQL condition matching colleges whose name or city has words starting with every term, from the FTS5 index"""
+        params.append(fts5_query(terms))
+        return f"id IN (SELECT rowid FROM {COLLEGE_SEARCH_TABLE} WHERE {COLLEGE_SEARCH_TABLE} MATCH %s)"
+
+    def stats(self):
+        with self._lock:
+            connections = self._connections
+        return {'backend': self.name, 'path': self.path, 'connections': connections, 'mmap_size': self.mmap_size}
+
+def open_storage(backend=None):
+    """Storage backend named by STORAGE_BACKEND, configured from the environment"""
+    # 'mysql' reads the database built by setup_mysql.py; 'sqlite' reads
+    # education_demographics.db as the setup scripts leave it, no migration needed
+    backend = backend or os.getenv('STORAGE_BACKEND', 'mysql')
+    if backend == 'mysql':
+        return MySQLStorage.from_env()
+    if backend == 'sqlite':
+        return SQLiteStorage(
+            os.getenv('SQLITE_PATH', 'education_demographics.db'),
+            mmap_size=int(os.getenv('SQLITE_MMAP_SIZE', str(DEFAULT_MMAP_SIZE)))
+        )
+    raise ValueError(f"Unknown storage backend '{backend}', expected 'mysql' or 'sqlite'")
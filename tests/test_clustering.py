@@ -0,0 +1,60 @@
+from clustering import MAX_CLUSTER_ZOOM, ClusterIndex, mercator_cells, morton_codes
+
+WORLD = (-180, -85, 180, 85)
+
+def college(id, latitude, longitude, income_bucket='$250k+', population_bucket='Under 10k', population_density=100.0):
+    return {'id': id, 'latitude': latitude, 'longitude': longitude, 'income_bucket': income_bucket,
+            'population_bucket': population_bucket, 'population_density': population_density}
+
+# Two colleges about a mile apart in Manhattan, one in Brooklyn, one in Los
+# Angeles and one without coordinates
+ROWS = [
+    college(1, 40.7500, -73.9900),
+    college(2, 40.7600, -73.9800, income_bucket='Under $50k', population_density=5000.0),
+    college(3, 40.6500, -73.9500, income_bucket=None),
+    college(4, 34.0500, -118.2500, population_bucket='10k-20k'),
+    college(5, None, None),
+]
+
+def by_count(clusters):
+    return sorted(clusters, key=lambda cluster: (-cluster['count'], cluster.get('id', 0)))
+
+def test_morton_code_prefix_is_the_parent_cell():
+    columns, rows = mercator_cells([40.75, 40.751], [-73.99, -73.989])
+    codes = morton_codes(columns, rows)
+    assert list(codes >> 2) == list(morton_codes(columns >> 1, rows >> 1))
+
+def test_low_zoom_groups_by_area_with_bucket_breakdown():
+    east, west = by_count(ClusterIndex('v1', ROWS).clusters(*WORLD, zoom=3))
+    assert east['count'] == 3
+    assert west['id'] == 4 and west['count'] == 1
+    # Colleges without a bucket count towards the total only
+    assert east['income_buckets'] == {'$250k+': 1, 'Under $50k': 1}
+    assert east['population_buckets'] == {'Under 10k': 3}
+    assert east['bounds'] == [-73.99, 40.65, -73.95, 40.76]
+    assert 'ids' not in east
+
+def test_zooming_in_splits_clusters():
+    index = ClusterIndex('v1', ROWS)
+    counts = [sorted(cluster['count'] for cluster in index.clusters(*WORLD, zoom=zoom)) for zoom in (3, 10, 12)]
+    assert counts == [[1, 3], [1, 1, 2], [1, 1, 1, 1]]
+
+def test_filters_and_bbox():
+    index = ClusterIndex('v1', ROWS)
+    assert [cluster['id'] for cluster in index.clusters(*WORLD, zoom=3, population_buckets=['10k-20k'])] == [4]
+    assert index.clusters(*WORLD, zoom=3, income_buckets=[]) == []
+    (dense,) = index.clusters(*WORLD, zoom=3, min_density=1000)
+    assert dense['id'] == 2
+    # Only cells the bbox touches, around Los Angeles
+    assert [cluster['id'] for cluster in index.clusters(-119, 33, -117, 35, zoom=8)] == [4]
+
+def test_inseparable_colleges_are_listed_by_id():
+    index = ClusterIndex('v1', [college(1, 40.0, -75.0), college(2, 40.0, -75.0), college(3, 40.00001, -75.0)])
+    (stacked,) = index.clusters(*WORLD, zoom=5)
+    assert 'ids' not in stacked
+    (deepest,) = index.clusters(*WORLD, zoom=MAX_CLUSTER_ZOOM + 3)
+    assert sorted(deepest['ids']) == [1, 2, 3]
+
+    same_point = ClusterIndex('v1', [college(1, 40.0, -75.0), college(2, 40.0, -75.0)])
+    (cluster,) = same_point.clusters(*WORLD, zoom=5)
+    assert sorted(cluster['ids']) == [1, 2]
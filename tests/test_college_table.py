@@ -0,0 +1,133 @@
+import json
+import sqlite3
+
+import pytest
+
+from data_version import stamp_data_version
+from text_search import create_college_search_table
+
+# (NAME, CITY, STATE, POPULATION, median_household_income, LATITUDE, LONGITUDE, latitude_zip, longitude_zip).
+# Names repeat so pages break inside runs of equal sort values, and some
+# incomes are missing so NULLs sort among them
+COLLEGES = [
+    (f"College {i % 7}", ['Boston', 'Austin', 'Denver'][i % 3], ['MA', 'TX', 'CO'][i % 3], 100 * (i % 5),
+     None if i % 4 == 0 else 50000 + 1000 * (i % 6), 40.0 + i / 100, -100.0 + i / 100, 40.0 + i / 100, -100.0 + i / 100)
+    for i in range(1, 41)
+]
+# Placed by its own coordinates at (10, 10), far from its ZIP's centroid
+COLLEGES.append(('Offset College', 'Miami', 'FL', 10, 90000, 10.0, 10.0, 45.0, -90.0))
+# No coordinates of its own, so placed at its ZIP's centroid
+COLLEGES.append(('Centroid College', 'Miami', 'FL', 10, 90000, None, None, 11.0, 11.0))
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('table') / 'colleges.db')
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE college_context (
+            id INTEGER PRIMARY KEY, NAME TEXT, ADDRESS TEXT, CITY TEXT, STATE TEXT, ZIP TEXT, TELEPHONE TEXT,
+            POPULATION INTEGER, COUNTY TEXT, COUNTYFIPS TEXT, WEBSITE TEXT, LATITUDE REAL, LONGITUDE REAL,
+            median_household_income INTEGER, zip_population INTEGER, income_bucket TEXT, population_bucket TEXT,
+            latitude_zip REAL, longitude_zip REAL, population_density REAL, zcta TEXT, zcta_method TEXT
+        )
+    """)
+    conn.executemany("""
+        INSERT INTO college_context (NAME, CITY, STATE, POPULATION, median_household_income,
+                                     LATITUDE, LONGITUDE, latitude_zip, longitude_zip)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, COLLEGES)
+    create_college_search_table(conn.cursor(), 'college_context')
+    stamp_data_version(conn)
+    conn.commit()
+    conn.close()
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+        monkeypatch.setenv('SQLITE_PATH', path)
+        monkeypatch.delenv('DATA_SNAPSHOT', raising=False)
+        import app
+        monkeypatch.setattr(app, 'storage', app.open_storage())
+        yield app.app.test_client()
+
+def table(client, **params):
+    response = client.get('/api/colleges/table', query_string=params)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+def ordered(column, descending=False):
+    return {'order[0][column]': 0, 'columns[0][data]': column, 'order[0][dir]': 'desc' if descending else 'asc'}
+
+@pytest.mark.parametrize('column', ['NAME', 'CITY', 'income_bucket', 'POPULATION'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_keyset_pages_match_offset_pages(client, column, descending):
+    length = 6
+    after = None
+    keyset_ids = []
+    for page in range(len(COLLEGES) // length + 1):
+        params = dict(ordered(column, descending), length=length, start=page * length)
+        offset_page = table(client, **params)
+        if after is not None:
+            params['after'] = json.dumps(after)
+        keyset_page = table(client, **params)
+        assert [row['id'] for row in keyset_page['data']] == [row['id'] for row in offset_page['data']]
+        keyset_ids += [row['id'] for row in keyset_page['data']]
+        after = keyset_page['next']
+        if after is None:
+            break
+    assert sorted(keyset_ids) == list(range(1, len(COLLEGES) + 1))
+
+def test_zero_length_returns_one_row(client):
+    page = table(client, length=0)
+    assert len(page['data']) == 1
+    assert page['next'] is not None
+
+def test_negative_and_oversized_lengths_are_capped(client):
+    assert len(table(client, length=-1)['data']) == len(COLLEGES)
+    assert len(table(client, length=1000)['data']) == len(COLLEGES)
+
+def test_page_past_the_end_has_no_cursor(client):
+    page = table(client, length=5, start=len(COLLEGES) + 10)
+    assert page['data'] == []
+    assert page['next'] is None
+    assert page['recordsTotal'] == len(COLLEGES)
+
+def test_invalid_parameters_are_rejected(client):
+    for params in ({'columns[0][data]': 'WEBSITE'}, {'order[0][dir]': 'sideways'},
+                   {'after': 'not json'}, {'after': '[1]'}, {'bbox': '1,2,3'}):
+        response = client.get('/api/colleges/table', query_string=params)
+        assert response.status_code == 400
+
+def test_bbox_places_colleges_like_the_clusters(client):
+    # Own coordinates first, then the ZIP centroid
+    page = table(client, bbox='9,9,12,12')
+    assert sorted(row['NAME'] for row in page['data']) == ['Centroid College', 'Offset College']
+    assert page['recordsTotal'] == 2
+
+def test_search_counts_filtered_rows(client):
+    page = table(client, **{'search[value]': 'bost'})
+    assert page['recordsTotal'] == len(COLLEGES)
+    assert page['recordsFiltered'] == len([college for college in COLLEGES if college[1] == 'Boston'])
+    assert all(row['CITY'] == 'Boston' for row in page['data'])
+
+def test_viewport_places_colleges_like_the_table(client):
+    response = client.get('/api/viewport', query_string={'bbox': '9,9,12,12', 'zoom': 8, 'boundaries': 0})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    colleges = {college['NAME']: (college['latitude'], college['longitude']) for college in response.get_json()['colleges']}
+    assert colleges == {'Offset College': (10.0, 10.0), 'Centroid College': (11.0, 11.0)}
+
+def test_snapshot_places_colleges_like_the_table(client):
+    import app
+    from snapshot import DataSnapshot
+    with app.get_db_cursor() as cursor:
+        cursor.execute(f"SELECT {app.COLLEGE_CONTEXT_COLUMNS} FROM college_context ORDER BY id")
+        snapshot = DataSnapshot('test', cursor.fetchall(), {})
+    assert sorted(row['NAME'] for row in snapshot.colleges_in_bbox(9, 9, 12, 12)) == ['Centroid College', 'Offset College']
+
+def test_college_popup_and_unknown_id(client):
+    response = client.get('/api/colleges/41')
+    assert response.status_code == 200
+    assert response.get_json()['NAME'] == 'Offset College'
+    for _ in range(2):
+        response = client.get('/api/colleges/9999')
+        assert response.status_code == 404
+        assert response.get_json() == {'error': 'No college with id 9999'}
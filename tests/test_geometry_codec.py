@@ -0,0 +1,45 @@
+import pytest
+import shapely
+
+from geometry_codec import MAGIC, QUANTIZE_SCALE, pack_collection, pack_geometries, unpack_collection
+
+SQUARE_WITH_HOLE = 'POLYGON ((-71.1 42.3, -71.0 42.3, -71.0 42.4, -71.1 42.4, -71.1 42.3), ' \
+                   '(-71.08 42.32, -71.02 42.32, -71.02 42.38, -71.08 42.32))'
+TWO_ISLANDS = 'MULTIPOLYGON (((-70.5 41.2, -70.4 41.2, -70.4 41.3, -70.5 41.2)), ' \
+              '((-70.1 41.25, -69.9 41.25, -69.9 41.35, -70.1 41.35, -70.1 41.25)))'
+
+def round_trip(geometries, properties):
+    return unpack_collection(pack_collection(pack_geometries(geometries), properties))
+
+def test_round_trip_keeps_shapes_within_quantization():
+    geometries = shapely.from_wkt([SQUARE_WITH_HOLE, TWO_ISLANDS, 'POLYGON ((0.1234567 0, 1 0, 1 1, 0.1234567 0))'])
+    properties = [{'zip_code': '02134'}, {'zip_code': '02554', 'density': 12.5}, {}]
+    decoded, decoded_properties = round_trip(geometries, properties)
+
+    assert decoded_properties == properties
+    assert len(decoded) == 3
+    for original, result in zip(geometries, decoded):
+        assert result.geom_type == 'MultiPolygon'
+        assert shapely.get_num_geometries(result) == shapely.get_num_geometries(original)
+        assert shapely.get_num_coordinates(result) == shapely.get_num_coordinates(original)
+        assert shapely.equals_exact(result, shapely.multipolygons(shapely.get_parts(original)),
+                                    tolerance=1 / QUANTIZE_SCALE)
+    # The hole survives as an interior ring
+    assert len(decoded[0].geoms[0].interiors) == 1
+
+def test_polygon_only_input_packs_like_multipolygons():
+    polygon = shapely.from_wkt(SQUARE_WITH_HOLE)
+    (only_polygons,) = pack_geometries([polygon])
+    (mixed, _) = pack_geometries([polygon, shapely.from_wkt(TWO_ISLANDS)])
+    assert only_polygons == mixed
+
+def test_empty_collection():
+    data = pack_collection([], [])
+    assert data.startswith(MAGIC)
+    geometries, properties = unpack_collection(data)
+    assert len(geometries) == 0
+    assert properties == []
+
+def test_rejects_other_payloads():
+    with pytest.raises(ValueError):
+        unpack_collection(b'{"type": "FeatureCollection", "features": []}' + bytes(64))
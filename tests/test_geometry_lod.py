@@ -0,0 +1,26 @@
+import numpy as np
+import shapely
+
+from geometry_lod import FULL_RESOLUTION_LOD, LOD_LEVELS, half_pixel_degrees, lod_for_zoom
+from geometry_workers import build_lod_level
+
+def test_tolerances_are_below_half_a_pixel_at_max_zoom():
+    for level in LOD_LEVELS:
+        assert level['tolerance'] < half_pixel_degrees(level['max_zoom'])
+        assert level['grid_size'] < level['tolerance']
+
+def test_each_zoom_gets_the_coarsest_level_it_allows():
+    assert [lod_for_zoom(zoom) for zoom in range(0, 15)] == [3] * 7 + [2] * 3 + [1] * 3 + [FULL_RESOLUTION_LOD] * 2
+    assert sorted(level['max_zoom'] for level in LOD_LEVELS) == [level['max_zoom'] for level in LOD_LEVELS]
+
+def test_levels_stay_within_their_vertex_budget():
+    # A 5000-vertex ring about a ZIP's size, and a small square that must not collapse
+    circle = shapely.Point(-71.0, 42.3).buffer(0.05, quad_segs=1250)
+    square = shapely.box(-70.0, 42.0, -69.9999, 42.0001)
+    for level in LOD_LEVELS:
+        geojson, packed, vertex_counts = build_lod_level(np.array([circle, square]), level)
+        assert vertex_counts[0] <= level['max_vertices']
+        assert len(packed) == 2
+        assert not shapely.from_geojson(geojson[1]).is_empty
+        # Simplified within a few tolerances of the original outline
+        assert shapely.hausdorff_distance(shapely.from_geojson(geojson[0]), circle) < 0.05
@@ -0,0 +1,27 @@
+import numpy as np
+import shapely
+
+from geometry_codec import pack_collection, unpack_collection
+from geometry_workers import dissolve_regions
+
+# A square with a spike: invalid, and the default make_valid turns it into a
+# GeometryCollection of the square and a line
+SPIKED_SQUARE = 'POLYGON ((0 0, 2 0, 2 2, 0 2, 0 0, -1 -1, 0 0))'
+
+def test_dissolve_keeps_only_polygons_of_repaired_shapes():
+    zip_codes = np.array(['10001', '10002'], dtype=object)
+    geojson = shapely.to_geojson([shapely.from_wkt(SPIKED_SQUARE), shapely.box(2, 0, 3, 1)])
+    regions, packed, bounds, members = dissolve_regions(zip_codes, geojson, 0.0005, 0.00001)
+
+    assert len(regions) == 1
+    assert shapely.from_geojson(regions[0]).geom_type == 'Polygon'
+    assert bounds[0].tolist() == [0.0, 0.0, 3.0, 2.0]
+    assert sorted(members[0]) == ['10001', '10002']
+    decoded, _ = unpack_collection(pack_collection(packed, [{}]))
+    assert abs(decoded[0].area - 5.0) < 1e-6
+
+def test_dissolve_orders_regions_largest_first():
+    zip_codes = np.array(['10001', '10002'], dtype=object)
+    geojson = shapely.to_geojson([shapely.box(0, 0, 1, 1), shapely.box(5, 5, 8, 8)])
+    regions, _, _, members = dissolve_regions(zip_codes, geojson, 0.0005, 0.00001)
+    assert members == [['10002'], ['10001']]
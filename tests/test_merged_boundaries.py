@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+import shapely
+
+import get_zip_boundaries
+from geometry_workers import GeometryPool
+
+# Two touching ZIPs in one bucket combination and one ZIP in another
+ZIPS = [
+    ('10001', shapely.box(0, 0, 1, 1), '$200k-$250k', 'Under 10k'),
+    ('10002', shapely.box(1, 0, 2, 1), '$200k-$250k', 'Under 10k'),
+    ('20001', shapely.box(5, 5, 6, 6), '$250k+', 'Under 10k')
+]
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE zip_boundaries (zip_code TEXT PRIMARY KEY, geometry TEXT)")
+    conn.execute("CREATE TABLE zip_demographics (zip_code TEXT PRIMARY KEY, income_bucket TEXT, population_bucket TEXT)")
+    for zip_code, geometry, income_bucket, population_bucket in ZIPS:
+        conn.execute("INSERT INTO zip_boundaries VALUES (?, ?)", (zip_code, shapely.to_geojson(geometry)))
+        conn.execute("INSERT INTO zip_demographics VALUES (?, ?, ?)", (zip_code, income_bucket, population_bucket))
+    conn.commit()
+    return conn
+
+def dissolve(conn):
+    """Run the merge and return {bucket combination: source hash}"""
+    with GeometryPool(workers=1) as pool:
+        get_zip_boundaries.create_merged_boundaries_table(conn, pool)
+    return {(income, population): source_hash for income, population, source_hash in conn.execute(
+        "SELECT income_bucket, population_bucket, source_hash FROM merged_boundary_groups"
+    )}
+
+def test_adjacent_zips_merge_into_one_region(conn):
+    dissolve(conn)
+    rows = conn.execute(
+        "SELECT income_bucket, zip_count, zip_codes FROM merged_boundaries ORDER BY income_bucket"
+    ).fetchall()
+    assert rows == [('$200k-$250k', 2, '10001,10002'), ('$250k+', 1, '20001')]
+
+def test_only_changed_groups_are_rebuilt(conn):
+    before = dissolve(conn)
+    conn.execute("UPDATE zip_boundaries SET geometry = ? WHERE zip_code = '20001'",
+                 (shapely.to_geojson(shapely.box(5, 5, 7, 6)),))
+    after = dissolve(conn)
+    assert after[('$200k-$250k', 'Under 10k')] == before[('$200k-$250k', 'Under 10k')]
+    assert after[('$250k+', 'Under 10k')] != before[('$250k+', 'Under 10k')]
+
+def test_new_simplification_settings_rebuild_every_group(conn, monkeypatch):
+    before = dissolve(conn)
+    monkeypatch.setattr(get_zip_boundaries, 'MERGED_TOLERANCE', get_zip_boundaries.MERGED_TOLERANCE * 2)
+    after = dissolve(conn)
+    assert set(after) == set(before)
+    assert all(after[key] != before[key] for key in before)
+
+def test_emptied_groups_are_dropped(conn):
+    dissolve(conn)
+    conn.execute("UPDATE zip_demographics SET income_bucket = '$200k-$250k' WHERE zip_code = '20001'")
+    assert set(dissolve(conn)) == {('$200k-$250k', 'Under 10k')}
+    assert conn.execute("SELECT COUNT(*) FROM merged_boundaries WHERE income_bucket = '$250k+'").fetchone()[0] == 0
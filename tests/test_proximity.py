@@ -0,0 +1,58 @@
+import numpy as np
+
+from proximity import GridIndex, LocatedRows, haversine_miles
+
+def random_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-90, 90, count), rng.uniform(-180, 180, count)
+
+def brute_force_within(latitudes, longitudes, latitude, longitude, radius_miles):
+    distances = haversine_miles(latitude, longitude, latitudes, longitudes)
+    return set(np.flatnonzero(distances <= radius_miles))
+
+def test_within_matches_brute_force():
+    latitudes, longitudes = random_points(5000)
+    index = GridIndex(latitudes, longitudes)
+    # Mid-latitudes, across the antimeridian and next to a pole
+    for latitude, longitude, radius_miles in ((40, -75, 300), (10, 179.9, 500), (-89.5, 20, 200), (0, 0, 3000)):
+        positions, distances = index.within(latitude, longitude, radius_miles)
+        assert set(positions) == brute_force_within(latitudes, longitudes, latitude, longitude, radius_miles)
+        assert np.all(np.diff(distances) >= 0)
+
+def test_nearest_matches_brute_force():
+    latitudes, longitudes = random_points(2000, seed=1)
+    index = GridIndex(latitudes, longitudes)
+    allowed = np.arange(len(latitudes)) % 3 == 0
+    distances = haversine_miles(35, -100, latitudes, longitudes)
+
+    positions, _ = index.nearest(35, -100, 10)
+    assert list(positions) == list(np.argsort(distances, kind='stable')[:10])
+    positions, _ = index.nearest(35, -100, 10, allowed)
+    assert list(positions) == [p for p in np.argsort(distances, kind='stable') if allowed[p]][:10]
+
+def test_nearest_returns_every_point_when_k_exceeds_them():
+    index = GridIndex([0, 10, 80], [0, 100, -170])
+    positions, _ = index.nearest(0, 0, 10)
+    assert list(positions) == [0, 1, 2]
+
+def test_points_without_coordinates_are_never_found():
+    index = GridIndex([40.0, np.nan, 40.0], [-75.0, -75.0, np.nan])
+    positions, _ = index.within(40, -75, 100)
+    assert list(positions) == [0]
+
+ROWS = [
+    {'id': 1, 'latitude': 40.0, 'longitude': -75.0, 'income_bucket': '$250k+', 'population_bucket': 'Under 10k'},
+    {'id': 2, 'latitude': 40.1, 'longitude': -75.0, 'income_bucket': 'Under $50k', 'population_bucket': 'Under 10k'},
+    {'id': 3, 'latitude': None, 'longitude': None, 'income_bucket': '$250k+', 'population_bucket': 'Under 10k'},
+]
+
+def test_located_rows_find_and_bucket_mask():
+    located = LocatedRows('v1', ROWS, 'id')
+    assert located.find(2) is ROWS[1]
+    assert located.find(99) is None
+
+    assert located.mask() is None
+    assert list(located.mask(income_buckets=[])) == [False, False, False]
+    allowed = located.mask(income_buckets=['$250k+'], population_buckets=['Under 10k'])
+    assert [row['id'] for row, _ in located.within(40.05, -75, 50, allowed)] == [1]
+    assert [row['id'] for row, _ in located.nearest(40.09, -75, 2)] == [2, 1]
@@ -0,0 +1,100 @@
+import gzip
+import sqlite3
+import time
+
+import brotli
+
+from result_cache import MIN_COMPRESS_SIZE, CompressedPayload, DiskCacheBackend
+
+BODY = b'{"rows": [' + b','.join(b'{"id": %d}' % i for i in range(500)) + b']}'
+
+def test_from_body_compresses_only_requested_encodings():
+    payload = CompressedPayload.from_body(BODY)
+    assert payload.identity == BODY
+    assert payload.gzip is None and payload.br is None
+
+    payload = CompressedPayload.from_body(BODY, ['gzip'])
+    assert gzip.decompress(payload.gzip) == BODY
+    assert payload.br is None
+
+def test_with_encodings_adds_missing_and_keeps_stored():
+    payload = CompressedPayload.from_body(BODY, ['gzip'])
+    assert payload.missing(['br', 'gzip']) == ['br']
+    upgraded = payload.with_encodings(['br', 'gzip'])
+    assert brotli.decompress(upgraded.br) == BODY
+    assert upgraded.gzip is payload.gzip
+    assert upgraded.missing(['br', 'gzip']) == []
+
+def test_best_recompresses_stored_encodings():
+    payload = CompressedPayload.from_body(BODY, ['br'])
+    best = payload.with_encodings(['br'], best=True)
+    assert best.br == brotli.compress(BODY, quality=11)
+    assert best.br != payload.br
+
+def test_small_bodies_stay_uncompressed():
+    body = b'x' * (MIN_COMPRESS_SIZE - 1)
+    payload = CompressedPayload.from_body(body, ['br', 'gzip'], best=True)
+    assert payload == (body, None, None)
+    assert payload.missing(['br']) == []
+
+class AcceptEncodings(dict):
+    def __getitem__(self, name):
+        return self.get(name, False)
+
+def test_negotiate_prefers_brotli_and_falls_back():
+    payload = CompressedPayload.from_body(BODY, ['br', 'gzip'])
+    assert payload.negotiate(AcceptEncodings(br=True, gzip=True)) == (payload.br, 'br')
+    assert payload.negotiate(AcceptEncodings(gzip=True)) == (payload.gzip, 'gzip')
+    assert payload.negotiate(AcceptEncodings()) == (BODY, None)
+
+def test_disk_cache_workers_on_different_versions_keep_each_others_entries(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    new_worker = DiskCacheBackend(path)
+    old_worker = DiskCacheBackend(path)
+    new_payload = CompressedPayload.from_body(b'new')
+    old_payload = CompressedPayload.from_body(b'old')
+
+    new_worker.set('k', 'v2', new_payload, ttl=60)
+    old_worker.set('k', 'v1', old_payload, ttl=60)
+    old_worker.set('other', 'v1', old_payload, ttl=60)
+    assert new_worker.get('k', 'v2') == new_payload
+    assert old_worker.get('k', 'v1') == old_payload
+    assert new_worker.get('other', 'v2') is None
+
+def test_disk_cache_hits_are_written_back_in_batches(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path / 'cache.db'), touch_interval=3600)
+    backend.set('k', 'v1', CompressedPayload.from_body(b'body'), ttl=60)
+
+    def last_used():
+        return backend._connection().execute("SELECT last_used FROM cache").fetchone()[0]
+
+    stored = last_used()
+    time.sleep(0.01)
+    backend.get('k', 'v1')
+    assert last_used() == stored
+    backend._write_touches()
+    assert last_used() > stored
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path / 'cache.db'), max_entries=2, touch_interval=0)
+    for key in ('a', 'b'):
+        backend.set(key, 'v1', CompressedPayload.from_body(key), ttl=60)
+        time.sleep(0.01)
+    backend.get('a', 'v1')
+    backend.set('c', 'v1', CompressedPayload.from_body(b'c'), ttl=60)
+    assert backend.get('b', 'v1') is None
+    assert backend.get('a', 'v1') is not None and backend.get('c', 'v1') is not None
+
+def test_disk_cache_replaces_files_keyed_by_key_alone(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE cache (key TEXT PRIMARY KEY, version TEXT, expires_at REAL, last_used REAL, "
+                 "value BLOB, value_gzip BLOB, value_br BLOB)")
+    conn.execute("INSERT INTO cache VALUES ('k', 'v1', 1e12, 0, x'00', NULL, NULL)")
+    conn.commit()
+    conn.close()
+
+    backend = DiskCacheBackend(path)
+    assert backend.get('k', 'v1') is None
+    backend.set('k', 'v2', CompressedPayload.from_body(b'body'), ttl=60)
+    assert backend.get('k', 'v2').identity == b'body'
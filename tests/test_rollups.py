@@ -0,0 +1,72 @@
+import pandas as pd
+
+from rollups import DIMENSIONS, aggregate_rollups, dimension_sets
+
+# Census ACS value for a suppressed median
+SUPPRESSED = -666666666
+
+def make_sources():
+    colleges = pd.DataFrame({
+        'state': ['CA', 'CA', 'NY'],
+        'countyfips': ['06001', '06001', '36061'],
+        'income_bucket': ['$250k+', 'Under $100k', '$250k+'],
+        'population_bucket': ['40,000+', '40,000+', '40,000+'],
+        'enrollment': [1000, 200, 3000]
+    })
+    zips = pd.DataFrame({
+        'zip_code': ['94000', '94001', '94002', '10001', '10002'],
+        'state': ['CA', 'CA', 'CA', 'NY', None],
+        'income_bucket': ['$250k+', '$250k+', 'Unknown', '$250k+', 'Under $100k'],
+        'population_bucket': ['40,000+', '40,000+', '40,000+', '40,000+', '40,000+'],
+        'population': [50000, 45000, 41000, 60000, 42000],
+        'median_household_income': [260000, 280000, SUPPRESSED, 300000, 50000]
+    })
+    return colleges, zips
+
+def rollup(df, **dims):
+    """The one row for a set of dimension values"""
+    matches = df[df['dimensions'] == ','.join(d for d in DIMENSIONS if d in dims)]
+    for dim, value in dims.items():
+        matches = matches[matches[dim].isna()] if value is None else matches[matches[dim] == value]
+    assert len(matches) == 1
+    return matches.iloc[0]
+
+def test_every_dimension_set_is_built():
+    df = aggregate_rollups(*make_sources())
+    assert len(dimension_sets()) == 16
+    assert set(df['dimensions']) == {','.join(dims) for dims in dimension_sets()}
+    assert df['rollup_key'].is_unique
+
+def test_suppressed_incomes_stay_out_of_percentiles():
+    df = aggregate_rollups(*make_sources())
+    percentiles = ['income_p25', 'income_p50', 'income_p75', 'income_p90']
+    assert (df[percentiles].dropna() >= 0).all().all()
+
+    california = rollup(df, state='CA')
+    # The suppressed ZIP is still counted, just not in the income figures
+    assert california['zip_count'] == 3
+    assert california['population'] == 136000
+    assert california['income_p50'] == 270000
+
+    unknown = rollup(df, state='CA', income_bucket='Unknown')
+    assert unknown['zip_count'] == 1
+    assert pd.isna(unknown['income_p50'])
+
+def test_totals_and_missing_dimension_values():
+    df = aggregate_rollups(*make_sources())
+    total = rollup(df)
+    assert total['college_count'] == 3
+    assert total['enrollment'] == 4200
+    assert total['zip_count'] == 5
+
+    # A ZIP without a state forms its own NULL-state group
+    stateless = rollup(df, state=None)
+    assert stateless['zip_count'] == 1
+    assert stateless['college_count'] == 0
+
+def test_county_groups_carry_college_figures_only():
+    df = aggregate_rollups(*make_sources())
+    county = rollup(df, countyfips='06001')
+    assert county['college_count'] == 2
+    assert pd.isna(county['zip_count'])
+    assert pd.isna(county['income_p50'])
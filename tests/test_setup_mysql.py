@@ -0,0 +1,100 @@
+import pandas as pd
+
+import setup_mysql
+from setup_mysql import column_type, ensure_columns, schema_columns
+
+class RecordingCursor:
+    """Stands in for a MySQL cursor: answers the information_schema query and records the rest"""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.statements = []
+        self._result = []
+
+    def execute(self, statement, params=None):
+        if 'information_schema.columns' in statement:
+            self._result = list(self.columns.items())
+        else:
+            self.statements.append(statement)
+
+    def fetchall(self):
+        return self._result
+
+def test_schema_columns_drop_keys_and_comments():
+    columns = schema_columns('zip_boundaries')
+    assert columns['zip_code'] == 'VARCHAR(10)'
+    assert columns['geometry'] == 'LONGTEXT'
+    assert columns['shape'] == 'GEOMETRY NOT NULL SRID 0'
+    assert 'PRIMARY' not in schema_columns('zip_boundary_lods')
+    assert schema_columns('colleges')['id'] == 'INT AUTO_INCREMENT'
+
+def test_column_type_matches_information_schema_spelling():
+    assert column_type('DECIMAL(10, 6)') == 'decimal(10,6)'
+    assert column_type('INT AUTO_INCREMENT') == 'int'
+    assert column_type('int(11)') == 'int'
+    assert column_type('GEOMETRY NOT NULL SRID 0') == 'geometry'
+
+def test_baseline_zip_boundaries_are_migrated():
+    # The table as the first version of setup_mysql.py created it
+    cursor = RecordingCursor({'zip_code': 'varchar(10)', 'geometry': 'text', 'perimeter_meters': 'decimal(10,6)'})
+    columns = {name: definition for name, definition in schema_columns('zip_boundaries').items() if name != 'shape'}
+    ensure_columns(cursor, 'zip_boundaries', columns)
+
+    assert "ALTER TABLE zip_boundaries MODIFY COLUMN `geometry` LONGTEXT" in cursor.statements
+    assert "ALTER TABLE zip_boundaries MODIFY COLUMN `perimeter_meters` DOUBLE" in cursor.statements
+    for name in ('geometry_packed', 'min_lon', 'max_lat', 'area_sq_meters', 'row_hash'):
+        assert any(f"ADD COLUMN `{name}`" in statement for statement in cursor.statements)
+    assert not any('zip_code' in statement for statement in cursor.statements)
+
+def test_current_tables_are_left_alone():
+    for table in setup_mysql.TABLE_KEYS:
+        columns = schema_columns(table)
+        cursor = RecordingCursor({name: column_type(definition) for name, definition in columns.items()})
+        ensure_columns(cursor, table, columns)
+        assert cursor.statements == []
+
+class LegacyBoundaryCursor:
+    """zip_boundaries from before the shape column, answering the queries ensure_spatial_column makes"""
+
+    def __init__(self, rows):
+        self.rows = dict(rows)
+        self.shapes = {}
+        self.statements = []
+        self._result = []
+
+    def execute(self, statement, params=None):
+        self.statements.append(statement)
+        if 'information_schema.columns' in statement:
+            self._result = [(0,)]
+        elif statement.startswith('SELECT zip_code, geometry'):
+            self._result = sorted((key, value) for key, value in self.rows.items() if key > params[0])[:2]
+
+    def executemany(self, statement, params):
+        for values in params:
+            if statement.startswith('UPDATE'):
+                self.shapes[values[1]] = values[0]
+            elif statement.startswith('DELETE'):
+                del self.rows[values[0]]
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+SQUARE = '{"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}'
+
+def test_spatial_backfill_deletes_unparseable_rows():
+    cursor = LegacyBoundaryCursor({'10001': SQUARE, '10002': SQUARE[:40], '10003': None, '10004': SQUARE})
+    assert setup_mysql.ensure_spatial_column(cursor, 'zip_boundaries', 'shape')
+
+    assert sorted(cursor.rows) == ['10001', '10004']
+    assert sorted(cursor.shapes) == ['10001', '10004']
+    assert cursor.statements[-1] == "ALTER TABLE zip_boundaries MODIFY COLUMN shape GEOMETRY NOT NULL SRID 0"
+
+def test_invalid_geometries_are_skipped_at_insert():
+    df = pd.DataFrame({'zip_code': ['10001', '10002', '10003'], 'geometry': [SQUARE, SQUARE[:40], None]})
+    df = setup_mysql.with_spatial_column('zip_boundaries', df)
+
+    assert list(df['zip_code']) == ['10001']
+    assert df['shape'].notna().all()
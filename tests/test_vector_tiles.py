@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+
+import mapbox_vector_tile
+import shapely
+
+from data_version import UNVERSIONED
+from vector_tiles import LAYER_NAME, TileCache, get_or_render_tile, render_tile, tile_bounds, tile_range
+
+OLD, NEW = '20260101000000-aaaaaaaa', '20260201000000-bbbbbbbb'
+
+def test_tile_range_covers_tile_bounds():
+    for z, x, y in ((0, 0, 0), (5, 9, 12), (12, 1205, 1539)):
+        west, south, east, north = tile_bounds(z, x, y)
+        # A point just inside the tile falls in exactly that tile
+        assert tile_range(z, west + 1e-9, south + 1e-9, west + 1e-9, north - 1e-9) == ((x, x), (y, y))
+        assert tile_range(z, west + 1e-9, south + 1e-9, east - 1e-9, north - 1e-9) == ((x, x), (y, y))
+
+def test_render_tile_keeps_zip_properties():
+    west, south, east, north = tile_bounds(10, 301, 385)
+    square = shapely.box(west, south, (west + east) / 2, (south + north) / 2)
+    data = render_tile([{'zip_code': '10001', 'geometry': shapely.to_geojson(square), 'income_bucket': None,
+                         'population_bucket': 'Under 10k', 'population_density': 1234.567}], 10, 301, 385)
+    (feature,) = mapbox_vector_tile.decode(data)[LAYER_NAME]['features']
+    assert feature['properties'] == {'zip_code': '10001', 'income_bucket': 'Unknown',
+                                     'population_bucket': 'Under 10k', 'population_density': 1234.6}
+    assert render_tile([], 10, 301, 385) == b''
+
+def test_tiles_are_kept_per_data_version(tmp_path):
+    cache = TileCache(str(tmp_path / 'tiles.mbtiles'))
+    cache.ensure_version(OLD)
+    cache.put(3, 1, 2, b'old tile', OLD)
+    assert cache.get(3, 1, 2, OLD) == b'old tile'
+    assert cache.get(3, 1, 2, NEW) is None
+
+    cache.ensure_version(NEW)
+    assert cache.get(3, 1, 2, NEW) is None
+
+def test_lagging_worker_neither_wipes_nor_pollutes_the_cache(tmp_path):
+    path = str(tmp_path / 'tiles.mbtiles')
+    current, lagging = TileCache(path), TileCache(path)
+    current.ensure_version(NEW)
+    current.put(3, 1, 2, b'new tile', NEW)
+
+    # A worker that has not seen the new version yet leaves the cache alone
+    lagging.ensure_version(OLD)
+    assert current.get(3, 1, 2, NEW) == b'new tile'
+    assert lagging.get(3, 1, 2, OLD) is None
+    # and a tile it rendered from old data is not stored
+    lagging.put(3, 1, 2, b'stale tile', OLD)
+    lagging.put(4, 1, 2, b'stale tile', OLD)
+    assert current.get(3, 1, 2, NEW) == b'new tile'
+    assert current.get(4, 1, 2, NEW) is None
+
+def test_unversioned_database_sorts_first(tmp_path):
+    cache = TileCache(str(tmp_path / 'tiles.mbtiles'))
+    cache.ensure_version(UNVERSIONED)
+    cache.put(0, 0, 0, b'tile', UNVERSIONED)
+    current = TileCache(cache.path)
+    current.ensure_version(OLD)
+    assert cache.get(0, 0, 0, UNVERSIONED) is None
+
+    current.put(0, 0, 0, b'tile', OLD)
+    TileCache(cache.path).ensure_version(UNVERSIONED)
+    assert current.get(0, 0, 0, OLD) == b'tile'
+
+class EmptyStorage:
+    """Storage with no boundaries that counts the queries made of it"""
+
+    def __init__(self):
+        self.queries = 0
+
+    def bbox_condition(self, alias, west, south, east, north, params):
+        return '1=1'
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, query, params):
+        self.queries += 1
+
+    def fetchall(self):
+        return []
+
+def test_get_or_render_tile_renders_once(tmp_path):
+    cache = TileCache(str(tmp_path / 'tiles.mbtiles'))
+    cache.ensure_version(NEW)
+    storage = EmptyStorage()
+    assert get_or_render_tile(cache, storage, 2, 1, 1, NEW) == b''
+    assert get_or_render_tile(cache, storage, 2, 1, 1, NEW) == b''
+    assert storage.queries == 1
@@ -0,0 +1,54 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from geometry_workers import serialize_zcta_polygons
+from zcta_assignment import assign_college_zctas, assign_zctas, load_zcta_polygons
+
+# A low-income ZCTA (left out of zip_boundaries) beside a richer one, with a
+# 0.005 degree gap between them, and a third ZCTA far away
+POOR = shapely.box(0, 0, 1, 1)
+RICH = shapely.box(1.005, 0, 2, 1)
+FAR = shapely.box(50, 50, 51, 51)
+
+def polygons_db(zip_codes, geometries):
+    conn = sqlite3.connect(':memory:')
+    serialize_zcta_polygons(np.array(zip_codes, dtype=object), np.array(geometries, dtype=object)).to_sql(
+        'zcta_polygons', conn, index=False
+    )
+    return conn
+
+def test_college_in_a_low_income_zcta_stays_there():
+    conn = polygons_db(['10001', '10002', '90001'], [POOR, RICH, FAR])
+    colleges = pd.DataFrame({'LATITUDE': [0.5], 'LONGITUDE': [0.999], 'ZIP': ['10001']})
+    assigned = assign_college_zctas(conn, colleges)
+    assert assigned.loc[0, 'zcta'] == '10001'
+    assert assigned.loc[0, 'zcta_method'] == 'polygon'
+
+def test_without_its_own_polygon_the_college_drifts_to_the_neighbour():
+    # What happened when only zip_boundaries' polygons were searched
+    zctas, methods = assign_zctas(np.array(['10002'], dtype=object), np.array([RICH]), [0.5], [0.999], ['10001'])
+    assert list(zctas) == ['10002']
+    assert list(methods) == ['nearest']
+
+def test_only_polygons_near_a_point_are_loaded():
+    conn = polygons_db(['10001', '10002', '90001'], [POOR, RICH, FAR])
+    zip_codes, polygons = load_zcta_polygons(conn, [0.5], [0.999])
+    assert list(zip_codes) == ['10001', '10002']
+    assert shapely.equals(polygons[0], POOR)
+
+def test_shared_edge_nearest_and_fallback():
+    zip_codes = np.array(['20001', '20002'], dtype=object)
+    polygons = np.array([shapely.box(0, 0, 1, 1), shapely.box(1, 0, 2, 1)])
+    zctas, methods = assign_zctas(
+        zip_codes, polygons,
+        latitudes=[0.5, 0.5, 1.005, 40.0, np.nan],
+        longitudes=[1.0, 1.5, 0.5, -100.0, np.nan],
+        fallback_zips=['99901', '99902', '99903', '99904', '99905']
+    )
+    # On the shared edge the lower ZIP wins; just outside goes to the nearest;
+    # far away or without coordinates keeps the listed ZIP
+    assert list(zctas) == ['20001', '20002', '20001', '99904', '99905']
+    assert list(methods) == ['polygon', 'polygon', 'nearest', 'zip', 'zip']
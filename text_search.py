@@ -0,0 +1,38 @@
+import re
+
+# Prefix search over college names and cities for the college table.
+#
+# SQLite answers it from college_search, a contentless FTS5 index keyed by
+# college_context.id and built beside the table by database_setup.py; MySQL
+# from a FULLTEXT index on college_context(NAME, CITY) created by
+# setup_mysql.py. Every word typed must start a word of the name or city.
+
+COLLEGE_SEARCH_TABLE = 'college_search'
+# Longest search accepted, in words; the rest are ignored
+MAX_SEARCH_TERMS = 8
+
+def search_terms(text):
+    """Lowercased words of a search box value, without punctuation or query syntax"""
+    return re.findall(r'\w+', (text or '').lower())[:MAX_SEARCH_TERMS]
+
+def fts5_query(terms):
+    """FTS5 MATCH expression requiring a word starting with each term"""
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def boolean_mode_query(terms):
+    """MySQL boolean-mode AGAINST expression requiring a word starting with each term"""
+    return ' '.join(f'+{term}*' for term in terms)
+
+def create_college_search_table(cursor, content_table):
+    """(Re)build the FTS5 index over a college context table's NAME and CITY"""
+    cursor.execute(f"DROP TABLE IF EXISTS {COLLEGE_SEARCH_TABLE}")
+    # Contentless: only the index is stored, and matches are joined back on id.
+    # Two- and three-character prefix indexes keep short searches off a full term scan
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE {COLLEGE_SEARCH_TABLE}
+        USING fts5(NAME, CITY, content='', prefix='2 3')
+    """)
+    cursor.execute(f"""
+        INSERT INTO {COLLEGE_SEARCH_TABLE} (rowid, NAME, CITY)
+        SELECT id, COALESCE(NAME, ''), COALESCE(CITY, '') FROM {content_table}
+    """)
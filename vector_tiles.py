@@ -0,0 +1,278 @@
+import argparse
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import mapbox_vector_tile
+import numpy as np
+import shapely
+
+from data_version import UNVERSIONED
+from geometry_lod import lod_for_zoom, FULL_RESOLUTION_LOD
+
+LAYER_NAME = 'zip_boundaries'
+TILE_EXTENT = 4096
+# Extra margin around each tile, as a fraction of its width, so polygon
+# edges do not show seams where neighbouring tiles meet
+TILE_BUFFER = 64 / TILE_EXTENT
+EARTH_RADIUS = 6378137.0
+MAX_LATITUDE = 85.0511287798
+
+def log_progress(message):
+    """Log a message with timestamp"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {message}")
+
+def tile_bounds(z, x, y):
+    """Longitude/latitude bounds (west, south, east, north) of an XYZ tile"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def tile_range(z, west, south, east, north):
+    """Inclusive XYZ tile column and row ranges covering a bbox"""
+    n = 2 ** z
+    south = max(south, -MAX_LATITUDE)
+    north = min(north, MAX_LATITUDE)
+
+    def to_x(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def to_y(lat):
+        lat_rad = math.radians(lat)
+        return min(n - 1, max(0, int((1 - math.asinh(math.tan(lat_rad)) / math.pi) / 2 * n)))
+
+    return (to_x(west), to_x(east)), (to_y(north), to_y(south))
+
+def to_web_mercator(coords):
+    """Project an (N, 2) array of lon/lat to spherical Web Mercator meters"""
+    lon = coords[:, 0]
+    lat = np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+    x = np.radians(lon) * EARTH_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * EARTH_RADIUS
+    return np.column_stack([x, y])
+
+def fetch_tile_features(storage, z, x, y):
+    """Load the ZIP boundaries overlapping a tile at the level of detail for its zoom"""
+    west, south, east, north = tile_bounds(z, x, y)
+    buffer_lon = (east - west) * TILE_BUFFER
+    buffer_lat = (north - south) * TILE_BUFFER
+    lod = lod_for_zoom(z)
+
+    if lod == FULL_RESOLUTION_LOD:
+        query = """
+            SELECT b.zip_code, b.geometry, d.income_bucket, d.population_bucket, b.population_density
+            FROM zip_boundaries b
+            JOIN zip_demographics d ON d.zip_code = b.zip_code
+        """
+        params = []
+    else:
+        query = """
+            SELECT b.zip_code, l.geometry, d.income_bucket, d.population_bucket, b.population_density
+            FROM zip_boundaries b
+            JOIN zip_boundary_lods l ON l.zip_code = b.zip_code AND l.lod = %s
+            JOIN zip_demographics d ON d.zip_code = b.zip_code
+        """
+        params = [lod]
+    query += " WHERE " + storage.bbox_condition('b', west - buffer_lon, south - buffer_lat,
+                                                east + buffer_lon, north + buffer_lat, params)
+
+    with storage.cursor() as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+def render_tile(features, z, x, y):
+    """Encode ZIP boundary rows as a Mapbox Vector Tile"""
+    if not features:
+        return b''
+
+    west, south, east, north = tile_bounds(z, x, y)
+    (min_x, min_y), (max_x, max_y) = to_web_mercator(np.array([[west, south], [east, north]]))
+    buffer = (max_x - min_x) * TILE_BUFFER
+
+    geometries = shapely.from_geojson([row['geometry'] for row in features], on_invalid='ignore')
+    geometries = shapely.transform(geometries, to_web_mercator)
+    geometries = shapely.clip_by_rect(geometries, min_x - buffer, min_y - buffer, max_x + buffer, max_y + buffer)
+
+    tile_features = []
+    for row, geometry in zip(features, geometries):
+        if geometry is None or geometry.is_empty:
+            continue
+        properties = {
+            'zip_code': row['zip_code'],
+            'income_bucket': row['income_bucket'] or 'Unknown',
+            'population_bucket': row['population_bucket'] or 'Unknown'
+        }
+        # Tiles cannot hold nulls, so ZIPs without a density just leave it out
+        if row['population_density'] is not None:
+            properties['population_density'] = round(float(row['population_density']), 1)
+        tile_features.append({'geometry': geometry, 'properties': properties})
+
+    if not tile_features:
+        return b''
+
+    return mapbox_vector_tile.encode(
+        [{'name': LAYER_NAME, 'features': tile_features}],
+        default_options={
+            'quantize_bounds': (min_x, min_y, max_x, max_y),
+            'extents': TILE_EXTENT,
+            'on_invalid_geometry': mapbox_vector_tile.encoder.on_invalid_geometry_make_valid
+        }
+    )
+
+class TileCache:
+    """MBTiles-style SQLite store of rendered vector tiles"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                name TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tiles (
+                zoom_level INTEGER,
+                tile_column INTEGER,
+                tile_row INTEGER,
+                tile_data BLOB,
+                PRIMARY KEY (zoom_level, tile_column, tile_row)
+            )
+        """)
+        conn.executemany("INSERT OR IGNORE INTO metadata (name, value) VALUES (?, ?)", [
+            ('name', LAYER_NAME),
+            ('format', 'pbf'),
+            ('type', 'overlay')
+        ])
+        conn.commit()
+
+    def _connection(self):
+        """One connection per thread; WAL lets several workers read while one writes"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, z, x, y, version):
+        """Cached tile bytes rendered from this data version, or None on a miss"""
+        # MBTiles rows count from the bottom (TMS), XYZ rows from the top
+        row = self._connection().execute(
+            f"""SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?
+                AND ({STORED_VERSION}) = ?""",
+            (z, x, 2 ** z - 1 - y, version)
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def put(self, z, x, y, data, version):
+        """Store a tile, unless the cache has moved on from the data version it was rendered from"""
+        conn = self._connection()
+        # Checked in the same statement, so a tile rendered just before another
+        # worker reset the cache for a newer version is never stored
+        conn.execute(
+            f"""INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data)
+                SELECT ?, ?, ?, ? WHERE ({STORED_VERSION}) = ?""",
+            (z, x, 2 ** z - 1 - y, sqlite3.Binary(data), version)
+        )
+        conn.commit()
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM tiles")
+        conn.commit()
+
+    def ensure_version(self, version):
+        """Drop every cached tile if they were rendered from an older data version
+
+        Workers notice a new version at different times, so the stored version
+        only ever moves forward: a worker still on an older one leaves the
+        cache alone, and its get and put miss until it catches up
+        """
+        if getattr(self._local, 'version', None) == version:
+            return
+        conn = self._connection()
+        # IMMEDIATE takes the write lock before reading, so two workers cannot both reset
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(STORED_VERSION).fetchone()
+            if row is None or version_order(row[0]) < version_order(version):
+                conn.execute("DELETE FROM tiles")
+                conn.execute("INSERT OR REPLACE INTO metadata (name, value) VALUES ('data_version', ?)", (version,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._local.version = version
+
+# The data version the cached tiles were rendered from
+STORED_VERSION = "SELECT value FROM metadata WHERE name = 'data_version'"
+
+def version_order(version):
+    """Sort key for data versions, which are time-ordered; a database without a stamp comes first"""
+    return (0, '') if version in (None, UNVERSIONED) else (1, version)
+
+def get_or_render_tile(cache, storage, z, x, y, version):
+    """Serve a tile from the cache, rendering and storing it on a miss"""
+    data = cache.get(z, x, y, version)
+    if data is None:
+        features = fetch_tile_features(storage, z, x, y)
+        data = render_tile(features, z, x, y)
+        cache.put(z, x, y, data, version)
+    return data
+
+def seed_tiles(cache, storage, version, min_zoom, max_zoom, bbox=None):
+    """Render every tile in a zoom range that overlaps the data extent"""
+    if bbox is None:
+        with storage.cursor() as cursor:
+            cursor.execute("""
+                SELECT MIN(min_lon) AS west, MIN(min_lat) AS south,
+                       MAX(max_lon) AS east, MAX(max_lat) AS north
+                FROM zip_boundaries
+            """)
+            extent = cursor.fetchone()
+        bbox = (float(extent['west']), float(extent['south']), float(extent['east']), float(extent['north']))
+
+    for z in range(min_zoom, max_zoom + 1):
+        start_time = time.time()
+        (x_min, x_max), (y_min, y_max) = tile_range(z, *bbox)
+        total = (x_max - x_min + 1) * (y_max - y_min + 1)
+        log_progress(f"Seeding {total} tiles at zoom {z}...")
+        non_empty = 0
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                features = fetch_tile_features(storage, z, x, y)
+                data = render_tile(features, z, x, y)
+                cache.put(z, x, y, data, version)
+                if data:
+                    non_empty += 1
+        log_progress(f"Zoom {z}: {non_empty} non-empty tiles in {time.time() - start_time:.1f} seconds")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-render ZIP boundary vector tiles into the tile cache')
+    parser.add_argument('--min-zoom', type=int, default=3)
+    parser.add_argument('--max-zoom', type=int, default=8)
+    parser.add_argument('--bbox', help="Limit seeding to 'west,south,east,north'")
+    parser.add_argument('--clear', action='store_true', help='Delete all cached tiles first')
+    args = parser.parse_args()
+
+    # Reuse the app's database access so seeding reads exactly what it serves
+    from app import storage, get_tile_cache, data_version
+
+    tile_cache = get_tile_cache()
+    if args.clear:
+        log_progress("Clearing tile cache...")
+        tile_cache.clear()
+    version = data_version.get()
+    tile_cache.ensure_version(version)
+    bbox = tuple(float(v) for v in args.bbox.split(',')) if args.bbox else None
+    seed_tiles(tile_cache, storage, version, args.min_zoom, args.max_zoom, bbox)
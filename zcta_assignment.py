@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+# Colleges outside every ZCTA polygon but this close to one (in degrees, about
+# 1 km), typically on a coastline or riverbank, are given the nearest ZCTA
+NEAREST_MAX_DEGREES = 0.01
+
+# ZIP codes per query when reading polygons back by key
+LOAD_BATCH_SIZE = 500
+
+def load_zcta_polygons(conn, latitudes, longitudes):
+    """ZIP codes and shapely polygons of the ZCTAs that could contain or be nearest to the points
+
+    Read from zcta_polygons, which holds every ZCTA in the shapefile;
+    zip_boundaries keeps only those above the lowest income bucket, so a
+    college in any other ZCTA would find no polygon and be handed to a richer
+    neighbour. Only polygons whose bounding box is near a point are parsed
+    """
+    bounds = pd.read_sql_query(
+        "SELECT zip_code, min_lon, min_lat, max_lon, max_lat FROM zcta_polygons ORDER BY zip_code", conn
+    )
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    located = np.isfinite(latitudes) & np.isfinite(longitudes)
+    if len(bounds) == 0 or not located.any():
+        return np.array([], dtype=object), np.array([], dtype=object)
+
+    boxes = shapely.box(bounds['min_lon'], bounds['min_lat'], bounds['max_lon'], bounds['max_lat'])
+    points = shapely.points(longitudes[located], latitudes[located])
+    _, box_positions = shapely.STRtree(boxes).query(points, predicate='dwithin', distance=NEAREST_MAX_DEGREES)
+    candidates = bounds['zip_code'].to_numpy(dtype=object)[np.unique(box_positions)]
+
+    chunks = []
+    for start in range(0, len(candidates), LOAD_BATCH_SIZE):
+        batch = list(candidates[start:start + LOAD_BATCH_SIZE])
+        chunks.append(pd.read_sql_query(
+            f"SELECT zip_code, shape FROM zcta_polygons WHERE zip_code IN ({', '.join('?' * len(batch))})",
+            conn, params=batch
+        ))
+    if not chunks:
+        return np.array([], dtype=object), np.array([], dtype=object)
+    # Ordered by ZIP code, so a point on a shared edge goes to the lowest one
+    polygons = pd.concat(chunks, ignore_index=True).sort_values('zip_code', kind='stable')
+    return polygons['zip_code'].to_numpy(dtype=object), shapely.from_wkb(polygons['shape'].to_numpy(), on_invalid='ignore')
+
+def assign_zctas(zip_codes, polygons, latitudes, longitudes, fallback_zips):
+    """ZCTA containing each point, found with one bulk STR-tree query, and the method that found it
+
+    Points inside a polygon get 'polygon', points just off one 'nearest', and
+    the rest (no coordinates, or nowhere near a ZCTA) keep their fallback ZIP
+    with 'zip'
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    zctas = np.array(fallback_zips, dtype=object)
+    methods = np.full(len(zctas), 'zip', dtype=object)
+
+    located = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+    if len(located) == 0 or len(zip_codes) == 0:
+        return zctas, methods
+    tree = shapely.STRtree(polygons)
+    points = shapely.points(longitudes[located], latitudes[located])
+
+    # A point on a shared edge intersects both ZCTAs; sorted by point and then
+    # polygon, the first pair for each point picks the lowest ZIP code
+    point_positions, polygon_positions = tree.query(points, predicate='intersects')
+    order = np.lexsort((polygon_positions, point_positions))
+    point_positions, polygon_positions = point_positions[order], polygon_positions[order]
+    first_pairs = np.unique(point_positions, return_index=True)[1]
+    inside = point_positions[first_pairs]
+    zctas[located[inside]] = zip_codes[polygon_positions[first_pairs]]
+    methods[located[inside]] = 'polygon'
+
+    outside = np.setdiff1d(np.arange(len(located)), inside)
+    if len(outside):
+        near_positions, polygon_positions = tree.query_nearest(
+            points[outside], max_distance=NEAREST_MAX_DEGREES, all_matches=False
+        )
+        zctas[located[outside[near_positions]]] = zip_codes[polygon_positions]
+        methods[located[outside[near_positions]]] = 'nearest'
+    return zctas, methods
+
+def assign_college_zctas(conn, colleges):
+    """zcta and zcta_method for each row of a colleges frame with LATITUDE, LONGITUDE and 5-digit ZIP"""
+    zip_codes, polygons = load_zcta_polygons(conn, colleges['LATITUDE'], colleges['LONGITUDE'])
+    zctas, methods = assign_zctas(zip_codes, polygons, colleges['LATITUDE'], colleges['LONGITUDE'], colleges['ZIP'])
+    return pd.DataFrame({'zcta': zctas, 'zcta_method': methods}, index=colleges.index)